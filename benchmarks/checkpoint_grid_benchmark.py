@@ -0,0 +1,82 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Per-update cost of the crossing test for growing mini-sector layouts: every checkpoint tested by the CrossingEngine
+against only the CheckpointGrid candidates tested with Point.calc_intersection. The timing lines are placed around an
+oval track at a constant spacing, the track grows with the number of lines, and the car drives one lap around it with a
+constant step. The grid cost therefore stays flat while the full test grows with the number of checkpoints.
+
+Run with: python -m benchmarks.checkpoint_grid_benchmark
+"""
+import math
+import timeit
+
+import numpy as np
+
+from time_tracking.time_tracking import Point, Checkpoint
+from time_tracking.crossing_engine import CrossingEngine, CheckpointGrid
+
+CHECKPOINT_COUNTS = (10, 100, 1000, 10000)
+LINE_SPACING = 40
+CAR_STEP = 5
+TRACK_HALF_WIDTH = 30
+SAMPLES = 2000
+
+
+def make_checkpoints(p_count: int) -> list:
+    radius = p_count * LINE_SPACING / (2 * math.pi)
+    checkpoints = []
+    for i in range(p_count):
+        angle = 2 * math.pi * i / p_count
+        cos, sin = math.cos(angle), math.sin(angle)
+        line = {
+            "x1": round(radius + (radius - TRACK_HALF_WIDTH) * cos),
+            "y1": round(radius + (radius - TRACK_HALF_WIDTH) * sin),
+            "x2": round(radius + (radius + TRACK_HALF_WIDTH) * cos),
+            "y2": round(radius + (radius + TRACK_HALF_WIDTH) * sin),
+        }
+        checkpoints.append(Checkpoint(line, i))
+    return checkpoints
+
+
+def make_drive(p_count: int) -> list:
+    """SAMPLES positions with a constant step, starting just after the first line"""
+    radius = p_count * LINE_SPACING / (2 * math.pi)
+    step = CAR_STEP / radius
+    return [
+        Point((radius + radius * math.cos(i * step + 1e-3), radius + radius * math.sin(i * step + 1e-3)))
+        for i in range(SAMPLES + 1)
+    ]
+
+
+def engine_hits(p_engine: CrossingEngine, p_lap: list) -> list:
+    return [np.flatnonzero(p_engine.crossed(start, end)).tolist() for start, end in zip(p_lap[:-1], p_lap[1:])]
+
+
+def grid_hits(p_grid: CheckpointGrid, p_checkpoints: list, p_lap: list) -> list:
+    return [
+        [i for i in p_grid.candidates(start, end) if start.calc_intersection(end, p_checkpoints[i])]
+        for start, end in zip(p_lap[:-1], p_lap[1:])
+    ]
+
+
+def main() -> None:
+    updates = SAMPLES
+    print(f"{'checkpoints':>11} {'engine [us/update]':>19} {'grid [us/update]':>17} {'crossings':>10}")
+    for count in CHECKPOINT_COUNTS:
+        lap = make_drive(count)
+        checkpoints = make_checkpoints(count)
+        engine = CrossingEngine(checkpoints)
+        grid = CheckpointGrid(checkpoints)
+
+        expected = engine_hits(engine, lap)
+        if grid_hits(grid, checkpoints, lap) != expected:
+            raise AssertionError(f"grid candidates miss crossings at {count} checkpoints")
+
+        engine_time = min(timeit.repeat(lambda: engine_hits(engine, lap), number=1, repeat=3)) / updates
+        grid_time = min(timeit.repeat(lambda: grid_hits(grid, checkpoints, lap), number=1, repeat=3)) / updates
+        crossings = sum(len(hits) for hits in expected)
+        print(f"{count:>11} {engine_time * 1e6:>19.1f} {grid_time * 1e6:>17.1f} {crossings:>10}")
+
+
+if __name__ == "__main__":
+    main()
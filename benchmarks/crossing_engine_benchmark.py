@@ -0,0 +1,83 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Microbenchmark of the crossing test: looping Point.calc_intersection over every checkpoint against one
+CrossingEngine.crossed call. Before timing, both are checked to return the same results on random and collinear
+segments.
+
+Run with: python -m benchmarks.crossing_engine_benchmark
+"""
+import random
+import timeit
+
+import numpy as np
+
+
+from time_tracking.time_tracking import Point, Checkpoint
+from time_tracking.crossing_engine import CrossingEngine
+
+CHECKPOINT_COUNTS = (3, 30, 300)
+WIDTH, HEIGHT = 1332, 990
+
+
+def make_checkpoints(p_count: int, p_rng: random.Random) -> list:
+    checkpoints = []
+    for i in range(p_count):
+        line = {
+            "x1": p_rng.randrange(WIDTH),
+            "y1": p_rng.randrange(HEIGHT),
+            "x2": p_rng.randrange(WIDTH),
+            "y2": p_rng.randrange(HEIGHT),
+        }
+        checkpoints.append(Checkpoint(line, i))
+    return checkpoints
+
+
+def make_segments(p_count: int, p_rng: random.Random, p_checkpoints: list) -> list:
+    segments = []
+    for _ in range(p_count):
+        start = (p_rng.randrange(WIDTH), p_rng.randrange(HEIGHT))
+        segments.append((Point(start), Point((start[0] + p_rng.randint(-40, 40), start[1] + p_rng.randint(-40, 40)))))
+    # collinear and degenerate segments lying on the timing lines
+    for checkpoint in p_checkpoints:
+        p1 = Point((checkpoint.get_x1(), checkpoint.get_y1()))
+        p2 = Point((checkpoint.get_x2(), checkpoint.get_y2()))
+        segments.append((p1, p2))
+        segments.append((p1, p1))
+    return segments
+
+
+def loop_crossed(p_checkpoints: list, p_start: Point, p_end: Point) -> list:
+    return [p_start.calc_intersection(p_end, checkpoint) for checkpoint in p_checkpoints]
+
+
+def check_equivalence(p_checkpoints: list, p_engine: CrossingEngine, p_segments: list) -> None:
+    for start, end in p_segments:
+        expected = loop_crossed(p_checkpoints, start, end)
+        actual = p_engine.crossed(start, end).tolist()
+        if expected != actual:
+            raise AssertionError(f"mismatch for segment {start[:]} -> {end[:]}: {expected} != {actual}")
+
+    path = np.array([segment[0][:] for segment in p_segments], dtype=np.float64)
+    expected_path = [loop_crossed(p_checkpoints, Point(start), Point(end)) for start, end in zip(path[:-1], path[1:])]
+    if p_engine.crossed_path(path).tolist() != expected_path:
+        raise AssertionError("crossed_path does not match the per-segment results")
+
+
+def main() -> None:
+    rng = random.Random(0)
+    print(f"{'checkpoints':>11} {'loop [us]':>10} {'engine [us]':>12} {'speedup':>8}")
+    for count in CHECKPOINT_COUNTS:
+        checkpoints = make_checkpoints(count, rng)
+        engine = CrossingEngine(checkpoints)
+        segments = make_segments(200, rng, checkpoints)
+        check_equivalence(checkpoints, engine, segments)
+
+        start, end = segments[0]
+        number = max(20, 20000 // count)
+        loop_time = min(timeit.repeat(lambda: loop_crossed(checkpoints, start, end), number=number, repeat=5)) / number
+        engine_time = min(timeit.repeat(lambda: engine.crossed(start, end), number=number, repeat=5)) / number
+        print(f"{count:>11} {loop_time * 1e6:>10.1f} {engine_time * 1e6:>12.1f} {loop_time / engine_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
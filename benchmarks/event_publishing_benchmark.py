@@ -0,0 +1,71 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Events per second of the former publish path (topic string, json.dumps of a fresh dict, print, encode, send) against
+the pre-encoded EventEncoder templates with JSON and binary payloads. The events are sent on an inproc Pub0 socket
+without subscribers and the console echo goes to os.devnull.
+
+Run with: python -m benchmarks.event_publishing_benchmark
+"""
+import contextlib
+import json
+import os
+import timeit
+
+import numpy as np
+import pynng
+
+from time_tracking.wire_format import EventEncoder
+
+TOPICS = {"lap_finished": "lap_finished", "sector:finished": "sector_finished", "lap_start": "lap_start"}
+BEST_TIMES = np.array([19.48, 9.87, 4.08, 5.53])
+EVENTS = 20000
+
+
+def former_path(p_socket: pynng.Pub0, p_sector: int, p_time: float) -> None:
+    payload = {
+        "current_driver": "anon",
+        "sector_number": p_sector,
+        "sector_time": p_time,
+        "sector_valid": True,
+        "type": "yellow",
+    }
+    msg = TOPICS["sector:finished"] + " " + json.dumps(payload)
+    print(msg)
+    p_socket.send(msg.encode())
+
+
+def encoder_path(p_socket: pynng.Pub0, p_encoder: EventEncoder, p_sector: int, p_time: float) -> None:
+    p_socket.send(p_encoder.sector("anon", p_sector, p_time, True, "yellow"))
+
+
+def fastest_run(p_publish, p_times: list) -> float:
+    """
+    Returns:
+        duration of the fastest of three runs publishing one event per time, in seconds
+    """
+
+    def run() -> None:
+        for time in p_times:
+            p_publish(time)
+
+    return min(timeit.repeat(run, number=1, repeat=3))
+
+
+def main() -> None:
+    times = [round(3.0 + i * 0.01, 2) for i in range(EVENTS)]
+    json_encoder = EventEncoder(TOPICS, 3)
+    binary_encoder = EventEncoder(TOPICS, 3, p_binary=True)
+    with pynng.Pub0(listen="inproc://event_publishing_benchmark") as socket, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            former = fastest_run(lambda t: former_path(socket, 1, t), times)
+        encoded_json = fastest_run(lambda t: encoder_path(socket, json_encoder, 1, t), times)
+        encoded_binary = fastest_run(lambda t: encoder_path(socket, binary_encoder, 1, t), times)
+
+    print(f"{'path':>26} {'events/s':>10}")
+    print(f"{'json.dumps + print':>26} {EVENTS / former:>10.0f}")
+    print(f"{'EventEncoder json':>26} {EVENTS / encoded_json:>10.0f}")
+    print(f"{'EventEncoder binary':>26} {EVENTS / encoded_binary:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
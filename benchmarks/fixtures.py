@@ -0,0 +1,56 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Working directory fixture of the benchmarks and tests that run a LapTimer: its configuration, with socket addresses of
+its own, and its checkpoints.
+"""
+import json
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+TEMPLATE_PATH = BASE_DIR / "time_tracking/templates/time_tracking_config.json"
+# three vertical timing lines next to each other, for runs where the layout does not matter
+THREE_LINES = {
+    "checkpoints": [
+        {"x1": 100, "y1": 0, "x2": 100, "y2": 100},
+        {"x1": 200, "y1": 0, "x2": 200, "y2": 100},
+        {"x1": 300, "y1": 0, "x2": 300, "y2": 100},
+    ]
+}
+
+
+def write_config(
+    p_dir: Path,
+    p_checkpoints: dict = THREE_LINES,
+    p_transport: str = "ipc",
+    p_publish_frames: bool = False,
+    p_frame_shape: tuple | None = None,
+) -> dict:
+    """
+    writes time_tracking_config.json and time_tracking.json into the directory the LapTimer is run in. Every socket
+    gets an address of its own, so the run neither disturbs nor receives from a time tracking running on the same
+    host, the best times are requested only once and cached inside the directory.
+    Args:
+        p_dir: working directory of the LapTimer
+        p_checkpoints: content of time_tracking.json
+        p_transport: "ipc" for socket files in p_dir, usable across processes, or "inproc" for a LapTimer fed from the
+            same process
+        p_publish_frames: receive frames and publish the overlay
+        p_frame_shape: shape of the raw frames received, the one of the template if None
+    Returns:
+        the written configuration
+    """
+    config = json.loads(TEMPLATE_PATH.read_text())
+    for group in config["pynng"].values():
+        for name, socket_config in group.items():
+            if p_transport == "inproc":
+                socket_config["address"] = f"inproc://{p_dir.name}_{name.strip('_')}"
+            else:
+                socket_config["address"] = f"ipc://{p_dir}/{name.strip('_')}.ipc"
+    config["pynng"]["publishers"]["__pub_frame"]["enabled"] = p_publish_frames
+    if p_frame_shape is not None:
+        config["pynng"]["subscribers"]["__sub_frame"]["raw_shape"] = list(p_frame_shape)
+    config["pynng"]["requesters"]["best_times"]["max_attempts"] = 1
+    config["best_times_cache"]["path"] = str(p_dir / "best_times_cache.json")
+    (p_dir / "time_tracking_config.json").write_text(json.dumps(config, indent=4))
+    (p_dir / "time_tracking.json").write_text(json.dumps(p_checkpoints))
+    return config
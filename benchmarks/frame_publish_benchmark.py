@@ -0,0 +1,83 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Time the draw loop spends per published frame for every frame encoding of the FramePublisher, next to the time of
+encoding the same frame inline with cv2.imencode. The frames are sent on an inproc Pub0 socket with one subscriber that
+checks the last received frame decodes to the published size.
+
+Run with: python -m benchmarks.frame_publish_benchmark
+"""
+import time
+
+import cv2
+import numpy as np
+import pynng
+
+from time_tracking.frame_pipeline import FrameBuffer, FramePublisher
+
+FRAME_SHAPE = (990, 1332, 3)
+FRAMES = 100
+ADDRESS = "inproc://frame_publish_benchmark"
+
+
+def synthetic_frame() -> bytes:
+    # gradient with some noise, compresses roughly like a camera image
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[: FRAME_SHAPE[0], : FRAME_SHAPE[1]]
+    frame = np.stack([x % 256, y % 256, (x + y) % 256], axis=2).astype(np.int16)
+    frame += rng.integers(-8, 8, FRAME_SHAPE, dtype=np.int16)
+    return np.clip(frame, 0, 255).astype(np.uint8).tobytes()
+
+
+def measure(p_encoding: str, p_received: bytes) -> None:
+    buffer = FrameBuffer(FRAME_SHAPE)
+    buffer.load(p_received)
+    with pynng.Pub0(listen=ADDRESS) as pub, pynng.Sub0(dial=ADDRESS, recv_timeout=1000) as sub:
+        sub.subscribe(b"")
+        publisher = FramePublisher(pub, p_encoding, 80)
+        start = time.perf_counter()
+        for _ in range(FRAMES):
+            publisher.publish(buffer)
+        loop = (time.perf_counter() - start) / FRAMES
+        last = None
+        while publisher.get_published_frames() + publisher.get_dropped_frames() < FRAMES:
+            time.sleep(0.001)
+        while True:
+            try:
+                last = sub.recv(block=False)
+            except pynng.TryAgain:
+                break
+        publisher.close()
+
+    assert last is not None, "no frame received"
+    if p_encoding == "raw":
+        shape = np.frombuffer(last, dtype=np.uint8).reshape(FRAME_SHAPE).shape
+    else:
+        decoded = cv2.imdecode(np.frombuffer(last, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert decoded is not None, "received frame does not decode"
+        shape = decoded.shape
+    assert shape == FRAME_SHAPE, shape
+    print(
+        f"{p_encoding:>5}: {loop * 1e3:7.3f} ms per frame in the draw loop, "
+        f"{publisher.get_published_frames():3d} published, {publisher.get_dropped_frames():3d} replaced, "
+        f"{len(last) / 1024:7.1f} KiB per frame"
+    )
+
+
+def inline(p_extension: str, p_received: bytes) -> None:
+    frame = np.frombuffer(p_received, dtype=np.uint8).reshape(FRAME_SHAPE)
+    start = time.perf_counter()
+    for _ in range(10):
+        cv2.imencode(p_extension, frame, [cv2.IMWRITE_JPEG_QUALITY, 80] if p_extension == ".jpg" else [])
+    print(f"inline {p_extension}: {(time.perf_counter() - start) / 10 * 1e3:7.3f} ms per frame")
+
+
+def main() -> None:
+    received = synthetic_frame()
+    for encoding in ("raw", "jpeg", "png"):
+        measure(encoding, received)
+    inline(".jpg", received)
+    inline(".png", received)
+
+
+if __name__ == "__main__":
+    main()
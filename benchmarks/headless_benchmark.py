@@ -0,0 +1,141 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Startup time and loop latency of the LapTimer with and without headless mode. Every mode runs in its own process in a
+temporary working directory with three timing lines and ipc addresses of its own:
+
+- headless:  --headless and overlay publishing disabled, no frames are received and cv2 is never imported
+- overlay:   --headless with overlay publishing, raw frames are received at 30 fps, drawn on and published
+- window:    overlay publishing and the debug window, skipped if the installed OpenCV has no GUI support
+
+Startup is the time from importing time_tracking to the constructed LapTimer. The loop latency is the time from sending
+a binary coordinate, stamped with time.monotonic_ns(), until process_coordinates has handled it. The frame governor
+counters of LapTimer.get_metrics are printed for the modes that receive frames.
+
+Run with: python -m benchmarks.headless_benchmark
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pynng
+
+from benchmarks.fixtures import BASE_DIR, write_config
+
+MODES = ("headless", "overlay", "window")
+FRAME_SHAPE = (990, 1332, 3)
+COORDINATES = 300
+COORDINATE_INTERVAL = 0.01
+FRAME_INTERVAL = 1 / 30
+
+
+def child(p_mode: str) -> None:
+    config = json.loads(Path("time_tracking_config.json").read_text())
+    subscribers = config["pynng"]["subscribers"]
+    if p_mode == "window":
+        import cv2
+
+        try:
+            cv2.namedWindow("Debug")
+        except cv2.error:
+            print(json.dumps({"mode": p_mode, "skipped": "OpenCV without GUI support"}))
+            return
+
+    coordinate_pub = pynng.Pub0(listen=subscribers["__sub_coordinates"]["address"])
+    frame_pub = pynng.Pub0(listen=subscribers["__sub_frame"]["address"])
+
+    start = time.perf_counter()
+    from time_tracking.time_tracking import LapTimer
+    from time_tracking.wire_format import encode_binary_coordinates
+
+    latencies = []
+
+    class ProbeTimer(LapTimer):
+        def process_coordinates(self, p_coordinates, p_receive_time_ns=None) -> None:
+            super().process_coordinates(p_coordinates, p_receive_time_ns)
+            latencies.append(time.monotonic_ns() - p_coordinates[2])
+
+    timer = ProbeTimer(p_headless=p_mode != "window")
+    startup = time.perf_counter() - start
+    cv2_loaded = "cv2" in sys.modules
+    timer.start_timer()
+
+    def loop() -> None:
+        while True:
+            timer.run()
+
+    def feed_frames() -> None:
+        frame = np.full(FRAME_SHAPE, 64, dtype=np.uint8).tobytes()
+        while True:
+            frame_pub.send(frame)
+            time.sleep(FRAME_INTERVAL)
+
+    threading.Thread(target=loop, daemon=True).start()
+    if timer.has_visualisation():
+        threading.Thread(target=feed_frames, daemon=True).start()
+    time.sleep(0.5)
+
+    topic = subscribers["__sub_coordinates"]["topics"]["pixel_coordinates"]
+    for i in range(COORDINATES):
+        x = 50 + (i * 7) % 300
+        coordinate_pub.send(encode_binary_coordinates(topic, 0, x, 50.0, time.monotonic_ns()))
+        time.sleep(COORDINATE_INTERVAL)
+    time.sleep(0.2)
+
+    latency = np.array(latencies) / 1e3
+    print(
+        json.dumps(
+            {
+                "mode": p_mode,
+                "startup_ms": startup * 1e3,
+                "cv2_loaded": cv2_loaded,
+                "samples": len(latency),
+                "p50_us": float(np.percentile(latency, 50)),
+                "p99_us": float(np.percentile(latency, 99)),
+                "metrics": timer.get_metrics(),
+            }
+        )
+    )
+
+
+def main() -> None:
+    for mode in MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            write_config(Path(tmp), p_publish_frames=mode != "headless", p_frame_shape=FRAME_SHAPE)
+            env = dict(os.environ, PYTHONPATH=str(BASE_DIR))
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.headless_benchmark", "--child", mode],
+                cwd=tmp,
+                env=env,
+                capture_output=True,
+                text=True,
+                timeout=60,
+            )
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+        if "skipped" in result:
+            print(f"{mode:>8}: skipped, {result['skipped']}")
+            continue
+        print(
+            f"{mode:>8}: startup {result['startup_ms']:7.1f} ms, cv2 loaded: {str(result['cv2_loaded']):5}, "
+            f"coordinate latency p50 {result['p50_us']:7.1f} us, p99 {result['p99_us']:8.1f} us "
+            f"({result['samples']} coordinates)"
+        )
+        metrics = result["metrics"]
+        if "frames_drawn" in metrics:
+            print(
+                f"{'':>10}frames drawn {metrics['frames_drawn']}, skipped for the frame rate "
+                f"{metrics['frames_skipped_rate']}, skipped for coordinate lag {metrics['frames_skipped_lag']}, "
+                f"draw time {metrics['draw_time_ms']:.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        child(sys.argv[2])
+    else:
+        main()
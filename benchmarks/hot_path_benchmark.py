@@ -0,0 +1,236 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Benchmark suite of the timing hot path: Point.calc_intersection, LapTimer.checkpoint_check, calc_type, send_data,
+__read_new_frame and publish_frame, driven with a synthetic trajectory and synthetic frames. The LapTimer runs in a
+temporary working directory whose configuration points every socket at an inproc:// address, so the messages are fed
+from this process and no other module has to run.
+
+Every operation is timed call by call with time.perf_counter_ns after a warm-up, in several rounds of which the one
+with the lowest median is kept, like timeit keeps the fastest repetition. The report shows the latency percentiles and
+the throughput (calls per second over the timed calls). With --check the p50 latency and the throughput
+are compared with the baselines in hot_path_baselines.json and the run fails if an operation is slower by more than
+the tolerance; --update stores the results of the run as the new baselines. Baselines depend on the machine, update
+them on the machine the check runs on.
+
+Run with: python -m benchmarks.hot_path_benchmark [--check | --update] [--tolerance 0.5]
+      or: tox -e bench
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pynng
+
+from benchmarks.fixtures import write_config
+from time_tracking.wire_format import encode_binary_coordinates, encode_frame_header
+
+BASELINE_PATH = Path(__file__).parent / "hot_path_baselines.json"
+CHECKPOINTS = {
+    "checkpoints": [
+        {"x1": 300, "y1": 100, "x2": 300, "y2": 400},
+        {"x1": 800, "y1": 100, "x2": 800, "y2": 400},
+        {"x1": 1000, "y1": 500, "x2": 1300, "y2": 500},
+        {"x1": 500, "y1": 600, "x2": 500, "y2": 900},
+    ]
+}
+FRAME_SHAPE = (990, 1332, 3)
+WARMUP = 100
+ROUNDS = 3
+ITERATIONS = {
+    "calc_intersection": 20000,
+    "checkpoint_check": 5000,
+    "calc_type": 20000,
+    "send_data": 20000,
+    "read_new_frame": 300,
+    "publish_frame": 300,
+}
+PERCENTILES = (50, 90, 99)
+# the trajectory is sampled like the vehicle tracking at 100 Hz
+SAMPLE_INTERVAL_NS = 10_000_000
+
+
+def trajectory(p_count: int) -> np.ndarray:
+    """
+    Returns:
+        (p_count, 2) positions on an ellipse through all timing lines, one lap every 300 samples, with tracking noise
+    """
+    rng = np.random.default_rng(7)
+    angles = np.arange(p_count) * 2 * np.pi / 300
+    positions = np.stack([666 + 450 * np.cos(angles), 495 + 300 * np.sin(angles)], axis=1)
+    return positions + rng.normal(0, 1.5, positions.shape)
+
+
+def measure(p_iterations: int, p_setup, p_operation) -> np.ndarray:
+    """
+    Args:
+        p_iterations: number of timed calls
+        p_setup: called with the iteration number before every call, not timed
+        p_operation: called with the iteration number, timed
+    Returns:
+        latency of every timed call of the round with the lowest median in nanoseconds
+    """
+    for i in range(WARMUP):
+        p_setup(i)
+        p_operation(i)
+    best = np.empty(0, dtype=np.int64)
+    clock = time.perf_counter_ns
+    for _ in range(ROUNDS):
+        latencies = np.empty(p_iterations, dtype=np.int64)
+        for i in range(p_iterations):
+            p_setup(i)
+            start = clock()
+            p_operation(i)
+            latencies[i] = clock() - start
+        if len(best) == 0 or np.median(latencies) < np.median(best):
+            best = latencies
+    return best
+
+
+def run_suite() -> dict:
+    """
+    Returns:
+        dict operation -> latency of every timed call in nanoseconds
+    """
+    from time_tracking.clock import NS_PER_SECOND, VirtualClock
+    from time_tracking.time_tracking import LapTimer, Point, Checkpoint
+
+    config = json.loads(Path("time_tracking_config.json").read_text())
+    subscribers = config["pynng"]["subscribers"]
+    coordinate_pub = pynng.Pub0(listen=subscribers["__sub_coordinates"]["address"])
+    frame_pub = pynng.Pub0(listen=subscribers["__sub_frame"]["address"])
+    # the coordinates carry capture timestamps of this clock, every sample is received the instant it was captured
+    clock = VirtualClock(1_000 * NS_PER_SECOND)
+    timer = LapTimer(p_async=True, p_clock=clock, p_headless=True)
+    timer.start_timer()
+    # inproc dials complete in the background, wait until the timer is connected
+    while not (coordinate_pub.pipes and frame_pub.pipes):
+        time.sleep(0.01)
+
+    results = {}
+    no_setup = lambda i: None  # noqa: E731
+
+    positions = trajectory(max(ITERATIONS.values()) + WARMUP + 1)
+    assert len(positions) >= WARMUP + ROUNDS * ITERATIONS["checkpoint_check"]
+    points = [Point((x, y)) for x, y in positions]
+    checkpoints = [Checkpoint(line, i) for i, line in enumerate(CHECKPOINTS["checkpoints"])]
+    results["calc_intersection"] = measure(
+        ITERATIONS["calc_intersection"],
+        no_setup,
+        lambda i: points[i].calc_intersection(points[i + 1], checkpoints[i % len(checkpoints)]),
+    )
+
+    topic = subscribers["__sub_coordinates"]["topics"]["pixel_coordinates"]
+    # the warm-up and every round restart the iteration number, the car keeps driving and time keeps running
+    samples = itertools.count()
+    capture_times = clock.now_ns() + np.arange(1, len(positions) + 1) * SAMPLE_INTERVAL_NS
+    coordinate_messages = [
+        encode_binary_coordinates(topic, 0, x, y, int(capture_time))
+        for (x, y), capture_time in zip(positions, capture_times)
+    ]
+
+    def send_coordinates(p_iteration: int) -> None:
+        sample = next(samples)
+        clock.set_ns(int(capture_times[sample]))
+        coordinate_pub.send(coordinate_messages[sample])
+
+    results["checkpoint_check"] = measure(
+        ITERATIONS["checkpoint_check"], send_coordinates, lambda i: timer.checkpoint_check()
+    )
+    # a rejected capture timestamp would time the fallback to the receive time instead of the interpolation
+    assert not getattr(timer, "_LapTimer__timestamp_rejected"), "the LapTimer rejected the capture timestamps"
+
+    rng = np.random.default_rng(11)
+    sector_times = rng.uniform(2.0, 12.0, ITERATIONS["calc_type"] + WARMUP)
+    sectors = len(CHECKPOINTS["checkpoints"])
+    results["calc_type"] = measure(
+        ITERATIONS["calc_type"],
+        no_setup,
+        lambda i: timer.calc_type(float(sector_times[i]), i % sectors, i % 7 != 0),
+    )
+
+    topic = config["pynng"]["publishers"]["__pub_time"]["topics"]["sector:finished"]
+    payload = {"current_driver": "anon", "sector_number": 2, "sector_time": 4.27, "sector_valid": True, "type": "green"}
+    results["send_data"] = measure(ITERATIONS["send_data"], no_setup, lambda i: timer.send_data(payload, topic))
+
+    frames = [
+        encode_frame_header(FRAME_SHAPE, "uint8", i, 0) + np.full(FRAME_SHAPE, i, np.uint8).tobytes() for i in (0, 1)
+    ]
+    # name mangled, __read_new_frame is the blocking frame receive of draw()
+    read_new_frame = getattr(timer, "_LapTimer__read_new_frame")
+    results["read_new_frame"] = measure(
+        ITERATIONS["read_new_frame"], lambda i: frame_pub.send(frames[i % 2]), lambda i: read_new_frame()
+    )
+    results["publish_frame"] = measure(ITERATIONS["publish_frame"], no_setup, lambda i: timer.publish_frame())
+
+    timer.stop()
+    return results
+
+
+def summarize(p_latencies: np.ndarray) -> dict:
+    summary = {f"p{percentile}_us": float(np.percentile(p_latencies, percentile)) / 1e3 for percentile in PERCENTILES}
+    summary["ops_per_s"] = len(p_latencies) / (p_latencies.sum() / 1e9)
+    return summary
+
+
+def check(p_summaries: dict, p_baselines: dict, p_tolerance: float) -> list:
+    """
+    Returns:
+        descriptions of the operations that are slower than their baseline by more than the tolerance
+    """
+    regressions = []
+    for name, summary in p_summaries.items():
+        baseline = p_baselines.get(name)
+        if baseline is None:
+            continue
+        if summary["p50_us"] > baseline["p50_us"] * (1 + p_tolerance):
+            regressions.append(f"{name}: p50 {summary['p50_us']:.2f} us, baseline {baseline['p50_us']:.2f} us")
+        if summary["ops_per_s"] < baseline["ops_per_s"] / (1 + p_tolerance):
+            regressions.append(f"{name}: {summary['ops_per_s']:.0f} ops/s, baseline {baseline['ops_per_s']:.0f} ops/s")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark suite of the timing hot path")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--check", action="store_true", help="fail on regressions against the stored baselines")
+    mode.add_argument("--update", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown, 0.5 allows 50 percent")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        write_config(Path(tmp), CHECKPOINTS, p_transport="inproc", p_publish_frames=True)
+        os.chdir(tmp)
+        try:
+            results = run_suite()
+        finally:
+            os.chdir(cwd)
+
+    summaries = {name: summarize(latencies) for name, latencies in results.items()}
+    for name, summary in summaries.items():
+        percentiles = "  ".join(f"p{percentile} {summary[f'p{percentile}_us']:9.2f} us" for percentile in PERCENTILES)
+        print(f"{name:>18}: {percentiles}  {summary['ops_per_s']:12,.0f} ops/s  ({len(results[name])} calls)")
+
+    if args.update:
+        baselines = {
+            name: {key: round(value, 2) for key, value in summary.items()} for name, summary in summaries.items()
+        }
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=4) + "\n")
+        print(f"baselines stored in {BASELINE_PATH}")
+    elif args.check:
+        regressions = check(summaries, json.loads(BASELINE_PATH.read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regression beyond {args.tolerance:.0%} of the baselines")
+
+
+if __name__ == "__main__":
+    main()
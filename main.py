@@ -1,9 +1,41 @@
 # Copyright (C) 2022 NG:ITL
+import asyncio
+import logging
+import argparse
+
 from time_tracking.time_tracking import LapTimer
 
+
+def main(p_batch: bool = False, p_headless: bool = False) -> None:
+    timer = LapTimer(p_batch=p_batch, p_headless=p_headless)
+    timer.start_timer()
+    try:
+        while True:
+            timer.run()
+    finally:
+        timer.stop()
+
+
+async def main_async(p_batch: bool = False, p_headless: bool = False) -> None:
+    timer = LapTimer(p_async=True, p_batch=p_batch, p_headless=p_headless)
+    timer.start_timer()
+    try:
+        await timer.arun()
+    finally:
+        timer.stop()
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAAI time tracking")
+    parser.add_argument("--asyncio", action="store_true", help="run all receivers on one asyncio event loop")
+    parser.add_argument("--batch", action="store_true", help="drain all pending coordinates and time them in bulk")
+    parser.add_argument("--headless", action="store_true", help="do not open the debug window")
+    parser.add_argument("--debug", action="store_true", help="echo every published event on the console")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
     print("Time-tracking started")
-    timer = LapTimer()
-    timer.start_timer()
-    while True:
-        timer.run()
+    if args.asyncio:
+        asyncio.run(main_async(args.batch, args.headless))
+    else:
+        main(args.batch, args.headless)
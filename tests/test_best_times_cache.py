@@ -0,0 +1,180 @@
+# Copyright (C) 2023, NG:ITL
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from benchmarks.fixtures import write_config
+from time_tracking.best_times import BEST_TIMES_CACHE_VERSION, BestTimesCache
+from time_tracking.clock import NS_PER_SECOND, VirtualClock
+from time_tracking.time_tracking import BEST_TIMES_SAVE_NS, LapTimer
+
+START_NS = 1_000 * NS_PER_SECOND
+HOUR_S = 3600
+
+
+class CacheSaveTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_path = Path(write_config(Path(self.tmp.name), p_transport="inproc")["best_times_cache"]["path"])
+        os.chdir(self.tmp.name)
+        self.clock = VirtualClock(START_NS)
+        self.timer = LapTimer(p_async=True, p_clock=self.clock, p_headless=True)
+
+    def tearDown(self) -> None:
+        self.timer.stop()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def cached_sector_time(self) -> float:
+        return json.loads(self.cache_path.read_text())["all_time"]["times"]["sector_1_best_time"]
+
+    def wait_for_the_writer(self) -> None:
+        self.timer._LapTimer__best_times_cache.close()  # type: ignore[attr-defined]
+
+    def test_records_are_saved_at_most_once_per_interval(self) -> None:
+        self.timer.send_sector(1, 3.0, True)
+        self.timer.send_sector(1, 2.0, True)
+        self.assertFalse(self.cache_path.exists())
+        self.clock.advance_ns(BEST_TIMES_SAVE_NS)
+        self.timer.run_scheduled(self.clock.now_ns())
+        self.wait_for_the_writer()
+        self.assertEqual(self.cached_sector_time(), 2.0)
+        modified = self.cache_path.stat().st_mtime_ns
+        self.clock.advance_ns(BEST_TIMES_SAVE_NS)
+        self.timer.run_scheduled(self.clock.now_ns())
+        self.wait_for_the_writer()
+        self.assertEqual(self.cache_path.stat().st_mtime_ns, modified)
+
+    def test_the_timing_loop_does_not_write(self) -> None:
+        writers = []
+        cache = self.timer._LapTimer__best_times_cache  # type: ignore[attr-defined]
+        write = cache._BestTimesCache__write
+
+        def record_writer(p_data: dict) -> None:
+            writers.append(threading.current_thread())
+            write(p_data)
+
+        cache._BestTimesCache__write = record_writer
+        self.timer.send_sector(1, 2.0, True)
+        self.clock.advance_ns(BEST_TIMES_SAVE_NS)
+        self.timer.run_scheduled(self.clock.now_ns())
+        self.wait_for_the_writer()
+        self.assertEqual(len(writers), 1)
+        self.assertIsNot(writers[0], threading.current_thread())
+        self.assertEqual(self.cached_sector_time(), 2.0)
+
+    def test_stop_saves_the_pending_records(self) -> None:
+        self.timer.send_sector(1, 2.5, True)
+        self.timer.stop()
+        self.assertEqual(self.cached_sector_time(), 2.5)
+
+
+class BestTimesCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.tmp.name) / "best_times_cache.json")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def write_cache(self, p_layout: str, p_all_time: dict, p_drivers: dict | None = None) -> None:
+        """
+        Args:
+            p_all_time: key -> (time, hours since the time was set)
+        """
+        Path(self.path).write_text(json.dumps(self.cache_data(p_layout, p_all_time, p_drivers or {})))
+
+    @staticmethod
+    def entry(p_times: dict) -> dict:
+        now = time.time()
+        return {
+            "times": {key: value for key, (value, _) in p_times.items()},
+            "updated": {key: now - age_hours * HOUR_S for key, (_, age_hours) in p_times.items()},
+        }
+
+    def cache_data(self, p_layout: str, p_all_time: dict, p_drivers: dict) -> dict:
+        return {
+            "version": BEST_TIMES_CACHE_VERSION,
+            "layout": p_layout,
+            "all_time": self.entry(p_all_time),
+            "drivers": {driver: self.entry(times) for driver, times in p_drivers.items()},
+        }
+
+    def saved(self, p_cache: BestTimesCache) -> dict:
+        p_cache.save_in_background()
+        p_cache.close()
+        return json.loads(Path(self.path).read_text())
+
+    def test_stale_times_expire(self) -> None:
+        self.write_cache(
+            "a",
+            {"best_lap_time": (30.0, 3), "sector_1_best_time": (10.0, 1)},
+            {"Max": {"best_lap_time": (31.0, 3)}, "Eva": {"best_lap_time": (32.0, 1)}},
+        )
+        cache = BestTimesCache(self.path, 2, "a")
+        self.assertEqual(cache.all_time_best(), {"sector_1_best_time": 10.0})
+        self.assertIsNone(cache.driver_best("Max"))
+        self.assertEqual(cache.driver_best("Eva"), {"best_lap_time": 32.0})
+        self.assertEqual(BestTimesCache(self.path, 0, "a").driver_best("Max"), {"best_lap_time": 31.0})
+
+    def test_new_record_does_not_refresh_the_other_times(self) -> None:
+        self.write_cache("a", {"best_lap_time": (30.0, 1.5), "sector_1_best_time": (10.0, 1.5)})
+        cache = BestTimesCache(self.path, 2, "a")
+        cache.update_all_time({"sector_1_best_time": 9.0})
+        updated = self.saved(cache)["all_time"]["updated"]
+        self.assertGreater(updated["sector_1_best_time"] - updated["best_lap_time"], HOUR_S)
+
+    def test_cache_of_another_layout_is_discarded(self) -> None:
+        self.write_cache("a", {"best_lap_time": (30.0, 0)}, {"Max": {"best_lap_time": (31.0, 0)}})
+        cache = BestTimesCache(self.path, 0, "b")
+        self.assertIsNone(cache.all_time_best())
+        self.assertIsNone(cache.driver_best("Max"))
+        self.assertEqual(self.saved(cache)["layout"], "b")
+
+    def test_cache_of_another_version_is_discarded(self) -> None:
+        data = self.cache_data("a", {"best_lap_time": (30.0, 0)}, {})
+        data["version"] = BEST_TIMES_CACHE_VERSION - 1
+        Path(self.path).write_text(json.dumps(data))
+        self.assertIsNone(BestTimesCache(self.path, 0, "a").all_time_best())
+
+    def test_set_layout_drops_the_entries(self) -> None:
+        self.write_cache("a", {"best_lap_time": (30.0, 0)}, {"Max": {"best_lap_time": (31.0, 0)}})
+        cache = BestTimesCache(self.path, 0, "a")
+        cache.set_layout("a")
+        self.assertEqual(cache.all_time_best(), {"best_lap_time": 30.0})
+        cache.set_layout("b")
+        self.assertIsNone(cache.all_time_best())
+        self.assertIsNone(cache.driver_best("Max"))
+
+    def test_reconcile_keeps_the_faster_time(self) -> None:
+        self.write_cache(
+            "a",
+            {"best_lap_time": (29.0, 1), "sector_1_best_time": (11.0, 1), "sector_2_best_time": (9.0, 3)},
+        )
+        cache = BestTimesCache(self.path, 2, "a")
+        database = {"best_lap_time": 30.0, "sector_1_best_time": 10.0, "sector_2_best_time": 9.5}
+        merged = cache.reconcile(database)
+        # the stale sector 2 time loses against the slower database time
+        self.assertEqual(merged, {"best_lap_time": 29.0, "sector_1_best_time": 10.0, "sector_2_best_time": 9.5})
+        self.assertEqual(cache.all_time_best(), merged)
+
+    def test_reconcile_refreshes_only_the_database_times(self) -> None:
+        self.write_cache("a", {"best_lap_time": (29.0, 1.5), "sector_1_best_time": (10.0, 1.5)})
+        cache = BestTimesCache(self.path, 2, "a")
+        cache.reconcile({"best_lap_time": 30.0, "sector_1_best_time": 10.0})
+        updated = self.saved(cache)["all_time"]["updated"]
+        # the database confirmed sector 1, the faster cached lap time keeps its age
+        self.assertLess(time.time() - updated["sector_1_best_time"], HOUR_S)
+        self.assertGreater(time.time() - updated["best_lap_time"], HOUR_S)
+        # once it is stale the database time is used
+        cache = BestTimesCache(self.path, 1, "a")
+        self.assertEqual(cache.reconcile({"best_lap_time": 30.0})["best_lap_time"], 30.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+# Copyright (C) 2023, NG:ITL
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import pynng
+
+from benchmarks.fixtures import write_config
+from time_tracking.clock import NS_PER_SECOND, VirtualClock
+from time_tracking.time_tracking import LapTimer, SCHEDULER_TICK_MS
+from time_tracking.wire_format import encode_binary_coordinates
+
+NOW_NS = 1_000 * NS_PER_SECOND
+
+
+class DecodeCoordinatesTest(unittest.TestCase):
+    def test_binary(self) -> None:
+        msg = encode_binary_coordinates("pixel_coordinates", 0, 1.5, 2.5, NOW_NS)
+        self.assertEqual(LapTimer.decode_coordinates(msg), (1.5, 2.5, NOW_NS))
+
+    def test_json_list_has_no_timestamp(self) -> None:
+        self.assertEqual(LapTimer.decode_coordinates(b"pixel_coordinates [1.5, 2.5]"), (1.5, 2.5))
+        self.assertEqual(LapTimer.decode_coordinates(b"pixel_coordinates [1.5, 2.5, 17]"), (1.5, 2.5))
+
+    def test_json_object(self) -> None:
+        msg = f'pixel_coordinates {{"x": 1.5, "y": 2.5, "timestamp_ns": {NOW_NS}}}'.encode()
+        self.assertEqual(LapTimer.decode_coordinates(msg), (1.5, 2.5, NOW_NS))
+        self.assertEqual(LapTimer.decode_coordinates(b'pixel_coordinates {"x": 1.5, "y": 2.5}'), (1.5, 2.5))
+
+
+class CaptureTimestampTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        write_config(Path(self.tmp.name), p_transport="inproc")
+        os.chdir(self.tmp.name)
+        self.timer = LapTimer(p_async=True, p_clock=VirtualClock(NOW_NS), p_headless=True)
+
+    def tearDown(self) -> None:
+        self.timer.stop()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def timed(self, p_coordinates: tuple) -> tuple:
+        return self.timer._LapTimer__timed_coordinates(p_coordinates, NOW_NS)  # type: ignore[attr-defined]
+
+    def test_capture_timestamp_close_to_the_receive_time(self) -> None:
+        self.assertEqual(self.timed((1.5, 2.5, NOW_NS - 2_000_000)), (1.5, 2.5, NOW_NS - 2_000_000))
+
+    def test_without_capture_timestamp(self) -> None:
+        self.assertEqual(self.timed((1.5, 2.5)), (1.5, 2.5, NOW_NS))
+
+    def test_implausible_timestamps_are_rejected_once(self) -> None:
+        with self.assertLogs("time_tracking.time_tracking", "WARNING") as logs:
+            self.assertEqual(self.timed((1.5, 2.5, 17)), (1.5, 2.5, NOW_NS))
+            self.assertEqual(self.timed((1.5, 2.5, NOW_NS + 5 * NS_PER_SECOND)), (1.5, 2.5, NOW_NS))
+            self.assertEqual(self.timed((1.5, 2.5, float(NOW_NS))), (1.5, 2.5, NOW_NS))
+        self.assertEqual(len(logs.records), 1)
+
+
+class ReceiveCoordinatesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = write_config(Path(self.tmp.name), p_transport="inproc")
+        os.chdir(self.tmp.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_blocks_past_the_scheduler_tick(self) -> None:
+        subscriber_config = self.config["pynng"]["subscribers"]["__sub_coordinates"]
+        topic = subscriber_config["topics"]["pixel_coordinates"]
+        done = threading.Event()
+        with pynng.Pub0(listen=subscriber_config["address"]) as publisher:
+            timer = LapTimer(p_async=True, p_headless=True)
+
+            def publish_late() -> None:
+                # first coordinates after three scheduler ticks, repeated until received as Pub/Sub drops messages
+                # sent before the subscriber is connected
+                done.wait(3 * SCHEDULER_TICK_MS / 1000)
+                while not done.is_set():
+                    publisher.send(f"{topic} [1.5, 2.5]".encode())
+                    done.wait(0.05)
+
+            thread = threading.Thread(target=publish_late, daemon=True)
+            start = time.monotonic()
+            thread.start()
+            try:
+                self.assertEqual(timer.receive_coordinates(), (1.5, 2.5))
+            finally:
+                done.set()
+                thread.join()
+                timer.stop()
+        self.assertGreaterEqual(time.monotonic() - start, 3 * SCHEDULER_TICK_MS / 1000)
+
+
+class TickingClock(VirtualClock):
+    """
+    VirtualClock that moves on by a millisecond every time it is read, so processing takes time
+    """
+
+    def now_ns(self) -> int:
+        self.advance_ns(1_000_000)
+        return super().now_ns()
+
+
+class CoordinateLagTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        write_config(Path(self.tmp.name), p_transport="inproc")
+        os.chdir(self.tmp.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def lag_ms(self, p_timer: LapTimer) -> float:
+        return p_timer.get_metrics()["coordinate_lag_ms"]
+
+    def test_lag_is_measured_from_the_receive_time(self) -> None:
+        clock = TickingClock(NOW_NS)
+        timer = LapTimer(p_async=True, p_clock=clock, p_headless=True)
+        receive_ns = clock.now_ns()
+        # captured 500 ms before it was received, the latency of the vehicle tracking is not part of the lag
+        msg = encode_binary_coordinates("pixel_coordinates", 0, 1.5, 2.5, receive_ns - NS_PER_SECOND // 2)
+        timer.handle_coordinate_message(msg, receive_ns)
+        self.assertGreater(self.lag_ms(timer), 0)
+        self.assertLess(self.lag_ms(timer), 20)
+        timer.stop()
+
+    def test_batch_lag_is_measured_from_the_first_message(self) -> None:
+        clock = TickingClock(NOW_NS)
+        timer = LapTimer(p_async=True, p_batch=True, p_clock=clock, p_headless=True)
+        receive_ns = clock.now_ns() - 30_000_000
+        timer.handle_coordinate_message(
+            encode_binary_coordinates("pixel_coordinates", 0, 1.5, 2.5, receive_ns), receive_ns
+        )
+        self.assertGreaterEqual(self.lag_ms(timer), 30)
+        timer.stop()
+
+    def test_lag_is_reset_while_the_socket_is_idle(self) -> None:
+        clock = TickingClock(NOW_NS)
+        timer = LapTimer(p_async=True, p_clock=clock, p_headless=True)
+        timer.handle_coordinate_message(b"pixel_coordinates [1.5, 2.5]", clock.now_ns() - 50_000_000)
+        self.assertGreaterEqual(self.lag_ms(timer), 50)
+        # nothing is published on the coordinate socket, the receive times out after a scheduler tick
+        timer.checkpoint_check()
+        self.assertEqual(self.lag_ms(timer), 0)
+        timer.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+# Copyright (C) 2023, NG:ITL
+import unittest
+
+import numpy as np
+
+from time_tracking.crossing_engine import CheckpointGrid, CrossingEngine
+from time_tracking.time_tracking import Checkpoint
+
+
+def baseline_prf_area(p1, p2, sx, sy) -> bool:
+    """
+    frozen copy of Point.prf_area before the crossing engine
+    """
+    if min(p1[0], p2[0]) <= sx <= max(p1[0], p2[0]) and min(p1[1], p2[1]) <= sy <= max(p1[1], p2[1]):
+        return True
+    return False
+
+
+def baseline_calc_intersection(p_start, p_end, p_line) -> bool:
+    """
+    frozen copy of Point.calc_intersection before the crossing engine, Point now delegates to the code under test
+    """
+
+    def det(a, b):
+        return a[0] * b[1] - a[1] * b[0]
+
+    p1, p2 = (p_line[0], p_line[1]), (p_line[2], p_line[3])
+    q1, q2 = (p_start[0], p_start[1]), (p_end[0], p_end[1])
+
+    xdiff = (p1[0] - p2[0], q1[0] - q2[0])
+    ydiff = (p1[1] - p2[1], q1[1] - q2[1])
+
+    div = det(xdiff, ydiff)
+    if div == 0:
+        return False
+
+    d = (det(*(p1, p2)), det(*(q1, q2)))
+    x = det(d, xdiff) / div
+    y = det(d, ydiff) / div
+
+    if baseline_prf_area(p1, p2, x, y) & baseline_prf_area(q1, q2, x, y):
+        return True
+    return False
+
+
+def make_checkpoints(p_lines: list) -> list:
+    return [Checkpoint({"x1": x1, "y1": y1, "x2": x2, "y2": y2}, i) for i, (x1, y1, x2, y2) in enumerate(p_lines)]
+
+
+def scalar_crossings(p_checkpoints: list, p_start, p_end) -> list:
+    """
+    the crossings of one motion segment as the scalar path finds them, as (checkpoint index, fraction)
+    """
+    crossings = []
+    for index, checkpoint in enumerate(p_checkpoints):
+        fraction = checkpoint.crossing_fraction(p_start[0], p_start[1], p_end[0], p_end[1])
+        if fraction is not None:
+            crossings.append((index, fraction))
+    return crossings
+
+
+# timing lines of every orientation, sharing endpoints with each other and with the degenerate segments below
+LINES = [
+    (100, 0, 100, 100),
+    (0, 50, 200, 50),
+    (0, 0, 100, 100),
+    (100, 100, 200, 0),
+    (50, 50, 50, 50),
+    (300, 10, 310, 400),
+]
+# segments that are collinear with a line, end or start on a line, touch an endpoint, have zero length or only touch
+# the bounding box of a line
+DEGENERATE_SEGMENTS = [
+    ((100, 20), (100, 80)),
+    ((100, -10), (100, 0)),
+    ((0, 50), (200, 50)),
+    ((20, 50), (80, 50)),
+    ((10, 10), (90, 90)),
+    ((90, 40), (100, 40)),
+    ((100, 40), (110, 40)),
+    ((100, 100), (100, 100)),
+    ((50, 50), (50, 50)),
+    ((0, 100), (100, 0)),
+    ((200, 0), (300, 0)),
+    ((100, 0), (200, 100)),
+    ((40, 60), (60, 40)),
+    ((305, 0), (305, 500)),
+    ((-5, 0), (5, 0)),
+]
+
+
+class CrossingEngineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(3)
+        random_lines = [tuple(line) for line in rng.uniform(0, 400, (40, 4))]
+        self.lines = LINES + random_lines
+        self.checkpoints = make_checkpoints(self.lines)
+        self.engine = CrossingEngine(self.checkpoints)
+        random_segments = [((a[0], a[1]), (b[0], b[1])) for a, b in rng.uniform(-20, 420, (500, 2, 2))]
+        self.segments = DEGENERATE_SEGMENTS + random_segments
+
+    def assert_same_crossings(self, p_expected: list, p_indices, p_fractions) -> None:
+        self.assertEqual([index for index, _ in p_expected], list(p_indices))
+        for (_, expected), fraction in zip(p_expected, p_fractions):
+            self.assertAlmostEqual(expected, float(fraction), places=12)
+
+    def test_crossed_matches_the_baseline_calc_intersection(self) -> None:
+        for start, end in self.segments:
+            with self.subTest(start=start, end=end):
+                expected = [baseline_calc_intersection(start, end, line) for line in self.lines]
+                self.assertEqual(list(self.engine.crossed(start, end)), expected)
+
+    def test_crossings_match_crossing_fraction(self) -> None:
+        for start, end in self.segments:
+            with self.subTest(start=start, end=end):
+                indices, fractions = self.engine.crossings(start, end)
+                self.assert_same_crossings(scalar_crossings(self.checkpoints, start, end), indices, fractions)
+
+    def test_crossed_path_matches_segment_by_segment(self) -> None:
+        points = np.array([point for segment in self.segments for point in segment], dtype=np.float64)
+        hits = self.engine.crossed_path(points)
+        self.assertEqual(hits.shape, (len(points) - 1, len(self.checkpoints)))
+        self.assertTrue(hits.any())
+        for i in range(len(points) - 1):
+            np.testing.assert_array_equal(hits[i], self.engine.crossed(points[i], points[i + 1]))
+
+    def test_path_crossings_match_crossing_fraction(self) -> None:
+        points = np.array([point for segment in self.segments for point in segment], dtype=np.float64)
+        crossings = {
+            segment: (indices, fractions) for segment, indices, fractions in self.engine.path_crossings(points)
+        }
+        for i in range(len(points) - 1):
+            with self.subTest(segment=i):
+                expected = scalar_crossings(self.checkpoints, points[i], points[i + 1])
+                indices, fractions = crossings.get(i, ([], []))
+                self.assert_same_crossings(expected, indices, fractions)
+
+    def test_path_of_one_point(self) -> None:
+        self.assertEqual(self.engine.crossed_path(np.array([[100.0, 50.0]])).shape, (0, len(self.checkpoints)))
+        self.assertEqual(self.engine.path_crossings(np.array([[100.0, 50.0]])), [])
+
+
+class CheckpointGridTest(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(5)
+        # short lines like the ones of a densely timed track plus a few long ones spanning many cells
+        centers = rng.uniform(0, 1000, (300, 2))
+        offsets = rng.uniform(-20, 20, (300, 2))
+        lines = [tuple(line) for line in np.hstack([centers - offsets, centers + offsets])]
+        lines += [(0, 500, 1000, 500), (500, 0, 500, 1000), (0, 0, 1000, 1000)]
+        self.checkpoints = make_checkpoints(LINES + lines)
+        self.engine = CrossingEngine(self.checkpoints)
+        steps = rng.normal(0, 15, (2000, 2))
+        steps[::100] *= 20
+        starts = rng.uniform(0, 1000, (2000, 2))
+        self.segments = DEGENERATE_SEGMENTS + [(tuple(a), tuple(a + b)) for a, b in zip(starts, steps)]
+
+    def test_candidates_contain_every_crossed_checkpoint(self) -> None:
+        for cell_size in (8, 32, 100):
+            grid = CheckpointGrid(self.checkpoints, cell_size)
+            for start, end in self.segments:
+                with self.subTest(cell_size=cell_size, start=start, end=end):
+                    candidates = grid.candidates(start, end)
+                    self.assertEqual(list(candidates), sorted(set(candidates)))
+                    crossed = set(np.flatnonzero(self.engine.crossed(start, end)).tolist())
+                    self.assertLessEqual(crossed, set(candidates))
+
+    def test_candidates_prune(self) -> None:
+        grid = CheckpointGrid(self.checkpoints)
+        self.assertLess(len(grid.candidates((700.0, 100.0), (705.0, 103.0))), len(self.checkpoints) // 10)
+
+    def test_segment_outside_of_all_cells(self) -> None:
+        grid = CheckpointGrid(self.checkpoints)
+        self.assertEqual(list(grid.candidates((5000.0, 5000.0), (5010.0, 5000.0))), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
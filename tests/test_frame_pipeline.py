@@ -0,0 +1,146 @@
+# Copyright (C) 2023, NG:ITL
+import tracemalloc
+import unittest
+
+import numpy as np
+import pynng
+
+from time_tracking.clock import NS_PER_SECOND
+from time_tracking.frame_pipeline import (
+    GOVERNOR_MAX_INTERVAL_NS,
+    GOVERNOR_MIN_BACKOFF_NS,
+    CheckpointOverlay,
+    FrameBuffer,
+    FrameGovernor,
+)
+from time_tracking.time_tracking import Checkpoint
+from time_tracking.wire_format import encode_frame_header
+
+FRAME_SHAPE = (990, 1332, 3)
+FRAMES = 50
+
+
+def make_checkpoints() -> list:
+    return [
+        Checkpoint({"x1": 100, "y1": 100, "x2": 300, "y2": 120}, 0),
+        Checkpoint({"x1": 600, "y1": 400, "x2": 700, "y2": 500}, 1),
+        Checkpoint({"x1": 1000, "y1": 800, "x2": 1200, "y2": 850}, 2),
+    ]
+
+
+class FrameBufferTest(unittest.TestCase):
+    def test_raw_and_header_frames(self) -> None:
+        buffer = FrameBuffer(FRAME_SHAPE)
+        pixels = np.arange(np.prod(FRAME_SHAPE), dtype=np.uint64).astype(np.uint8).reshape(FRAME_SHAPE)
+        np.testing.assert_array_equal(buffer.load(pixels.tobytes()), pixels)
+        small = np.full((24, 32, 3), 7, dtype=np.uint8)
+        frame = buffer.load(encode_frame_header(small.shape, "uint8", 0, 0) + small.tobytes())
+        np.testing.assert_array_equal(frame, small)
+        self.assertIs(buffer.get_frame(), frame)
+        self.assertEqual(pynng.ffi.buffer(buffer.payload())[:], small.tobytes())
+
+    def test_missed_frames_from_the_index(self) -> None:
+        buffer = FrameBuffer(FRAME_SHAPE)
+        small = bytes(24 * 32 * 3)
+        for index in (0, 1, 4, 5, 9, 2, 3):
+            buffer.load(encode_frame_header((24, 32, 3), "uint8", index, 0) + small)
+        self.assertEqual(buffer.get_missed_frames(), 5)
+
+
+class FramePathAllocationTest(unittest.TestCase):
+    """
+    receive into the FrameBuffer, composite the cached checkpoint overlay in place and publish from the buffer, raw
+    frames and frames with frame header alternating. tracemalloc has to see no frame sized allocation per frame; the
+    received bytes are created up front, as they are allocated by pynng before the frame path starts.
+    """
+
+    @staticmethod
+    def process_frame(p_buffer: FrameBuffer, p_overlay: CheckpointOverlay, p_socket, p_received: bytes) -> None:
+        frame = p_buffer.load(p_received)
+        p_overlay.apply(frame)
+        p_socket.send(p_buffer.payload())
+
+    def test_no_frame_sized_allocation(self) -> None:
+        frame_size = int(np.prod(FRAME_SHAPE))
+        received = [np.full(FRAME_SHAPE, i, dtype=np.uint8).tobytes() for i in range(2)]
+        received += [encode_frame_header(FRAME_SHAPE, "uint8", i, i) + received[i] for i in range(2)]
+        buffer = FrameBuffer(FRAME_SHAPE)
+        overlay = CheckpointOverlay(make_checkpoints())
+        with pynng.Pub0(listen="inproc://test_frame_pipeline") as socket:
+            self.process_frame(buffer, overlay, socket, received[0])
+
+            tracemalloc.start()
+            start, _ = tracemalloc.get_traced_memory()
+            for i in range(FRAMES):
+                self.process_frame(buffer, overlay, socket, received[i % len(received)])
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.assertLess(peak - start, frame_size)
+
+    def test_overlay_only_changes_the_timing_lines(self) -> None:
+        frame = np.zeros(FRAME_SHAPE, dtype=np.uint8)
+        CheckpointOverlay(make_checkpoints()).apply(frame)
+        drawn = np.asarray(frame.any(axis=2))
+        self.assertTrue(drawn[110, 200])
+        self.assertFalse(drawn[0, 0])
+        self.assertLess(drawn.mean(), 0.01)
+
+
+class FrameGovernorTest(unittest.TestCase):
+    MS = 1_000_000
+
+    def interval_ms(self, p_governor: FrameGovernor) -> float:
+        return p_governor.metrics()["frame_interval_ms"]
+
+    def test_target_frame_rate(self) -> None:
+        governor = FrameGovernor(10, 20)
+        admitted = [governor.admit(t * self.MS, 0) for t in (0, 50, 99, 100, 180, 260)]
+        self.assertEqual(admitted, [True, False, False, True, False, True])
+        metrics = governor.metrics()
+        self.assertEqual((metrics["frames_drawn"], metrics["frames_skipped_rate"]), (3, 3))
+        self.assertEqual(metrics["frames_skipped_lag"], 0)
+
+    def test_every_frame_without_target(self) -> None:
+        governor = FrameGovernor(0, 20)
+        self.assertTrue(all(governor.admit(t, 0) for t in range(10)))
+
+    def test_lag_backs_off_up_to_the_maximum_interval(self) -> None:
+        governor = FrameGovernor(0, 20)
+        self.assertFalse(governor.admit(0, 21 * self.MS))
+        self.assertEqual(self.interval_ms(governor), GOVERNOR_MIN_BACKOFF_NS / self.MS)
+        self.assertFalse(governor.admit(0, 21 * self.MS))
+        self.assertEqual(self.interval_ms(governor), 2 * GOVERNOR_MIN_BACKOFF_NS / self.MS)
+        for _ in range(20):
+            governor.admit(0, 21 * self.MS)
+        self.assertEqual(self.interval_ms(governor), GOVERNOR_MAX_INTERVAL_NS / self.MS)
+        self.assertEqual(governor.metrics()["frames_skipped_lag"], 22)
+
+    def test_recovers_once_the_lag_is_below_half_the_limit(self) -> None:
+        governor = FrameGovernor(0, 20)
+        for _ in range(3):
+            governor.admit(0, 30 * self.MS)
+        backoff = self.interval_ms(governor)
+        # below the limit, but not below half of it: drawn at the slower interval
+        self.assertTrue(governor.admit(NS_PER_SECOND, 15 * self.MS))
+        self.assertEqual(self.interval_ms(governor), backoff)
+        # every drawn frame halves the interval until the target, here every frame, is reached
+        intervals = []
+        for second in range(2, 10):
+            self.assertTrue(governor.admit(second * NS_PER_SECOND, 0))
+            intervals.append(self.interval_ms(governor))
+        self.assertAlmostEqual(intervals[0], backoff / 2, places=5)
+        self.assertAlmostEqual(intervals[1], backoff / 4, places=5)
+        self.assertEqual(intervals[-1], 0)
+        self.assertEqual(intervals, sorted(intervals, reverse=True))
+
+    def test_draw_time_average(self) -> None:
+        governor = FrameGovernor()
+        governor.record_draw(16 * self.MS)
+        self.assertEqual(governor.metrics()["draw_time_ms"], 1.0)
+        for _ in range(200):
+            governor.record_draw(16 * self.MS)
+        self.assertAlmostEqual(governor.metrics()["draw_time_ms"], 16.0, delta=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+# Copyright (C) 2023, NG:ITL
+import unittest
+
+import numpy as np
+
+from benchmarks.hot_path_benchmark import check, measure, summarize
+
+
+class MeasureTest(unittest.TestCase):
+    def test_times_every_call_after_its_setup(self) -> None:
+        calls = []
+        latencies = measure(10, lambda i: calls.append(("setup", i)), lambda i: calls.append(("operation", i)))
+        self.assertEqual(latencies.shape, (10,))
+        self.assertTrue((latencies >= 0).all())
+        self.assertEqual(calls[-2:], [("setup", 9), ("operation", 9)])
+
+    def test_summary_of_known_latencies(self) -> None:
+        summary = summarize(np.full(100, 2_000, dtype=np.int64))
+        self.assertAlmostEqual(summary["p50_us"], 2.0)
+        self.assertAlmostEqual(summary["p99_us"], 2.0)
+        self.assertAlmostEqual(summary["ops_per_s"], 500_000)
+
+
+class CheckTest(unittest.TestCase):
+    BASELINES = {"send_data": {"p50_us": 10.0, "ops_per_s": 100_000}}
+
+    def test_within_tolerance(self) -> None:
+        summaries = {"send_data": {"p50_us": 14.0, "ops_per_s": 70_000}}
+        self.assertEqual(check(summaries, self.BASELINES, 0.5), [])
+
+    def test_slower_than_tolerance(self) -> None:
+        summaries = {"send_data": {"p50_us": 16.0, "ops_per_s": 60_000}}
+        self.assertEqual(len(check(summaries, self.BASELINES, 0.5)), 2)
+
+    def test_operation_without_baseline(self) -> None:
+        summaries = {"publish_frame": {"p50_us": 1e6, "ops_per_s": 1}}
+        self.assertEqual(check(summaries, self.BASELINES, 0.5), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+# Copyright (C) 2023, NG:ITL
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.fixtures import write_config
+from time_tracking.clock import NS_PER_SECOND, VirtualClock
+from time_tracking.lap_trajectory import LapTrajectory, RecordedLap, ReferenceLap
+from time_tracking.time_tracking import LapTimer
+
+INTERVAL_NS = NS_PER_SECOND // 100
+CELL_PX = 32.0
+
+
+def recorded_lap(p_positions: np.ndarray) -> RecordedLap:
+    return RecordedLap("Max", len(p_positions) / 100, np.arange(len(p_positions)) * INTERVAL_NS, p_positions)
+
+
+def figure_eight(p_samples: int = 400) -> np.ndarray:
+    """
+    Returns:
+        lemniscate through (400, 300) that crosses itself there, once going up and once going down
+    """
+    angles = np.linspace(0, 2 * np.pi, p_samples)
+    return np.stack([400 + 300 * np.sin(angles), 300 + 150 * np.sin(2 * angles)], axis=1)
+
+
+def brute_force_locate(p_lap: RecordedLap, p_x: float, p_y: float, p_window: float, p_expected_arc=None):
+    """
+    projection onto every segment of the lap with the rules of ReferenceLap.locate, without the grid
+    """
+    starts = p_lap.positions[:-1]
+    vectors = np.diff(p_lap.positions, axis=0)
+    lengths = np.hypot(*vectors.T)
+    arc = np.concatenate(([0.0], np.cumsum(lengths)))
+    offsets = np.array((p_x, p_y)) - starts
+    squared_lengths = lengths**2
+    safe_lengths = np.where(squared_lengths > 0, squared_lengths, 1)
+    fractions = np.where(squared_lengths > 0, np.clip((offsets * vectors).sum(axis=1) / safe_lengths, 0, 1), 0)
+    distances = ((offsets - fractions[:, None] * vectors) ** 2).sum(axis=1)
+    arcs = arc[:-1] + fractions * lengths
+    close = distances <= CELL_PX**2
+    if not close.any():
+        return None
+    expected = close & (np.abs(arcs - p_expected_arc) <= p_window) if p_expected_arc is not None else close
+    candidates = np.flatnonzero(expected if expected.any() else close)
+    i = candidates[np.argmin(distances[candidates])]
+    time_ns = p_lap.times_ns[i] + fractions[i] * (p_lap.times_ns[i + 1] - p_lap.times_ns[i])
+    return float(arcs[i]), float(time_ns)
+
+
+class LapTrajectoryTest(unittest.TestCase):
+    def test_grows_and_keeps_the_samples(self) -> None:
+        trajectory = LapTrajectory(p_initial_capacity=4)
+        trajectory.start(100)
+        for i in range(5):
+            trajectory.append(float(i), -float(i), 100 + i)
+        trajectory.extend(np.array([[5.0, -5.0], [6.0, -6.0]]), np.array([105, 106]))
+        self.assertEqual(len(trajectory), 7)
+        self.assertEqual(trajectory.get_capacity(), 8)
+        np.testing.assert_array_equal(trajectory.get_times(), np.arange(100, 107))
+        np.testing.assert_array_equal(trajectory.get_positions()[:, 0], np.arange(7.0))
+        trajectory.start(200)
+        self.assertEqual((len(trajectory), trajectory.get_start_ns(), trajectory.get_capacity()), (0, 200, 8))
+
+
+class ReferenceLapTest(unittest.TestCase):
+    def assert_matches_brute_force(self, p_positions: np.ndarray, p_queries: np.ndarray, p_with_expected: bool) -> None:
+        lap = recorded_lap(p_positions)
+        reference = ReferenceLap(lap, p_cell_px=CELL_PX)
+        window = max(0.1 * reference.get_length(), 2 * CELL_PX)
+        rng = np.random.default_rng(7)
+        for x, y in p_queries:
+            expected_arc = float(rng.uniform(0, reference.get_length())) if p_with_expected else None
+            expected = brute_force_locate(lap, x, y, window, expected_arc)
+            actual = reference.locate(x, y, expected_arc)
+            if expected is None:
+                self.assertIsNone(actual)
+                continue
+            self.assertIsNotNone(actual)
+            assert actual is not None
+            self.assertAlmostEqual(actual[0], expected[0], places=6)
+            self.assertLessEqual(abs(actual[1] - expected[1]), 1)
+
+    def queries(self, p_positions: np.ndarray, p_count: int = 300) -> np.ndarray:
+        rng = np.random.default_rng(3)
+        # close to the lap, a few cells away from it, and anywhere
+        near = p_positions[rng.integers(0, len(p_positions), p_count)] + rng.normal(0, 15, (p_count, 2))
+        anywhere = rng.uniform(-100, 900, (p_count // 3, 2))
+        return np.concatenate((near, anywhere))
+
+    def test_matches_brute_force(self) -> None:
+        rng = np.random.default_rng(5)
+        angles = np.linspace(0, 2 * np.pi, 300)
+        circle = np.stack([400 + 250 * np.cos(angles), 300 + 200 * np.sin(angles)], axis=1)
+        circle += rng.normal(0, 1.5, circle.shape)
+        for with_expected in (False, True):
+            with self.subTest(with_expected=with_expected):
+                self.assert_matches_brute_force(circle, self.queries(circle), with_expected)
+
+    def test_self_crossing_lap_matches_brute_force(self) -> None:
+        positions = figure_eight()
+        for with_expected in (False, True):
+            with self.subTest(with_expected=with_expected):
+                self.assert_matches_brute_force(positions, self.queries(positions), with_expected)
+
+    def test_jump_in_the_lap_matches_brute_force(self) -> None:
+        # the tracking lost the car for a moment, one segment is many cells long
+        positions = figure_eight()
+        positions[150:160] = positions[150]
+        positions = np.delete(positions, range(151, 170), axis=0)
+        self.assert_matches_brute_force(positions, self.queries(positions), False)
+
+    def test_expected_arc_picks_the_pass_at_the_crossing(self) -> None:
+        reference = ReferenceLap(recorded_lap(figure_eight()), p_cell_px=CELL_PX)
+        length = reference.get_length()
+        first = reference.locate(400.5, 300.0, 0.0)
+        second = reference.locate(400.5, 300.0, length / 2)
+        assert first is not None and second is not None
+        # the lap passes (400, 300) at its start and half way
+        self.assertLess(min(first[0], length - first[0]), 0.05 * length)
+        self.assertLess(abs(second[0] - length / 2), 0.05 * length)
+
+    def test_far_from_the_lap(self) -> None:
+        reference = ReferenceLap(recorded_lap(figure_eight()), p_cell_px=CELL_PX)
+        self.assertIsNone(reference.locate(400.0, 0.0))
+        self.assertIsNone(reference.locate(5_000.0, 5_000.0))
+
+
+class LiveDeltaTest(unittest.TestCase):
+    """
+    drives the rectangle of the replay test around the timing lines of THREE_LINES: a valid lap at 3 px per 10 ms
+    becomes the reference, the next lap is driven 10 % slower
+    """
+
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        write_config(Path(self.tmp.name), p_transport="inproc")
+        os.chdir(self.tmp.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    @staticmethod
+    def rectangle() -> np.ndarray:
+        corners = [(50, 50), (350, 50), (350, 200), (50, 200), (50, 50)]
+        positions = []
+        for (x1, y1), (x2, y2) in zip(corners, corners[1:]):
+            steps = int(max(abs(x2 - x1), abs(y2 - y1)) / 3)
+            for step in range(steps):
+                positions.append((x1 + (x2 - x1) * step / steps, y1 + (y2 - y1) * step / steps))
+        return np.array(positions)
+
+    def test_delta_to_the_best_lap(self) -> None:
+        events: list = []
+
+        class EventTimer(LapTimer):
+            def publish_event(self, p_msg: bytes) -> None:
+                topic, payload = p_msg.split(b" ", 1)
+                if topic == b"live_delta":
+                    events.append(json.loads(payload))
+
+        clock = VirtualClock(1_000 * NS_PER_SECOND)
+        timer = EventTimer(p_async=True, p_clock=clock, p_headless=True)
+        timer.start_timer()
+        track = self.rectangle()
+        # starts just behind the finish line, so every pass ends with a finish line crossing
+        track = np.roll(track, -int(np.argmax(track[:, 0] > 100)), axis=0)
+        now = clock.now_ns()
+        # the lap since start_timer, the reference lap and the slower lap
+        for interval_ns in (INTERVAL_NS, INTERVAL_NS, 11 * INTERVAL_NS // 10):
+            events.clear()
+            for x, y in track:
+                now += interval_ns
+                clock.set_ns(now)
+                timer.process_coordinates((float(x), float(y), now), now)
+                timer.run_scheduled(now)
+        timer.stop()
+
+        reference = timer.get_best_lap("anon")
+        assert reference is not None
+        self.assertTrue(events)
+        self.assertTrue(all(event["reference_lap_time"] == reference.lap_time for event in events))
+        progress = [event["lap_progress"] for event in events]
+        self.assertEqual(progress, sorted(progress))
+        self.assertGreater(progress[-1], 0.9)
+        # at constant speed the slower lap is behind by 10 % of the time the reference lap took to the same point
+        for event in events:
+            self.assertAlmostEqual(event["delta"], 0.1 * event["lap_progress"] * reference.lap_time, delta=0.02)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+# Copyright (C) 2023, NG:ITL
+import unittest
+
+import numpy as np
+
+from time_tracking.clock import NS_PER_SECOND
+from time_tracking.position_history import PositionHistory
+
+INTERVAL_NS = NS_PER_SECOND // 100
+
+
+class PositionHistoryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # capacity of 20 samples, the 50 samples appended below wrap around the ring buffer
+        self.history = PositionHistory(p_seconds=0.2, p_max_rate_hz=100)
+        for i in range(50):
+            self.history.append(float(i), 2.0 * i, i * INTERVAL_NS)
+
+    def test_keeps_the_newest_samples(self) -> None:
+        self.assertEqual(len(self.history), self.history.get_capacity())
+        self.assertEqual(self.history.newest(), (49.0, 98.0, 49 * INTERVAL_NS))
+        positions, times = self.history.last(3)
+        np.testing.assert_array_equal(positions, [[47, 94], [48, 96], [49, 98]])
+        np.testing.assert_array_equal(times, np.arange(47, 50) * INTERVAL_NS)
+
+    def test_window(self) -> None:
+        positions, times = self.history.window(4 * INTERVAL_NS)
+        np.testing.assert_array_equal(times, np.arange(45, 50) * INTERVAL_NS)
+        self.assertEqual(len(positions), 5)
+
+    def test_smoothed_position_and_instant(self) -> None:
+        self.assertEqual(self.history.smoothed(4 * INTERVAL_NS), (47.0, 94.0, 47 * INTERVAL_NS))
+        self.assertIsNone(PositionHistory().smoothed(INTERVAL_NS))
+
+    def test_speed(self) -> None:
+        self.assertAlmostEqual(self.history.speed(10 * INTERVAL_NS), np.hypot(1, 2) * 100)
+        self.history.clear()
+        self.assertIsNone(self.history.speed(10 * INTERVAL_NS))
+
+    def test_extend_matches_append(self) -> None:
+        extended = PositionHistory(p_seconds=0.2, p_max_rate_hz=100)
+        extended.extend(np.stack([np.arange(50.0), 2.0 * np.arange(50)], axis=1), np.arange(50) * INTERVAL_NS)
+        for expected, actual in zip(self.history.last(20), extended.last(20)):
+            np.testing.assert_array_equal(expected, actual)
+
+
+if __name__ == "__main__":
+    unittest.main()
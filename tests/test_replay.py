@@ -0,0 +1,200 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Checks that a recorded session replays to the same events however it is replayed. A synthetic session of three laps
+(binary coordinates at 100 Hz, a driver change and frames with header) is written with the RecordingWriter, then
+replayed into a headless LapTimer, each replay in its own process and temporary working directory:
+
+- fast:    in-process with a VirtualClock, as fast as possible
+- paced:   in-process with a VirtualClock, at five times the recorded speed
+- pynng:   published in real time on local pynng sockets to a LapTimer on the monotonic clock
+
+The published events of every replay must equal those of the fast replay. The LapTimer of the pynng replay is started
+before the replay instead of at the first record, so its first, partial lap is left out of the comparison, and so are
+the lap_start events, whose best times include the sector of that lap. The lap_trajectory events carry the samples
+relative to the lap start, so they are compared as well. The live_delta events are left out: they are published by
+the scheduler, which runs on the monotonic clock in the pynng replay.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.fixtures import BASE_DIR, write_config
+from time_tracking.clock import NS_PER_SECOND
+from time_tracking.recording import RecordingReader, RecordingWriter, COORDINATES, FRAME, USER, rebase_timestamp
+from time_tracking.wire_format import decode_binary_coordinates, encode_binary_coordinates, encode_frame_header
+
+START_NS = 1_000 * NS_PER_SECOND
+SAMPLE_INTERVAL_NS = NS_PER_SECOND // 100
+CAPTURE_DELAY_NS = 2_000_000
+LAPS = 3
+FRAME_SHAPE = (240, 320, 3)
+FRAME_EVERY = 10
+
+
+def track() -> np.ndarray:
+    """
+    Returns:
+        positions of one lap at 3 pixels per sample: right through the timing lines, around above them and back
+    """
+    corners = [(50, 50), (350, 50), (350, 200), (50, 200), (50, 50)]
+    positions = []
+    for (x1, y1), (x2, y2) in zip(corners, corners[1:]):
+        steps = int(max(abs(x2 - x1), abs(y2 - y1)) / 3)
+        for step in range(steps):
+            positions.append((x1 + (x2 - x1) * step / steps, y1 + (y2 - y1) * step / steps))
+    return np.array(positions)
+
+
+def write_session(p_path: str, p_config: dict) -> None:
+    subscribers = p_config["pynng"]["subscribers"]
+    coordinate_topic = subscribers["__sub_coordinates"]["topics"]["pixel_coordinates"]
+    user_topic = subscribers["__sub_user"]["topics"]["current_driver"]
+    frame = np.full(FRAME_SHAPE, 64, dtype=np.uint8).tobytes()
+    with RecordingWriter(p_path) as writer:
+        writer.write(USER, START_NS, f"{user_topic}alice".encode())
+        timestamp_ns = START_NS
+        for index, (x, y) in enumerate(np.tile(track(), (LAPS, 1))):
+            timestamp_ns += SAMPLE_INTERVAL_NS
+            capture_ns = timestamp_ns - CAPTURE_DELAY_NS
+            writer.write(COORDINATES, timestamp_ns, encode_binary_coordinates(coordinate_topic, 0, x, y, capture_ns))
+            if index % FRAME_EVERY == 0:
+                header = encode_frame_header(FRAME_SHAPE, "uint8", index // FRAME_EVERY, capture_ns)
+                writer.write(FRAME, timestamp_ns, header + frame)
+
+
+def child(p_mode: str, p_path: str) -> None:
+    from time_tracking.clock import VirtualClock
+    from time_tracking.recording import paced, replay_in_process, replay_pynng
+    from time_tracking.time_tracking import LapTimer
+
+    events = []
+
+    class EventTimer(LapTimer):
+        def publish_event(self, p_msg: bytes) -> None:
+            super().publish_event(p_msg)
+            # latin-1 maps every byte, the lap_trajectory events are binary
+            events.append(p_msg.decode("latin-1"))
+
+    reader = RecordingReader(p_path)
+    if p_mode == "pynng":
+        config = json.loads(Path("time_tracking_config.json").read_text())
+        timer = EventTimer(p_headless=True)
+        timer.start_timer()
+
+        def loop() -> None:
+            while True:
+                timer.run()
+
+        threading.Thread(target=loop, daemon=True).start()
+        replay_pynng(paced(reader.records()), config)
+        time.sleep(0.3)
+    else:
+        clock = VirtualClock(START_NS)
+        timer = EventTimer(p_async=True, p_clock=clock, p_headless=True)
+        timer.start_timer()
+        replay_in_process(paced(reader.records(), 0 if p_mode == "fast" else 5), timer, clock)
+    print(json.dumps(events))
+
+
+def replay(p_mode: str, p_path: str) -> list:
+    """
+    replays the recording in a child process with a working directory of its own
+    Returns:
+        the published events
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        write_config(Path(tmp))
+        env = dict(os.environ, PYTHONPATH=str(BASE_DIR))
+        output = subprocess.run(
+            [sys.executable, "-m", "tests.test_replay", "--child", p_mode, p_path],
+            cwd=tmp,
+            env=env,
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+    if output.returncode != 0:
+        raise RuntimeError(f"{p_mode} replay failed:\n{output.stderr}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+class ReplayTest(unittest.TestCase):
+    session_dir: tempfile.TemporaryDirectory
+    path: str
+    reference: list
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.session_dir = tempfile.TemporaryDirectory()
+        cls.path = str(Path(cls.session_dir.name) / "session.rec")
+        write_session(cls.path, write_config(Path(cls.session_dir.name)))
+        cls.reference = replay("fast", cls.path)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.session_dir.cleanup()
+
+    def test_fast_replay_publishes_the_laps(self) -> None:
+        laps = [event for event in self.reference if event.startswith("lap_finished")]
+        self.assertEqual(len(laps), LAPS)
+
+    def test_paced_matches_fast(self) -> None:
+        self.assertEqual(replay("paced", self.path), self.reference)
+
+    def test_pynng_matches_fast(self) -> None:
+        events = [event for event in replay("pynng", self.path) if not event.startswith("live_delta")]
+        expected = [event for event in self.reference if not event.startswith("live_delta")]
+        # the first lap_finished event ends the partial lap since start_timer, its trajectory follows before the
+        # first lap_start of the next lap
+        first_lap = next(i for i, event in enumerate(events) if event.startswith("lap_finished"))
+        next_lap = next(i for i in range(first_lap, len(events)) if events[i].startswith("lap_start"))
+        events = [event for event in events[next_lap:] if not event.startswith("lap_start")]
+        expected = [event for event in expected[next_lap:] if not event.startswith("lap_start")]
+        self.assertTrue(events)
+        self.assertEqual(events, expected)
+
+    def test_seek_matches_the_full_read(self) -> None:
+        reader = RecordingReader(self.path)
+        records = list(reader.records())
+        self.assertEqual(len(records), reader.get_record_count())
+        self.assertGreater(reader.get_chunk_count(), 1)
+        seek_ns = START_NS + 4 * NS_PER_SECOND + 5 * SAMPLE_INTERVAL_NS // 2
+        tail = [record for record in records if record[0] >= seek_ns]
+        self.assertEqual(list(reader.records(seek_ns)), tail)
+
+
+class RebaseTimestampTest(unittest.TestCase):
+    def test_json_object_timestamp_is_shifted(self) -> None:
+        payload = b'pixel_coordinates {"x": 1.5, "y": 2.0, "timestamp_ns": 1000}'
+        topic, coordinates = rebase_timestamp(COORDINATES, payload, 250).split(b" ", 1)
+        self.assertEqual(topic, b"pixel_coordinates")
+        self.assertEqual(json.loads(coordinates), {"x": 1.5, "y": 2.0, "timestamp_ns": 1250})
+
+    def test_json_without_timestamp_is_unchanged(self) -> None:
+        for payload in (
+            b'pixel_coordinates {"x": 1.5, "y": 2.0}',
+            b"pixel_coordinates [1.5, 2.0]",
+            b"pixel_coordinates [1.5, 2.0, 1000]",
+        ):
+            with self.subTest(payload=payload):
+                self.assertEqual(rebase_timestamp(COORDINATES, payload, 250), payload)
+
+    def test_binary_timestamp_is_shifted(self) -> None:
+        payload = encode_binary_coordinates("pixel_coordinates", 2, 1.5, 2.0, 1000)
+        rebased = rebase_timestamp(COORDINATES, payload, 250)
+        self.assertEqual(decode_binary_coordinates(rebased, len("pixel_coordinates ")), (2, 1.5, 2.0, 1250))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+    else:
+        unittest.main()
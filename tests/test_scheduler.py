@@ -0,0 +1,169 @@
+# Copyright (C) 2023, NG:ITL
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmarks.fixtures import write_config
+from time_tracking.clock import NS_PER_SECOND, VirtualClock
+from time_tracking.scheduler import Scheduler
+from time_tracking.time_tracking import LapTimer
+
+NOW_NS = 1_000 * NS_PER_SECOND
+SAMPLE_INTERVAL_NS = 10_000_000
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_tasks_run_in_due_order(self) -> None:
+        scheduler = Scheduler()
+        ran: list = []
+        scheduler.call_at(30, ran.append, "c")
+        scheduler.call_at(10, ran.append, "a")
+        scheduler.call_at(20, ran.append, "b1")
+        scheduler.call_at(20, ran.append, "b2")
+        self.assertEqual(scheduler.run_due(9), 0)
+        self.assertEqual(scheduler.run_due(20), 3)
+        self.assertEqual(ran, ["a", "b1", "b2"])
+        self.assertEqual(len(scheduler), 1)
+        scheduler.run_due(100)
+        self.assertEqual(ran, ["a", "b1", "b2", "c"])
+
+    def test_task_scheduled_by_a_due_task_runs_if_due(self) -> None:
+        scheduler = Scheduler()
+        ran: list = []
+        scheduler.call_at(10, lambda: scheduler.call_at(15, ran.append, "follow-up"))
+        scheduler.call_at(10, lambda: scheduler.call_at(25, ran.append, "later"))
+        scheduler.run_due(20)
+        self.assertEqual(ran, ["follow-up"])
+
+    def test_cancel(self) -> None:
+        scheduler = Scheduler()
+        ran: list = []
+        handle = scheduler.call_at(10, ran.append, "cancelled")
+        scheduler.call_at(10, ran.append, "kept")
+        scheduler.cancel(handle)
+        scheduler.cancel(None)
+        self.assertEqual(len(scheduler), 1)
+        self.assertEqual(scheduler.run_due(10), 1)
+        self.assertEqual(ran, ["kept"])
+
+    def test_call_every(self) -> None:
+        scheduler = Scheduler()
+        ran: list = []
+        handle = scheduler.call_every(100, 10, lambda: ran.append(len(ran)))
+        scheduler.run_due(109)
+        self.assertEqual(ran, [])
+        for now in (110, 115, 120, 130):
+            scheduler.run_due(now)
+        self.assertEqual(ran, [0, 1, 2])
+        scheduler.cancel(handle)
+        scheduler.run_due(200)
+        self.assertEqual(len(ran), 3)
+        self.assertEqual(len(scheduler), 0)
+
+    def test_call_every_does_not_catch_up(self) -> None:
+        scheduler = Scheduler()
+        ran: list = []
+        scheduler.call_every(0, 10, ran.append, "tick")
+        # the loop was blocked for five intervals, the task runs once and is next due one interval later
+        self.assertEqual(scheduler.run_due(55), 1)
+        self.assertEqual(scheduler.run_due(64), 0)
+        self.assertEqual(scheduler.run_due(65), 1)
+        self.assertEqual(ran, ["tick", "tick"])
+
+
+class LapTimerSchedulingTest(unittest.TestCase):
+    """
+    the finish line is the vertical line at x = 100 of THREE_LINES, the sector lines are at x = 200 and x = 300
+    """
+
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = write_config(Path(self.tmp.name), p_transport="inproc")
+        os.chdir(self.tmp.name)
+        self.timers: list = []
+
+    def tearDown(self) -> None:
+        for timer in self.timers:
+            timer.stop()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def make_timer(self, p_timing: dict) -> tuple:
+        """
+        Returns:
+            the started LapTimer on a VirtualClock at NOW_NS and the list of topics it publishes
+        """
+        self.config["timing"].update(p_timing)
+        Path("time_tracking_config.json").write_text(json.dumps(self.config))
+        topics: list = []
+
+        class EventTimer(LapTimer):
+            def publish_event(self, p_msg: bytes) -> None:
+                topics.append(p_msg.split(b" ", 1)[0].decode())
+
+        clock = VirtualClock(NOW_NS)
+        timer = EventTimer(p_async=True, p_clock=clock, p_headless=True)
+        self.timers.append(timer)
+        timer.start_timer()
+        return timer, clock, topics
+
+    @staticmethod
+    def drive(p_timer: LapTimer, p_clock: VirtualClock, p_start_ns: int, p_xs) -> None:
+        """
+        drives along y = 50 through the given x positions, one sample every SAMPLE_INTERVAL_NS from p_start_ns on
+        """
+        for i, x in enumerate(p_xs):
+            p_clock.set_ns(p_start_ns + i * SAMPLE_INTERVAL_NS)
+            p_timer.process_coordinates((x, 50.0, p_clock.now_ns()), p_clock.now_ns())
+
+    def laps_after_each_sample(self, p_timing: dict, p_xs) -> list:
+        timer, clock, topics = self.make_timer(p_timing)
+        laps = []
+        for i, x in enumerate(p_xs):
+            self.drive(timer, clock, NOW_NS + i * SAMPLE_INTERVAL_NS, [x])
+            laps.append(topics.count("lap_finished"))
+        return laps
+
+    def test_debounce_in_seconds(self) -> None:
+        timer, clock, topics = self.make_timer({"finish_debounce": {"unit": "seconds", "value": 2}})
+        self.drive(timer, clock, NOW_NS, [90, 110, 90, 110, 90])
+        self.assertEqual(topics.count("lap_finished"), 1)
+        # re-armed 2 s after the first crossing, the next crossing counts
+        self.drive(timer, clock, NOW_NS + 2 * NS_PER_SECOND, [90, 110])
+        self.assertEqual(topics.count("lap_finished"), 2)
+
+    def test_debounce_in_pixels(self) -> None:
+        # 20 px per sample, the finish line counts again once 50 px were driven after the crossing
+        laps = self.laps_after_each_sample({"finish_debounce": {"unit": "pixels", "value": 50}}, [90, 110, 90, 110, 90])
+        self.assertEqual(laps, [0, 1, 1, 1, 2])
+
+    def test_debounce_in_samples(self) -> None:
+        laps = self.laps_after_each_sample({"finish_debounce": {"unit": "samples", "value": 2}}, [90, 110, 90, 110, 90])
+        self.assertEqual(laps, [0, 1, 1, 2, 2])
+
+    def test_lap_timeout_abandons_the_lap(self) -> None:
+        timer, clock, topics = self.make_timer({"lap_timeout_s": 1})
+        self.drive(timer, clock, NOW_NS, [190, 210])
+        self.assertEqual(topics, ["lap_start", "sector_finished"])
+        timer.run_scheduled(NOW_NS + NS_PER_SECOND + 1)
+        # sector crossings of the abandoned lap are ignored, the finish line starts a new lap without finishing one
+        self.drive(timer, clock, NOW_NS + 2 * NS_PER_SECOND, [290, 310, 90, 110])
+        self.assertEqual(topics, ["lap_start", "sector_finished", "lap_start"])
+        self.drive(timer, clock, NOW_NS + 3 * NS_PER_SECOND, [190, 210])
+        self.assertEqual(topics[-1], "sector_finished")
+
+    def test_finished_lap_restarts_the_lap_timeout(self) -> None:
+        timer, clock, topics = self.make_timer({"lap_timeout_s": 1})
+        self.drive(timer, clock, NOW_NS + NS_PER_SECOND // 2, [90, 110])
+        self.assertEqual(topics.count("lap_finished"), 1)
+        # 1 s after start_timer, but only 0.5 s into the new lap
+        timer.run_scheduled(NOW_NS + NS_PER_SECOND + 1)
+        self.drive(timer, clock, NOW_NS + NS_PER_SECOND + 2, [190, 210])
+        self.assertEqual(topics[-1], "sector_finished")
+
+
+if __name__ == "__main__":
+    unittest.main()
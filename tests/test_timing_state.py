@@ -0,0 +1,93 @@
+# Copyright (C) 2023, NG:ITL
+import unittest
+
+import numpy as np
+
+from time_tracking.timing_state import LAP, NO_TIME, TimingState, best_time_key
+
+
+class CrossedMaskTest(unittest.TestCase):
+    def test_sector_counts_once(self) -> None:
+        state = TimingState(3)
+        self.assertTrue(state.register_crossing(2))
+        self.assertFalse(state.register_crossing(2))
+        self.assertTrue(state.is_crossed(2))
+        self.assertFalse(state.is_crossed(1))
+
+    def test_all_crossed(self) -> None:
+        state = TimingState(3)
+        for checkpoint in (1, 2):
+            state.register_crossing(checkpoint)
+            self.assertFalse(state.all_crossed())
+        state.mark_crossed(0)
+        self.assertTrue(state.all_crossed())
+
+    def test_new_lap_keeps_the_finish_line_crossed(self) -> None:
+        state = TimingState(3)
+        for checkpoint in range(3):
+            state.register_crossing(checkpoint)
+        state.clear_sectors()
+        self.assertEqual([state.is_crossed(checkpoint) for checkpoint in range(3)], [True, False, False])
+        # the debounce has not re-armed the finish line yet
+        self.assertFalse(state.register_crossing(0))
+        state.clear_crossed(0)
+        self.assertTrue(state.register_crossing(0))
+
+    def test_clear_crossed(self) -> None:
+        state = TimingState(3)
+        for checkpoint in range(3):
+            state.register_crossing(checkpoint)
+        state.clear_crossed(1)
+        self.assertEqual([state.is_crossed(checkpoint) for checkpoint in range(3)], [True, False, True])
+        state.clear_crossed()
+        self.assertEqual(state.crossed_mask, 0)
+
+    def test_more_checkpoints_than_a_machine_word(self) -> None:
+        state = TimingState(100)
+        for checkpoint in range(1, 100):
+            state.register_crossing(checkpoint)
+        self.assertFalse(state.all_crossed())
+        state.register_crossing(0)
+        self.assertTrue(state.all_crossed())
+        state.clear_sectors()
+        self.assertEqual(state.crossed_mask, 1)
+
+
+class BestTimesTest(unittest.TestCase):
+    def test_best_time_keys(self) -> None:
+        self.assertEqual(best_time_key(LAP), "lap_best_time")
+        self.assertEqual(best_time_key(2), "sector_2_best_time")
+
+    def test_load_keeps_the_missing_sectors(self) -> None:
+        state = TimingState(3)
+        state.load_best_times({"lap_best_time": 30.0, "sector_1_best_time": 10.0})
+        state.load_best_times({"sector_2_best_time": 9.0, "sector_4_best_time": 1.0})
+        self.assertEqual(
+            state.best_times(),
+            {
+                "lap_best_time": 30.0,
+                "sector_1_best_time": 10.0,
+                "sector_2_best_time": 9.0,
+                "sector_3_best_time": NO_TIME,
+            },
+        )
+
+    def test_load_replaces_the_array(self) -> None:
+        state = TimingState(2)
+        before = state.all_time_best
+        state.load_best_times({"sector_1_best_time": 10.0})
+        self.assertIsNot(state.all_time_best, before)
+        self.assertEqual(before[1], NO_TIME)
+
+    def test_personal_best(self) -> None:
+        state = TimingState(2)
+        state.load_personal_best({"lap_best_time": 31.0})
+        state.load_personal_best({"sector_1_best_time": 11.0})
+        # a driver without a time for a sector has no personal best there
+        np.testing.assert_array_equal(state.personal_best, [NO_TIME, 11.0, NO_TIME])
+        state.reset_personal_best()
+        np.testing.assert_array_equal(state.personal_best, [NO_TIME] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
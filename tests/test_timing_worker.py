@@ -0,0 +1,84 @@
+# Copyright (C) 2023, NG:ITL
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from benchmarks.fixtures import write_config
+from time_tracking.time_tracking import LapTimer
+
+
+class FailingTimer(LapTimer):
+    """
+    LapTimer whose timing step fails after a few iterations
+    """
+
+    def __init__(self, p_steps: int) -> None:
+        self.steps = p_steps
+        super().__init__(p_headless=True)
+
+    def timing_step(self) -> None:
+        self.steps -= 1
+        if self.steps == 0:
+            raise ValueError("broken coordinate")
+        super().timing_step()
+
+
+class TimingWorkerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        write_config(Path(self.tmp.name), p_transport="inproc")
+        os.chdir(self.tmp.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_stop_joins_the_worker(self) -> None:
+        timer = FailingTimer(-1)
+        timer.start_timing_worker()
+        thread = timer._LapTimer__timing_thread  # type: ignore[attr-defined]
+        self.assertTrue(thread.is_alive())
+        timer.stop()
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(timer._LapTimer__timing_thread)  # type: ignore[attr-defined]
+
+    def test_worker_exception_ends_run(self) -> None:
+        timer = FailingTimer(3)
+        with self.assertLogs("time_tracking.time_tracking", "ERROR"):
+            timer.start_timing_worker()
+            thread = timer._LapTimer__timing_thread  # type: ignore[attr-defined]
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        with self.assertRaises(RuntimeError) as context:
+            timer.run()
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+        timer.stop()
+
+    def test_worker_exception_ends_run_while_frames_stall(self) -> None:
+        # frames are received for the published overlay, but the frame source never sends any
+        write_config(Path(self.tmp.name), p_transport="inproc", p_publish_frames=True)
+        timer = FailingTimer(3)
+        self.assertTrue(timer.has_visualisation())
+        errors = []
+
+        def main_loop() -> None:
+            try:
+                while True:
+                    timer.run()
+            except RuntimeError as error:
+                errors.append(error)
+
+        with self.assertLogs("time_tracking.time_tracking", "ERROR"):
+            thread = threading.Thread(target=main_loop, daemon=True)
+            thread.start()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsInstance(errors[0].__cause__, ValueError)
+        timer.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
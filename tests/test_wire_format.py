@@ -0,0 +1,114 @@
+# Copyright (C) 2023, NG:ITL
+import json
+import unittest
+
+import numpy as np
+
+from time_tracking.wire_format import (
+    EventEncoder,
+    decode_binary_coordinates,
+    decode_binary_event,
+    decode_frame_header,
+    decode_lap_trajectory,
+    encode_binary_coordinates,
+    encode_frame_header,
+    encode_lap_trajectory,
+    is_binary_coordinates,
+)
+
+TOPICS = {
+    "lap_finished": "lap_finished",
+    "sector:finished": "sector_finished",
+    "lap_start": "lap_start",
+    "live_delta": "live_delta",
+}
+
+
+def split(p_msg: bytes) -> tuple:
+    topic, payload = p_msg.split(b" ", 1)
+    return topic.decode(), json.loads(payload)
+
+
+class CoordinatesTest(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        msg = encode_binary_coordinates("pixel_coordinates", 3, 12.5, -7.25, 123_456_789_012)
+        offset = len("pixel_coordinates ")
+        self.assertTrue(is_binary_coordinates(msg, offset))
+        self.assertEqual(decode_binary_coordinates(msg, offset), (3, 12.5, -7.25, 123_456_789_012))
+
+    def test_json_is_not_binary(self) -> None:
+        self.assertFalse(is_binary_coordinates(b"pixel_coordinates [1.0, 2.0]", len("pixel_coordinates ")))
+
+
+class FrameHeaderTest(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        header = encode_frame_header((990, 1332, 3), "uint8", 42, 5_000_000)
+        self.assertEqual(decode_frame_header(header + b"\x00"), ((990, 1332, 3), "uint8", 42, 5_000_000, len(header)))
+
+    def test_raw_frame_has_no_header(self) -> None:
+        self.assertIsNone(decode_frame_header(bytes(990 * 1332 * 3)))
+
+
+class EventEncoderTest(unittest.TestCase):
+    def test_json_matches_json_dumps(self) -> None:
+        encoder = EventEncoder(TOPICS, 3)
+        self.assertEqual(
+            split(encoder.sector("Max", 2, 3.25, True, "purple")),
+            (
+                "sector_finished",
+                {
+                    "current_driver": "Max",
+                    "sector_number": 2,
+                    "sector_time": 3.25,
+                    "sector_valid": True,
+                    "type": "purple",
+                },
+            ),
+        )
+        self.assertEqual(
+            split(encoder.lap(None, 61.5, False, "yellow")),
+            ("lap_finished", {"current_driver": None, "lap_time": 61.5, "lap_valid": False, "type": "yellow"}),
+        )
+        self.assertEqual(
+            split(encoder.lap_start([60.0, 20.0, 21.0, 19.0])),
+            (
+                "lap_start",
+                {
+                    "sector_1_best_time": 20.0,
+                    "sector_2_best_time": 21.0,
+                    "sector_3_best_time": 19.0,
+                    "lap_best_time": 60.0,
+                },
+            ),
+        )
+
+    def test_binary_decodes_to_the_json_fields(self) -> None:
+        json_encoder = EventEncoder(TOPICS, 3)
+        binary_encoder = EventEncoder(TOPICS, 3, p_binary=True)
+        for method, args in (
+            ("sector", ("Max", 2, 3.25, True, "purple")),
+            ("lap", ("Max", 61.5, False, "yellow")),
+            ("live_delta", ("Max", -0.5, 0.25, 61.5)),
+            ("lap_start", ([60.0, 20.0, 21.0, 19.0],)),
+        ):
+            with self.subTest(method=method):
+                expected = split(getattr(json_encoder, method)(*args))
+                self.assertEqual(decode_binary_event(getattr(binary_encoder, method)(*args)), expected)
+
+
+class LapTrajectoryTest(unittest.TestCase):
+    def test_round_trip_within_the_quantization(self) -> None:
+        rng = np.random.default_rng(1)
+        times_ns = np.cumsum(rng.integers(3_000_000, 5_000_000, 500))
+        positions = rng.uniform(0, 1332, (500, 2))
+        topic, lap = decode_lap_trajectory(
+            encode_lap_trajectory("lap_trajectory", "Max", 2.1, True, times_ns, positions)
+        )
+        self.assertEqual(topic, "lap_trajectory")
+        self.assertEqual((lap["current_driver"], lap["lap_time"], lap["lap_valid"]), ("Max", 2.1, True))
+        self.assertLessEqual(np.abs(lap["times_ns"] - times_ns).max(), 50_000)
+        self.assertLessEqual(np.abs(lap["positions"] - positions).max(), 1 / 32)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,331 @@
+# Copyright (C) 2023, NG:ITL
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+
+import pynng
+
+logger = logging.getLogger(__name__)
+
+BEST_TIMES_REQUEST = b"get_best_times"
+
+
+class BestTimesFetcher:
+    """
+    Requests the all-time best times from the database interface without blocking the startup. Every attempt is bounded
+    by the socket timeouts, failed attempts are retried after an exponentially growing delay. The result is picked up
+    by the timing loop with take(), so the best times are swapped in between two coordinate updates.
+    """
+
+    def __init__(
+        self,
+        p_socket: pynng.Req0,
+        p_timeout_ms: int = 1000,
+        p_max_attempts: int = 10,
+        p_backoff_ms: int = 250,
+        p_max_backoff_ms: int = 8000,
+    ) -> None:
+        """
+        Args:
+            p_socket: requester dialed to the database interface
+            p_timeout_ms: send and receive timeout of one attempt
+            p_max_attempts: number of attempts before giving up, 0 retries forever
+            p_backoff_ms: delay after the first failed attempt, doubled after every further one
+            p_max_backoff_ms: upper bound of the delay
+        """
+        self.__socket = p_socket
+        self.__socket.send_timeout = p_timeout_ms
+        self.__socket.recv_timeout = p_timeout_ms
+        self.__max_attempts = p_max_attempts
+        self.__backoff_ms = p_backoff_ms
+        self.__max_backoff_ms = p_max_backoff_ms
+        self.__lock = threading.Lock()
+        self.__result: dict | None = None
+        self.__stop_event = threading.Event()
+        self.__thread: threading.Thread | None = None
+
+    def __attempts(self):
+        attempt = 0
+        while self.__max_attempts == 0 or attempt < self.__max_attempts:
+            yield attempt
+            attempt += 1
+
+    def __delay(self, p_attempt: int) -> float:
+        """
+        Returns:
+            seconds to wait after the given failed attempt
+        """
+        return min(self.__backoff_ms * 2**p_attempt, self.__max_backoff_ms) / 1000
+
+    def fetch(self) -> dict | None:
+        """
+        requests the best times, retrying until they are received or the attempts are used up
+        Returns:
+            dict in the format of the database or None
+        """
+        for attempt in self.__attempts():
+            try:
+                self.__socket.send(BEST_TIMES_REQUEST)
+                return json.loads(self.__socket.recv().decode("utf-8"))
+            except (pynng.NNGException, ValueError) as error:
+                logger.warning("best times request %d failed: %s", attempt + 1, error)
+            if self.__stop_event.wait(self.__delay(attempt)):
+                return None
+        return None
+
+    async def afetch(self) -> dict | None:
+        """
+        asyncio version of fetch
+        Returns:
+            dict in the format of the database or None
+        """
+        for attempt in self.__attempts():
+            try:
+                await self.__socket.asend(BEST_TIMES_REQUEST)
+                return json.loads((await self.__socket.arecv()).decode("utf-8"))
+            except (pynng.NNGException, ValueError) as error:
+                logger.warning("best times request %d failed: %s", attempt + 1, error)
+            await asyncio.sleep(self.__delay(attempt))
+        return None
+
+    def start(self) -> None:
+        """
+        fetches the best times on a background thread, the result is handed out by take()
+        """
+        self.__thread = threading.Thread(target=self.__run, name="best_times", daemon=True)
+        self.__thread.start()
+
+    def __run(self) -> None:
+        best_times = self.fetch()
+        if best_times is None:
+            logger.warning("no best times received, keeping the fallback best times")
+            return
+        with self.__lock:
+            self.__result = best_times
+
+    def take(self) -> dict | None:
+        """
+        Returns:
+            the best times received since the last call, None if there are none
+        """
+        with self.__lock:
+            best_times, self.__result = self.__result, None
+        return best_times
+
+    def stop(self) -> None:
+        """
+        ends a running background fetch after its current attempt
+        """
+        self.__stop_event.set()
+
+
+BEST_TIMES_CACHE_VERSION = 2
+
+
+def layout_fingerprint(p_checkpoints: list) -> str:
+    """
+    Args:
+        p_checkpoints: checkpoint list of time_tracking.json
+    Returns:
+        short hash of the checkpoint positions, best times of another layout are not comparable
+    """
+    return hashlib.sha1(json.dumps(p_checkpoints, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class BestTimesCache:
+    """
+    On-disk copy of the all-time best times and the personal best times of every driver, so a restart without database
+    does not lose the records. Every time carries the wall clock time it was last set or confirmed by the database,
+    times older than the maximum age are stale and ignored. The file is replaced atomically, a crash while saving leaves
+    the previous file. The timing loop hands snapshots to a writer thread with save_in_background, so a slow disk never
+    delays timing.
+    """
+
+    def __init__(self, p_path: str, p_max_age_hours: float, p_layout: str) -> None:
+        """
+        Args:
+            p_path: path of the cache file
+            p_max_age_hours: age after which an entry is stale, 0 never treats entries as stale
+            p_layout: layout_fingerprint of the current checkpoints, a cache of another layout is discarded
+        """
+        self.__path = p_path
+        self.__max_age_s = p_max_age_hours * 3600
+        self.__layout = p_layout
+        self.__all_time: dict | None = None
+        self.__drivers: dict = {}
+        # snapshot waiting for the writer thread, a newer one replaces it
+        self.__condition = threading.Condition()
+        self.__pending: dict | None = None
+        self.__closed = False
+        self.__writer: threading.Thread | None = None
+        self.__load()
+
+    def __load(self) -> None:
+        try:
+            with open(self.__path, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as error:
+            logger.warning("ignoring unreadable best times cache %s: %s", self.__path, error)
+            return
+        if data.get("version") != BEST_TIMES_CACHE_VERSION or data.get("layout") != self.__layout:
+            logger.info("best times cache %s has another version or checkpoint layout, starting empty", self.__path)
+            return
+        self.__all_time = data.get("all_time")
+        self.__drivers = data.get("drivers", {})
+
+    def set_layout(self, p_layout: str) -> None:
+        """
+        switches to another checkpoint layout, the entries of the previous layout are dropped
+        Args:
+            p_layout: layout_fingerprint of the new checkpoints
+        """
+        if p_layout != self.__layout:
+            self.__layout = p_layout
+            self.__all_time = None
+            self.__drivers = {}
+
+    def __fresh_entry(self, p_entry: dict | None) -> dict:
+        """
+        Returns:
+            entry with only the times that are not stale
+        """
+        if p_entry is None:
+            return {"times": {}, "updated": {}}
+        now = time.time()
+        fresh = [
+            key
+            for key, updated in p_entry["updated"].items()
+            if not self.__max_age_s or now - updated <= self.__max_age_s
+        ]
+        return {
+            "times": {key: p_entry["times"][key] for key in fresh},
+            "updated": {key: p_entry["updated"][key] for key in fresh},
+        }
+
+    def __fresh(self, p_entry: dict | None) -> dict | None:
+        return self.__fresh_entry(p_entry)["times"] or None
+
+    def all_time_best(self) -> dict | None:
+        """
+        Returns:
+            the cached all-time best times, None if there are none or they are stale
+        """
+        return self.__fresh(self.__all_time)
+
+    def driver_best(self, p_driver: str | None) -> dict | None:
+        """
+        Returns:
+            the cached personal best times of the driver, None if there are none or they are stale
+        """
+        return self.__fresh(self.__drivers.get(p_driver))
+
+    def __merge(self, p_entry: dict | None, p_records: dict) -> dict:
+        entry = self.__fresh_entry(p_entry)
+        now = time.time()
+        for key, record in p_records.items():
+            entry["times"][key] = record
+            entry["updated"][key] = now
+        return entry
+
+    def update_all_time(self, p_records: dict) -> None:
+        """
+        Args:
+            p_records: new all-time records in the format of the database, only the improved sectors
+        """
+        self.__all_time = self.__merge(self.__all_time, p_records)
+
+    def update_driver(self, p_driver: str | None, p_records: dict) -> None:
+        """
+        Args:
+            p_driver: name of the driver, records of an unknown driver (None) are not kept
+            p_records: new personal records in the format of the database, only the improved sectors
+        """
+        if p_driver is not None:
+            self.__drivers[p_driver] = self.__merge(self.__drivers.get(p_driver), p_records)
+
+    def reconcile(self, p_database: dict) -> dict:
+        """
+        merges the best times received from the database with the cached ones. Records only ever improve, so the
+        faster time of each sector wins; a fresh cache therefore keeps records the database has not seen yet, a stale
+        one is overruled by the database. Only the times taken from the database count as confirmed, a cached time
+        that wins keeps the time it was set and still expires.
+        Args:
+            p_database: best times received from the database
+        Returns:
+            dict, the merged best times, also stored as the new all-time entry
+        """
+        entry = self.__fresh_entry(self.__all_time)
+        now = time.time()
+        for key, database_time in p_database.items():
+            if key not in entry["times"] or database_time <= entry["times"][key]:
+                entry["times"][key] = database_time
+                entry["updated"][key] = now
+        self.__all_time = entry
+        return dict(entry["times"])
+
+    def __snapshot(self) -> dict:
+        # entries are always replaced and never changed in place, so a copy of the driver dict is enough
+        return {
+            "version": BEST_TIMES_CACHE_VERSION,
+            "layout": self.__layout,
+            "all_time": self.__all_time,
+            "drivers": dict(self.__drivers),
+        }
+
+    def save_in_background(self) -> None:
+        """
+        hands a snapshot of the cache to the writer thread, which is started on first use. A snapshot still waiting to
+        be written is replaced by the newer one
+        """
+        with self.__condition:
+            self.__pending = self.__snapshot()
+            if self.__writer is None:
+                self.__closed = False
+                self.__writer = threading.Thread(target=self.__write_worker, name="best_times_cache", daemon=True)
+                self.__writer.start()
+            self.__condition.notify()
+
+    def __write_worker(self) -> None:
+        while True:
+            with self.__condition:
+                while self.__pending is None and not self.__closed:
+                    self.__condition.wait()
+                if self.__pending is None:
+                    return
+                data, self.__pending = self.__pending, None
+            self.__write(data)
+
+    def close(self) -> None:
+        """
+        waits until a pending snapshot is written and ends the writer thread, a later save_in_background starts it again
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+            writer, self.__writer = self.__writer, None
+        if writer is not None:
+            writer.join()
+
+    def __write(self, p_data: dict) -> None:
+        """
+        writes the data to a temporary file next to the cache file and replaces the cache file with it
+        """
+        directory = os.path.dirname(os.path.abspath(self.__path))
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".best_times_", suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "w") as file:
+                json.dump(p_data, file, indent=4)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, self.__path)
+        except OSError as error:
+            logger.warning("could not save the best times cache %s: %s", self.__path, error)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
@@ -5,6 +5,8 @@ import pynng
 import numpy as np
 
 from time_tracking.utils import read_config
+from time_tracking.frame_pipeline import frame_view
+from time_tracking.recording import RecordingReader, FRAME
 
 
 class CheckpointDefiner:
@@ -17,7 +19,8 @@ class CheckpointDefiner:
 
             Debugging Only (!!DO NOT USE!!):
             `use_camera_stream:bool = True` -> If set to false it will show the video on the given `video_path`
-            `video_path:str = ""` -> If use_camera_stream is set to false it will try to read this video
+            `video_path:str = ""` -> If use_camera_stream is set to false it will try to read this recording (see
+            recording.py) or video file
 
         Output:
         `None`
@@ -44,10 +47,15 @@ class CheckpointDefiner:
         Output:
         `None`
         """
+        # frames without frame header, frames with header carry their own size
+        sub_frame_config = self.__pynng_config["pynng"]["subscribers"]["__sub_frame"]
+        self.__raw_frame_shape = tuple(sub_frame_config.get("raw_shape", (990, 1332, 3)))
+        self.__recorded_frames = None
         if self.__use_camera_stream:
             self.__define_image_receiver()
-            # self.__RESHAPE_VIDEO_SIZE = (480, 640, 3)
-            self.__RESHAPE_VIDEO_SIZE = (990, 1332, 3)
+            self.__read_new_frame()
+        elif video_path.endswith(".rec"):
+            self.__recorded_frames = RecordingReader(video_path).records(p_streams=(FRAME,))
             self.__read_new_frame()
         else:
             self.__video_cap = cv2.VideoCapture(video_path)
@@ -117,8 +125,12 @@ class CheckpointDefiner:
         """
         if self.__use_camera_stream:
             frame_bytes = self.__frame_receiver.recv()
-            frame = np.frombuffer(frame_bytes, dtype=np.uint8)
-            self.__frame = frame.reshape(self.__RESHAPE_VIDEO_SIZE)
+            self.__frame, _, _ = frame_view(frame_bytes, self.__raw_frame_shape)
+        elif self.__recorded_frames is not None:
+            record = next(self.__recorded_frames, None)
+            if record is None:
+                raise IndexError("Frame could not be read. Recording ended.")
+            self.__frame, _, _ = frame_view(record[2], self.__raw_frame_shape)
         else:
             success, self.__frame = self.__video_cap.read()
             if not success:
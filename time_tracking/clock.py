@@ -0,0 +1,45 @@
+# Copyright (C) 2023, NG:ITL
+import time
+
+NS_PER_SECOND = 1_000_000_000
+
+
+class MonotonicClock:
+    """
+    Default clock of the LapTimer. Integer nanoseconds of time.monotonic_ns(), which never jumps under NTP adjustments
+    and is shared by all processes of a host, so the vehicle tracking can stamp coordinates with the same clock.
+    """
+
+    def now_ns(self) -> int:
+        return time.monotonic_ns()
+
+
+class VirtualClock:
+    """
+    Clock that only moves when it is told to. Used to re-time recorded sessions faster than real time: the replay sets
+    the clock to the recorded timestamp of every message before it is handed to the LapTimer.
+    """
+
+    def __init__(self, p_start_ns: int = 0) -> None:
+        self.__now_ns = p_start_ns
+
+    def now_ns(self) -> int:
+        return self.__now_ns
+
+    def set_ns(self, p_now_ns: int) -> None:
+        self.__now_ns = p_now_ns
+
+    def advance_ns(self, p_duration_ns: int) -> None:
+        self.__now_ns += p_duration_ns
+
+
+def ns_to_seconds(p_duration_ns: int, p_digits: int = 2) -> float:
+    """
+    converts a duration to seconds, rounded for publishing
+    Args:
+        p_duration_ns: duration in nanoseconds
+        p_digits: number of decimal places
+    Returns:
+        float
+    """
+    return round(p_duration_ns / NS_PER_SECOND, p_digits)
@@ -0,0 +1,195 @@
+# Copyright (C) 2023, NG:ITL
+import numpy as np
+
+# edge length in pixels of the cells of the CheckpointGrid
+GRID_CELL_SIZE = 32
+# from this number of checkpoints on, the LapTimer prunes the checkpoints with a CheckpointGrid before testing them
+GRID_MIN_CHECKPOINTS = 32
+# below this number of checkpoints, testing them one by one with Checkpoint.crossing_fraction is faster than the
+# vectorized call, see benchmarks/crossing_engine_benchmark.py
+ENGINE_MIN_CHECKPOINTS = 24
+
+
+class CrossingEngine:
+    """
+    Keeps the endpoints of every timing line in contiguous arrays and tests a motion segment against all of them in a
+    single vectorized call. The arithmetic follows Point.calc_intersection/Point.prf_area step by step, so both return
+    the same results, including the collinear (div == 0) case.
+    """
+
+    def __init__(self, p_checkpoints: list) -> None:
+        """
+        Args:
+            p_checkpoints: Checkpoint objects, the index in this list is the index in the returned masks
+        """
+        self.__x1 = np.array([checkpoint.get_x1() for checkpoint in p_checkpoints], dtype=np.float64)
+        self.__y1 = np.array([checkpoint.get_y1() for checkpoint in p_checkpoints], dtype=np.float64)
+        self.__x2 = np.array([checkpoint.get_x2() for checkpoint in p_checkpoints], dtype=np.float64)
+        self.__y2 = np.array([checkpoint.get_y2() for checkpoint in p_checkpoints], dtype=np.float64)
+
+        # everything that only depends on the checkpoints is computed once
+        self.__xdiff = self.__x1 - self.__x2
+        self.__ydiff = self.__y1 - self.__y2
+        self.__det = self.__x1 * self.__y2 - self.__y1 * self.__x2
+        self.__min_x = np.minimum(self.__x1, self.__x2)
+        self.__max_x = np.maximum(self.__x1, self.__x2)
+        self.__min_y = np.minimum(self.__y1, self.__y2)
+        self.__max_y = np.maximum(self.__y1, self.__y2)
+
+    def __len__(self) -> int:
+        return len(self.__x1)
+
+    def crossed(self, p_start, p_end) -> np.ndarray:
+        """
+        tests the motion segment from p_start to p_end against every checkpoint
+        Args:
+            p_start: previous position of the car (anything indexable as [x, y])
+            p_end: current position of the car
+        Returns:
+            boolean array of shape (checkpoints,), True for every checkpoint the segment crosses
+        """
+        q1x, q1y, q2x, q2y = p_start[0], p_start[1], p_end[0], p_end[1]
+        bounds = (min(q1x, q2x), max(q1x, q2x), min(q1y, q2y), max(q1y, q2y))
+        return self.__intersect(q1x, q1y, q2x, q2y, bounds)[0]
+
+    def crossings(self, p_start, p_end) -> tuple:
+        """
+        like crossed, but also returns where on the motion segment each crossing happened
+        Args:
+            p_start: previous position of the car (anything indexable as [x, y])
+            p_end: current position of the car
+        Returns:
+            (ascending indices of the crossed checkpoints, fraction of the segment from p_start to each crossing)
+        """
+        q1x, q1y, q2x, q2y = p_start[0], p_start[1], p_end[0], p_end[1]
+        bounds = (min(q1x, q2x), max(q1x, q2x), min(q1y, q2y), max(q1y, q2y))
+        hits, x, y = self.__intersect(q1x, q1y, q2x, q2y, bounds)
+        indices = np.flatnonzero(hits)
+        return indices, segment_fraction(q1x, q1y, q2x, q2y, x[indices], y[indices])
+
+    def crossed_path(self, p_points: np.ndarray) -> np.ndarray:
+        """
+        tests every segment between consecutive points of a path against every checkpoint in one pass
+        Args:
+            p_points: (N, 2) array of positions in the order they were received
+        Returns:
+            boolean array of shape (N - 1, checkpoints), row i belongs to the segment from point i to point i + 1
+        """
+        return self.__intersect_path(p_points)[0]
+
+    def path_crossings(self, p_points: np.ndarray) -> list:
+        """
+        like crossed_path, but only returns the segments with crossings and where on the segment they happened
+        Args:
+            p_points: (N, 2) array of positions in the order they were received
+        Returns:
+            list of (segment index, ascending indices of the crossed checkpoints, fractions of the segment) in driving
+            order
+        """
+        hits, x, y = self.__intersect_path(p_points)
+        crossings = []
+        for segment in np.flatnonzero(hits.any(axis=1)):
+            indices = np.flatnonzero(hits[segment])
+            (q1x, q1y), (q2x, q2y) = p_points[segment, :2], p_points[segment + 1, :2]
+            fractions = segment_fraction(q1x, q1y, q2x, q2y, x[segment, indices], y[segment, indices])
+            crossings.append((segment, indices, fractions))
+        return crossings
+
+    def __intersect_path(self, p_points: np.ndarray) -> tuple:
+        q1x, q1y = p_points[:-1, 0:1], p_points[:-1, 1:2]
+        q2x, q2y = p_points[1:, 0:1], p_points[1:, 1:2]
+        bounds = (np.minimum(q1x, q2x), np.maximum(q1x, q2x), np.minimum(q1y, q2y), np.maximum(q1y, q2y))
+        return self.__intersect(q1x, q1y, q2x, q2y, bounds)
+
+    def __intersect(self, q1x, q1y, q2x, q2y, p_bounds: tuple) -> tuple:
+        """
+        Point.calc_intersection for every checkpoint, q* are scalars or (segments, 1) columns that broadcast against
+        the checkpoint arrays, p_bounds is (min x, max x, min y, max y) of the motion segments.
+        Returns (hits, x, y) with the intersection coordinates of the infinite lines.
+        """
+        q_min_x, q_max_x, q_min_y, q_max_y = p_bounds
+        q_xdiff = q1x - q2x
+        q_ydiff = q1y - q2y
+        q_det = q1x * q2y - q1y * q2x
+
+        div = self.__xdiff * q_ydiff - q_xdiff * self.__ydiff
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = (self.__det * q_xdiff - q_det * self.__xdiff) / div
+            y = (self.__det * q_ydiff - q_det * self.__ydiff) / div
+
+        hits = div != 0
+        hits &= self.__min_x <= x
+        hits &= x <= self.__max_x
+        hits &= self.__min_y <= y
+        hits &= y <= self.__max_y
+        hits &= q_min_x <= x
+        hits &= x <= q_max_x
+        hits &= q_min_y <= y
+        hits &= y <= q_max_y
+        return hits, x, y
+
+
+def segment_fraction(q1x, q1y, q2x, q2y, p_x, p_y):
+    """
+    position of the intersection (p_x, p_y) on the motion segment from q1 to q2, as fraction of the segment. Measured
+    along the axis the segment moves the most on, so that the result is well conditioned.
+    Args:
+        q1x, q1y: start of the motion segment
+        q2x, q2y: end of the motion segment
+        p_x, p_y: intersection coordinates, scalars or arrays
+    Returns:
+        fraction between 0 (q1) and 1 (q2), same shape as p_x
+    """
+    if abs(q2x - q1x) >= abs(q2y - q1y):
+        fraction = (p_x - q1x) / (q2x - q1x)
+    else:
+        fraction = (p_y - q1y) / (q2y - q1y)
+    return np.clip(fraction, 0.0, 1.0)
+
+
+class CheckpointGrid:
+    """
+    Uniform grid over the frame, every cell knows the checkpoints whose bounding box overlaps it. A motion segment only
+    has to be tested against the checkpoints registered in the cells its own bounding box touches, so the cost of an
+    update depends on the checkpoint density around the car and not on the total number of checkpoints.
+    """
+
+    def __init__(self, p_checkpoints: list, p_cell_size: int = GRID_CELL_SIZE) -> None:
+        """
+        Args:
+            p_checkpoints: Checkpoint objects, the returned candidates are indices into this list
+            p_cell_size: edge length of a grid cell in pixels
+        """
+        self.__cell_size = p_cell_size
+        self.__cells: dict = {}
+        for index, checkpoint in enumerate(p_checkpoints):
+            x1, y1, x2, y2 = checkpoint.get_x1(), checkpoint.get_y1(), checkpoint.get_x2(), checkpoint.get_y2()
+            for cell in self.__cells_in_box(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)):
+                self.__cells.setdefault(cell, []).append(index)
+
+    def __cells_in_box(self, p_min_x, p_min_y, p_max_x, p_max_y) -> list:
+        size = self.__cell_size
+        return [
+            (cell_x, cell_y)
+            for cell_x in range(int(p_min_x // size), int(p_max_x // size) + 1)
+            for cell_y in range(int(p_min_y // size), int(p_max_y // size) + 1)
+        ]
+
+    def candidates(self, p_start, p_end) -> list:
+        """
+        returns the checkpoints that may be crossed by the motion segment from p_start to p_end
+        Args:
+            p_start: previous position of the car (anything indexable as [x, y])
+            p_end: current position of the car
+        Returns:
+            ascending list of checkpoint indices
+        """
+        cells = self.__cells_in_box(
+            min(p_start[0], p_end[0]), min(p_start[1], p_end[1]), max(p_start[0], p_end[0]), max(p_start[1], p_end[1])
+        )
+        if len(cells) == 1:
+            return self.__cells.get(cells[0], [])
+        candidates: set = set()
+        for cell in cells:
+            candidates.update(self.__cells.get(cell, ()))
+        return sorted(candidates)
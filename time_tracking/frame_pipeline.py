@@ -0,0 +1,312 @@
+# Copyright (C) 2023, NG:ITL
+import threading
+
+import cv2
+import numpy as np
+import pynng
+
+from time_tracking.clock import NS_PER_SECOND
+from time_tracking.wire_format import decode_frame_header
+
+
+def frame_view(p_data, p_default_shape: tuple) -> tuple:
+    """
+    interprets a received frame without copying the pixels
+    Args:
+        p_data: received frame, optionally starting with the header of wire_format.encode_frame_header
+        p_default_shape: (height, width, channels) of frames without header, those are uint8
+    Returns:
+        (read-only pixel view of the shape of the frame, frame index or None, capture timestamp in ns or None)
+    """
+    header = decode_frame_header(p_data)
+    if header is None:
+        return np.frombuffer(p_data, dtype=np.uint8).reshape(p_default_shape), None, None
+    shape, dtype, index, timestamp_ns, offset = header
+    count = shape[0] * shape[1] * shape[2]
+    return np.frombuffer(p_data, dtype=dtype, count=count, offset=offset).reshape(shape), index, timestamp_ns
+
+
+class FrameBuffer:
+    """
+    Reusable, writable frames, one per resolution, allocated with the first frame of that resolution. Received frames
+    are copied into it, the checkpoint overlay is drawn on it in place and it is published straight from its memory, so
+    no frame sized buffer is allocated per frame.
+    """
+
+    def __init__(self, p_default_shape: tuple) -> None:
+        """
+        Args:
+            p_default_shape: (height, width, channels) of frames that are sent without header
+        """
+        self.__default_shape = p_default_shape
+        # (shape, dtype) -> (frame, cdata view on the frame memory accepted by Socket.send without a copy)
+        self.__buffers: dict[tuple, tuple] = {}
+        self.__frame: np.ndarray | None = None
+        self.__payload = None
+        # index of the last frame with header, gaps in the indices are frames the vehicle tracking sent but that were
+        # never received
+        self.__frame_index: int | None = None
+        self.__missed_frames = 0
+
+    def get_frame(self) -> np.ndarray | None:
+        return self.__frame
+
+    def get_missed_frames(self) -> int:
+        return self.__missed_frames
+
+    def __select(self, p_shape: tuple, p_dtype: np.dtype) -> np.ndarray:
+        key = (p_shape, p_dtype)
+        if key not in self.__buffers:
+            frame = np.empty(p_shape, dtype=p_dtype)
+            self.__buffers[key] = (frame, pynng.ffi.from_buffer(frame))
+        self.__frame, self.__payload = self.__buffers[key]
+        return self.__frame
+
+    def __count_missed(self, p_index: int | None) -> None:
+        # a lower index means the vehicle tracking restarted, nothing was missed
+        if p_index is not None and self.__frame_index is not None and p_index > self.__frame_index + 1:
+            self.__missed_frames += p_index - self.__frame_index - 1
+        self.__frame_index = p_index
+
+    def load(self, p_data) -> np.ndarray:
+        """
+        copies a received frame into the buffer of its resolution
+        Args:
+            p_data: received frame (bytes or any other buffer), with or without header
+        Returns:
+            the writable frame
+        """
+        pixels, index, _ = frame_view(p_data, self.__default_shape)
+        self.__count_missed(index)
+        frame = self.__frame
+        if frame is None or frame.shape != pixels.shape or frame.dtype != pixels.dtype:
+            frame = self.__select(pixels.shape, pixels.dtype)
+        np.copyto(frame, pixels)
+        return frame
+
+    def payload(self):
+        """
+        Returns:
+            the memory of the current frame in a form pynng can send directly
+        """
+        return self.__payload
+
+
+class CheckpointOverlay:
+    """
+    The timing lines rasterized once into a color layer and a mask of the frame size. Every frame gets the overlay
+    with a single masked copy, so the cost per frame does not depend on the number of checkpoints. The cache is rebuilt
+    when the checkpoints are reloaded or the frame size or pixel type changes.
+    """
+
+    def __init__(self, p_checkpoints: list) -> None:
+        """
+        Args:
+            p_checkpoints: Checkpoint objects that are drawn
+        """
+        self.__checkpoints = p_checkpoints
+        self.__layer: np.ndarray | None = None
+        self.__mask: np.ndarray | None = None
+
+    def invalidate(self, p_checkpoints: list) -> None:
+        """
+        replaces the checkpoints, the overlay is rasterized again with the next frame
+        Args:
+            p_checkpoints: Checkpoint objects that are drawn from now on
+        """
+        self.__checkpoints = p_checkpoints
+        self.__layer = None
+        self.__mask = None
+
+    def __rasterize(self, p_shape: tuple, p_dtype: np.dtype) -> tuple:
+        layer = np.zeros(p_shape, dtype=p_dtype)
+        for checkpoint in self.__checkpoints:
+            checkpoint.draw_checkpoint(layer)
+        # the timing lines are never drawn in black, so every pixel they cover is non-zero
+        mask = np.asarray(layer.any(axis=2), dtype=np.uint8)
+        self.__layer, self.__mask = layer, mask
+        return layer, mask
+
+    def apply(self, p_frame: np.ndarray) -> None:
+        """
+        draws the overlay onto the frame in place
+        Args:
+            p_frame: writable frame
+        """
+        layer, mask = self.__layer, self.__mask
+        if layer is None or mask is None or layer.shape != p_frame.shape or layer.dtype != p_frame.dtype:
+            layer, mask = self.__rasterize(p_frame.shape, p_frame.dtype)
+        cv2.copyTo(layer, mask, p_frame)
+
+
+# encodings of the published frames, "raw" sends the pixels of the frame buffer without copy
+FRAME_ENCODINGS = ("raw", "jpeg", "png")
+
+
+class FramePublisher:
+    """
+    Publishes the drawn frames on __pub_frame. Raw frames are sent straight from the frame buffer. JPEG and PNG frames
+    are copied into a pending slot and compressed and sent by a worker thread, so the draw loop never waits for the
+    encoder; a frame still pending when the next one arrives is replaced and counted as dropped.
+    """
+
+    def __init__(self, p_socket, p_encoding: str = "raw", p_quality: int = 80) -> None:
+        """
+        Args:
+            p_socket: pynng socket the frames are published on
+            p_encoding: one of FRAME_ENCODINGS
+            p_quality: JPEG quality from 0 to 100, unused by the other encodings
+        """
+        if p_encoding not in FRAME_ENCODINGS:
+            raise ValueError(f"Unknown frame encoding {p_encoding}, expected one of {FRAME_ENCODINGS}")
+        self.__socket = p_socket
+        self.__encoding = p_encoding
+        self.__extension = f".{p_encoding}" if p_encoding != "jpeg" else ".jpg"
+        self.__params = [cv2.IMWRITE_JPEG_QUALITY, p_quality] if p_encoding == "jpeg" else []
+        self.__published_frames = 0
+        self.__dropped_frames = 0
+
+        # the draw loop fills __pending, the worker swaps it with __encoding and compresses that one
+        self.__condition = threading.Condition()
+        self.__pending: np.ndarray | None = None
+        self.__encoding_frame: np.ndarray | None = None
+        self.__has_pending = False
+        self.__closed = False
+        self.__worker: threading.Thread | None = None
+        if p_encoding != "raw":
+            self.__worker = threading.Thread(target=self.__encode_worker, name="frame_encoder", daemon=True)
+            self.__worker.start()
+
+    def get_encoding(self) -> str:
+        return self.__encoding
+
+    def get_published_frames(self) -> int:
+        return self.__published_frames
+
+    def get_dropped_frames(self) -> int:
+        return self.__dropped_frames
+
+    def publish(self, p_frame_buffer: FrameBuffer) -> None:
+        """
+        publishes the current frame of the buffer or hands it to the encoder thread, nothing is published before the
+        buffer received its first frame
+        Args:
+            p_frame_buffer: buffer holding the drawn frame
+        """
+        frame = p_frame_buffer.get_frame()
+        if frame is None:
+            return
+        if self.__worker is None:
+            self.__socket.send(p_frame_buffer.payload())
+            self.__published_frames += 1
+            return
+
+        with self.__condition:
+            if self.__pending is None or self.__pending.shape != frame.shape or self.__pending.dtype != frame.dtype:
+                self.__pending = np.empty_like(frame)
+            np.copyto(self.__pending, frame)
+            if self.__has_pending:
+                self.__dropped_frames += 1
+            self.__has_pending = True
+            self.__condition.notify()
+
+    def __encode_worker(self) -> None:
+        while True:
+            with self.__condition:
+                while not self.__has_pending and not self.__closed:
+                    self.__condition.wait()
+                if self.__closed:
+                    return
+                self.__pending, self.__encoding_frame = self.__encoding_frame, self.__pending
+                self.__has_pending = False
+                frame = self.__encoding_frame
+            if frame is None:
+                continue
+            success, encoded = cv2.imencode(self.__extension, frame, self.__params)
+            if success:
+                self.__socket.send(pynng.ffi.from_buffer(encoded))
+                self.__published_frames += 1
+
+    def close(self) -> None:
+        """
+        stops the encoder thread, a frame still pending is not published
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        if self.__worker is not None:
+            self.__worker.join()
+
+
+# slowest the governor lets the visualisation become while the timing is behind, and its first backoff step
+GOVERNOR_MAX_INTERVAL_NS = NS_PER_SECOND
+GOVERNOR_MIN_BACKOFF_NS = NS_PER_SECOND // 60
+
+
+class FrameGovernor:
+    """
+    Decides per received frame whether the overlay is drawn, published and shown. Frames are skipped to keep the target
+    frame rate and, while the coordinate processing falls behind by more than the allowed lag, to give the timing the
+    CPU. Each frame skipped for lag doubles the frame interval, once the lag is back below half the limit every drawn
+    frame halves it again until the target frame rate is reached, below the first backoff step it returns to the target
+    at once. The time a drawn frame takes is measured as well.
+    """
+
+    def __init__(self, p_target_fps: float = 0.0, p_max_lag_ms: float = 20.0) -> None:
+        """
+        Args:
+            p_target_fps: maximum number of visualised frames per second, 0 visualises every frame
+            p_max_lag_ms: coordinate lag in milliseconds above which frames are skipped
+        """
+        self.__target_interval_ns = round(NS_PER_SECOND / p_target_fps) if p_target_fps > 0 else 0
+        self.__interval_ns = self.__target_interval_ns
+        self.__max_lag_ns = round(p_max_lag_ms * 1_000_000)
+        self.__next_frame_ns = 0
+        self.__draw_time_ns = 0
+        self.__drawn_frames = 0
+        self.__skipped_rate = 0
+        self.__skipped_lag = 0
+
+    def admit(self, p_now_ns: int, p_lag_ns: int) -> bool:
+        """
+        Args:
+            p_now_ns: current instant in nanoseconds
+            p_lag_ns: how far the coordinate processing is behind, in nanoseconds
+        Returns:
+            True if the frame is visualised, False if it is skipped
+        """
+        if p_lag_ns > self.__max_lag_ns:
+            self.__interval_ns = min(max(2 * self.__interval_ns, GOVERNOR_MIN_BACKOFF_NS), GOVERNOR_MAX_INTERVAL_NS)
+            self.__skipped_lag += 1
+            return False
+        if p_now_ns < self.__next_frame_ns:
+            self.__skipped_rate += 1
+            return False
+        if self.__interval_ns > self.__target_interval_ns and 2 * p_lag_ns < self.__max_lag_ns:
+            halved = self.__interval_ns // 2
+            # below the first backoff step the target interval is restored at once
+            self.__interval_ns = max(halved if halved >= GOVERNOR_MIN_BACKOFF_NS else 0, self.__target_interval_ns)
+        self.__next_frame_ns = max(self.__next_frame_ns + self.__interval_ns, p_now_ns)
+        self.__drawn_frames += 1
+        return True
+
+    def record_draw(self, p_duration_ns: int) -> None:
+        """
+        Args:
+            p_duration_ns: time it took to draw, publish and show an admitted frame
+        """
+        # exponential moving average over roughly the last 16 frames
+        self.__draw_time_ns += (p_duration_ns - self.__draw_time_ns) // 16
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict with the frame counters, the current frame interval and the average draw time in milliseconds
+        """
+        return {
+            "frames_drawn": self.__drawn_frames,
+            "frames_skipped_rate": self.__skipped_rate,
+            "frames_skipped_lag": self.__skipped_lag,
+            "frame_interval_ms": self.__interval_ns / 1_000_000,
+            "draw_time_ms": self.__draw_time_ns / 1_000_000,
+        }
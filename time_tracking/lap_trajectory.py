@@ -0,0 +1,245 @@
+# Copyright (C) 2023, NG:ITL
+import math
+
+import numpy as np
+
+# samples preallocated for a lap, 60 s at 250 Hz, the arrays double their size when a lap gets longer
+INITIAL_LAP_SAMPLES = 15_000
+
+
+class LapTrajectory:
+    """
+    Samples (timestamp, x, y) of the current lap in preallocated arrays. When they are full the arrays double their
+    capacity, so appending is amortized O(1) and a lap of any length reallocates only a few times. The capacity is kept
+    from lap to lap.
+    """
+
+    def __init__(self, p_initial_capacity: int = INITIAL_LAP_SAMPLES) -> None:
+        """
+        Args:
+            p_initial_capacity: number of samples preallocated
+        """
+        capacity = max(1, p_initial_capacity)
+        self.__times = np.empty(capacity, dtype=np.int64)
+        self.__positions = np.empty((capacity, 2), dtype=np.float64)
+        self.__count = 0
+        self.__start_ns = 0
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def get_capacity(self) -> int:
+        return len(self.__times)
+
+    def get_start_ns(self) -> int:
+        return self.__start_ns
+
+    def start(self, p_start_ns: int) -> None:
+        """
+        drops the samples and starts the trajectory of a new lap
+        Args:
+            p_start_ns: instant the lap started in nanoseconds
+        """
+        self.__count = 0
+        self.__start_ns = p_start_ns
+
+    def __reserve(self, p_count: int) -> None:
+        capacity = len(self.__times)
+        if p_count <= capacity:
+            return
+        while capacity < p_count:
+            capacity *= 2
+        times = np.empty(capacity, dtype=np.int64)
+        positions = np.empty((capacity, 2), dtype=np.float64)
+        times[: self.__count] = self.__times[: self.__count]
+        positions[: self.__count] = self.__positions[: self.__count]
+        self.__times = times
+        self.__positions = positions
+
+    def append(self, p_x: float, p_y: float, p_time_ns: int) -> None:
+        """
+        Args:
+            p_x: x coordinate in pixels
+            p_y: y coordinate in pixels
+            p_time_ns: timestamp of the position in nanoseconds
+        """
+        i = self.__count
+        if i == len(self.__times):
+            self.__reserve(i + 1)
+        self.__times[i] = p_time_ns
+        self.__positions[i, 0] = p_x
+        self.__positions[i, 1] = p_y
+        self.__count = i + 1
+
+    def extend(self, p_positions: np.ndarray, p_times_ns: np.ndarray) -> None:
+        """
+        appends a batch of samples in one go
+        Args:
+            p_positions: (N, 2) array of positions in the order they were received
+            p_times_ns: (N,) array of their timestamps in nanoseconds
+        """
+        start = self.__count
+        end = start + len(p_times_ns)
+        self.__reserve(end)
+        self.__times[start:end] = p_times_ns
+        self.__positions[start:end] = p_positions
+        self.__count = end
+
+    def get_times(self) -> np.ndarray:
+        """
+        Returns:
+            view of the timestamps of the samples in nanoseconds, valid until the next sample is added
+        """
+        return self.__times[: self.__count]
+
+    def get_positions(self) -> np.ndarray:
+        """
+        Returns:
+            (N, 2) view of the positions of the samples, valid until the next sample is added
+        """
+        return self.__positions[: self.__count]
+
+
+class RecordedLap:
+    """
+    Finished lap of a driver with its samples, the times relative to the start of the lap
+    """
+
+    __slots__ = ("driver", "lap_time", "times_ns", "positions")
+
+    def __init__(self, p_driver: str | None, p_lap_time: float, p_times_ns: np.ndarray, p_positions: np.ndarray):
+        """
+        Args:
+            p_driver: driver of the lap
+            p_lap_time: published lap time in seconds
+            p_times_ns: (N,) array of the sample times since the start of the lap in nanoseconds, owned by the lap
+            p_positions: (N, 2) array of the sample positions, owned by the lap
+        """
+        self.driver = p_driver
+        self.lap_time = p_lap_time
+        self.times_ns = p_times_ns
+        self.positions = p_positions
+
+
+class ReferenceLap:
+    """
+    Index of a recorded lap the live delta is measured against. The cumulative arc length and the time of every sample
+    are precomputed, and a uniform grid sorted by cell number maps every cell to the segments of the lap passing
+    through it. A position is projected only onto the segments in the 3x3 cells around it, found with two binary
+    searches per row of cells, so a lookup does not depend on the length of the lap. The projection gives how far
+    along the lap the car is and when the reference lap was at that point.
+    """
+
+    def __init__(self, p_lap: RecordedLap, p_cell_px: float = 32.0, p_window: float = 0.1) -> None:
+        """
+        Args:
+            p_lap: recorded lap with at least two samples
+            p_cell_px: size of the grid cells in pixels, it is also the largest distance from the lap a position is
+                projected onto it from
+            p_window: fraction of the lap length a projection may be away from the previous one, keeps the position
+                on the right part of the lap where it passes the same place twice
+        """
+        self.__lap = p_lap
+        positions = p_lap.positions
+        self.__starts = positions[:-1]
+        self.__vectors = np.diff(positions, axis=0)
+        self.__lengths = np.hypot(*self.__vectors.T)
+        self.__squared_lengths = self.__lengths**2
+        self.__arc = np.concatenate(([0.0], np.cumsum(self.__lengths)))
+        self.__times = p_lap.times_ns
+
+        # every segment is entered in all cells it passes through, so every segment closer to a position than a cell
+        # is entered in one of the 3x3 cells around it. A segment is split into pieces of at most one cell for that,
+        # each piece lies in at most 2x2 cells; a jump of the tracking in the lap adds cells but does not grow them.
+        self.__cell = p_cell_px
+        pieces = np.maximum(np.ceil(self.__lengths / self.__cell), 1).astype(np.int64)
+        segments = np.repeat(np.arange(len(self.__lengths)), pieces)
+        # index of every piece within its segment
+        piece = np.arange(len(segments)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        piece_vectors = self.__vectors[segments] / pieces[segments, None]
+        piece_starts = self.__starts[segments] + piece[:, None] * piece_vectors
+        piece_ends = piece_starts + piece_vectors
+        low = np.floor(np.minimum(piece_starts, piece_ends) / self.__cell).astype(np.int64)
+        high = np.floor(np.maximum(piece_starts, piece_ends) / self.__cell).astype(np.int64)
+        origin = low.min(axis=0)
+        low -= origin
+        high -= origin
+        self.__origin = (int(origin[0]), int(origin[1]))
+        self.__columns = int(high[:, 0].max()) + 1
+        self.__rows = int(high[:, 1].max()) + 1
+        key_parts = []
+        segment_parts = []
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            column = low[:, 0] + dx
+            row = low[:, 1] + dy
+            inside = (column <= high[:, 0]) & (row <= high[:, 1])
+            key_parts.append(row[inside] * self.__columns + column[inside])
+            segment_parts.append(segments[inside])
+        keys = np.concatenate(key_parts)
+        order = np.argsort(keys, kind="stable")
+        self.__cell_keys = keys[order]
+        self.__cell_segments = np.concatenate(segment_parts)[order]
+        self.__window = max(p_window * self.get_length(), 2 * self.__cell)
+
+    def get_lap(self) -> RecordedLap:
+        return self.__lap
+
+    def get_length(self) -> float:
+        """
+        Returns:
+            arc length of the lap in pixels
+        """
+        return float(self.__arc[-1])
+
+    def __candidates(self, p_x: float, p_y: float) -> np.ndarray:
+        column = math.floor(p_x / self.__cell) - self.__origin[0]
+        row = math.floor(p_y / self.__cell) - self.__origin[1]
+        first_column = max(column - 1, 0)
+        last_column = min(column + 1, self.__columns - 1)
+        if first_column > last_column:
+            return self.__cell_segments[:0]
+        pieces = []
+        for r in range(max(row - 1, 0), min(row + 1, self.__rows - 1) + 1):
+            start = np.searchsorted(self.__cell_keys, r * self.__columns + first_column, side="left")
+            end = np.searchsorted(self.__cell_keys, r * self.__columns + last_column, side="right")
+            pieces.append(self.__cell_segments[start:end])
+        if not pieces:
+            return self.__cell_segments[:0]
+        # a segment passing through several of the cells is tested more than once, which does not change the result
+        return np.concatenate(pieces)
+
+    def locate(self, p_x: float, p_y: float, p_expected_arc: float | None = None) -> tuple | None:
+        """
+        projects a position onto the closest segment of the lap
+        Args:
+            p_x: x coordinate in pixels
+            p_y: y coordinate in pixels
+            p_expected_arc: arc length of the previous projection, segments further along the lap than the window are
+                only used if there is no other segment close to the position
+        Returns:
+            (arc length of the projection in pixels, time of the reference lap at it in nanoseconds since the start of
+            the lap), None if no segment is closer than a cell
+        """
+        candidates = self.__candidates(p_x, p_y)
+        if len(candidates) == 0:
+            return None
+        starts = self.__starts[candidates]
+        vectors = self.__vectors[candidates]
+        squared_lengths = self.__squared_lengths[candidates]
+        offsets = np.array((p_x, p_y)) - starts
+        dots = (offsets * vectors).sum(axis=1)
+        fractions = np.clip(np.divide(dots, squared_lengths, out=np.zeros_like(dots), where=squared_lengths > 0), 0, 1)
+        distances = ((offsets - fractions[:, None] * vectors) ** 2).sum(axis=1)
+        arcs = self.__arc[candidates] + fractions * self.__lengths[candidates]
+        close = distances <= self.__cell**2
+        if p_expected_arc is not None:
+            expected = close & (np.abs(arcs - p_expected_arc) <= self.__window)
+            if expected.any():
+                close = expected
+        if not close.any():
+            return None
+        best = int(np.argmin(np.where(close, distances, np.inf)))
+        segment = candidates[best]
+        start_time = self.__times[segment]
+        time_ns = start_time + round(float(fractions[best]) * float(self.__times[segment + 1] - start_time))
+        return float(arcs[best]), int(time_ns)
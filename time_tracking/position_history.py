@@ -0,0 +1,136 @@
+# Copyright (C) 2023, NG:ITL
+import math
+
+import numpy as np
+
+from time_tracking.clock import NS_PER_SECOND
+
+
+class PositionHistory:
+    """
+    Ring buffer of the most recent positions of the car and their timestamps, preallocated for the configured number of
+    seconds at the highest expected coordinate rate. Every sample is written twice, at its slot and one capacity
+    further, so the newest k samples are always one contiguous slice: appending is O(1) and last() and window() return
+    views into the buffer without copying. Views are only valid until the samples they show are overwritten.
+    """
+
+    def __init__(self, p_seconds: float = 2.0, p_max_rate_hz: float = 250.0) -> None:
+        """
+        Args:
+            p_seconds: how much history is kept at p_max_rate_hz, at higher rates the history gets shorter
+            p_max_rate_hz: highest expected coordinate rate
+        """
+        self.__capacity = max(2, math.ceil(p_seconds * p_max_rate_hz))
+        self.__positions = np.zeros((2 * self.__capacity, 2), dtype=np.float64)
+        self.__times = np.zeros(2 * self.__capacity, dtype=np.int64)
+        # slot the next sample is written to, between 0 and capacity
+        self.__head = 0
+        self.__count = 0
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def get_capacity(self) -> int:
+        return self.__capacity
+
+    def clear(self) -> None:
+        self.__head = 0
+        self.__count = 0
+
+    def append(self, p_x: float, p_y: float, p_time_ns: int) -> None:
+        """
+        Args:
+            p_x: x coordinate in pixels
+            p_y: y coordinate in pixels
+            p_time_ns: timestamp of the position in nanoseconds
+        """
+        head = self.__head
+        mirror = head + self.__capacity
+        positions = self.__positions
+        positions[head, 0] = positions[mirror, 0] = p_x
+        positions[head, 1] = positions[mirror, 1] = p_y
+        self.__times[head] = self.__times[mirror] = p_time_ns
+        self.__head = head + 1 if head + 1 < self.__capacity else 0
+        if self.__count < self.__capacity:
+            self.__count += 1
+
+    def extend(self, p_positions: np.ndarray, p_times_ns: np.ndarray) -> None:
+        """
+        appends a batch of samples in one go
+        Args:
+            p_positions: (N, 2) array of positions in the order they were received
+            p_times_ns: (N,) array of their timestamps in nanoseconds
+        """
+        capacity = self.__capacity
+        count = len(p_times_ns)
+        if count > capacity:
+            p_positions, p_times_ns, count = p_positions[-capacity:], p_times_ns[-capacity:], capacity
+        # slots of the batch, every one of them written at the slot and at its mirror
+        slots = (self.__head + np.arange(count)) % capacity
+        for offset in (0, capacity):
+            self.__positions[slots + offset] = p_positions
+            self.__times[slots + offset] = p_times_ns
+        self.__head = (self.__head + count) % capacity
+        self.__count = min(self.__count + count, capacity)
+
+    def newest(self) -> tuple | None:
+        """
+        Returns:
+            (x, y, timestamp in ns) of the newest sample, None if the history is empty
+        """
+        if self.__count == 0:
+            return None
+        i = self.__head - 1 + self.__capacity
+        return float(self.__positions[i, 0]), float(self.__positions[i, 1]), int(self.__times[i])
+
+    def last(self, p_count: int) -> tuple:
+        """
+        Args:
+            p_count: number of samples, at most the number kept
+        Returns:
+            ((k, 2) view of the positions, (k,) view of the timestamps), oldest first
+        """
+        count = min(p_count, self.__count)
+        end = self.__head + self.__capacity
+        return self.__positions[end - count : end], self.__times[end - count : end]
+
+    def window(self, p_duration_ns: int) -> tuple:
+        """
+        Args:
+            p_duration_ns: age of the oldest sample returned, relative to the newest sample
+        Returns:
+            ((k, 2) view of the positions, (k,) view of the timestamps) of the samples in the window, oldest first
+        """
+        positions, times = self.last(self.__count)
+        if len(times) == 0:
+            return positions, times
+        start = int(np.searchsorted(times, times[-1] - p_duration_ns, side="left"))
+        return positions[start:], times[start:]
+
+    def smoothed(self, p_duration_ns: int) -> tuple | None:
+        """
+        Args:
+            p_duration_ns: length of the averaging window
+        Returns:
+            (x, y, t), mean position of the samples in the window and the mean of their timestamps in nanoseconds, the
+            instant the mean position belongs to, None if the history is empty
+        """
+        positions, times = self.window(p_duration_ns)
+        if len(times) == 0:
+            return None
+        x, y = positions.mean(axis=0)
+        return float(x), float(y), round(float(times.mean()))
+
+    def speed(self, p_duration_ns: int) -> float | None:
+        """
+        Args:
+            p_duration_ns: length of the window the speed is averaged over
+        Returns:
+            path length driven in the window divided by its duration, in pixels per second, None with fewer than two
+            samples in the window
+        """
+        positions, times = self.window(p_duration_ns)
+        if len(times) < 2 or times[-1] == times[0]:
+            return None
+        distance = float(np.hypot(*np.diff(positions, axis=0).T).sum())
+        return distance * NS_PER_SECOND / float(times[-1] - times[0])
@@ -0,0 +1,476 @@
+# Copyright (C) 2023, NG:ITL
+"""
+Records the coordinate, frame and driver streams the LapTimer subscribes to and replays them, either over local pynng
+sockets in place of the vehicle tracking or in-process into a LapTimer with a VirtualClock.
+
+Run with:
+    python -m time_tracking.recording record session.rec --duration 600
+    python -m time_tracking.recording replay session.rec [--fast] [--speed 2] [--start 30]
+    python -m time_tracking.recording replay session.rec --in-process [--batch]
+    python -m time_tracking.recording info session.rec
+"""
+import json
+import time
+import zlib
+import struct
+import asyncio
+import bisect
+import logging
+import argparse
+
+import pynng
+
+from time_tracking.clock import MonotonicClock, VirtualClock, NS_PER_SECOND
+from time_tracking.wire_format import (
+    FRAME_HEADER_STRUCT,
+    is_binary_coordinates,
+    decode_binary_coordinates,
+    encode_binary_coordinates,
+    decode_frame_header,
+)
+
+logger = logging.getLogger(__name__)
+
+# stream ids of the records and the subscriber of time_tracking_config.json they are received on
+COORDINATES, FRAME, USER = 0, 1, 2
+STREAMS = {COORDINATES: "__sub_coordinates", FRAME: "__sub_frame", USER: "__sub_user"}
+STREAM_NAMES = {"coordinates": COORDINATES, "frame": FRAME, "user": USER}
+
+# File layout: magic and version (8 bytes), then chunks until the end of the file. A chunk header holds everything
+# needed to seek, so the reader indexes a file by hopping from header to header without decompressing, and a recording
+# cut off by a crash is readable up to its last complete chunk:
+# magic (4 bytes), codec (uint8), padding, stored size (uint32), raw size (uint32), record count (uint32),
+# timestamp of the first and of the last record (int64, ns). The raw chunk is the records back to back:
+# timestamp (int64, ns), stream id (uint8), payload size (uint32), payload.
+FILE_MAGIC = b"RAAIREC\x01"
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER_STRUCT = struct.Struct("<4sBxxxIIIqq")
+RECORD_HEADER_STRUCT = struct.Struct("<qBI")
+STORED, ZLIB = 0, 1
+
+# records from this size on (frames) get a chunk of their own, compressed with the large record level
+LARGE_RECORD_BYTES = 64 * 1024
+
+
+class RecordingWriter:
+    """
+    Appends records to a recording. Small records are collected into chunks of at most p_chunk_bytes or p_chunk_ns
+    and compressed with zlib, so coordinates and driver changes take a few bytes each and a seek lands within one
+    chunk of the target. Camera frames are noisy and barely compress, while zlib takes longer than a frame interval
+    for one of them, so large records are stored uncompressed unless p_large_level says otherwise.
+    """
+
+    def __init__(
+        self,
+        p_path: str,
+        p_level: int = 6,
+        p_large_level: int = 0,
+        p_chunk_bytes: int = 256 * 1024,
+        p_chunk_ns: int = NS_PER_SECOND,
+    ) -> None:
+        """
+        Args:
+            p_path: path of the recording, an existing file is overwritten
+            p_level: zlib level of chunks of small records, 0 stores them uncompressed
+            p_large_level: zlib level of large records
+            p_chunk_bytes: raw size after which a chunk is written
+            p_chunk_ns: time span after which a chunk is written
+        """
+        self.__file = open(p_path, "wb")
+        self.__file.write(FILE_MAGIC)
+        self.__level = p_level
+        self.__large_level = p_large_level
+        self.__chunk_bytes = p_chunk_bytes
+        self.__chunk_ns = p_chunk_ns
+        self.__chunk = bytearray()
+        self.__count = 0
+        self.__first_ns = 0
+        self.__last_ns = 0
+        self.__records = 0
+
+    def get_records(self) -> int:
+        return self.__records
+
+    def write(self, p_stream: int, p_timestamp_ns: int, p_payload) -> None:
+        """
+        Args:
+            p_stream: stream id, one of STREAMS
+            p_timestamp_ns: instant the message was received
+            p_payload: message as received, including the topic
+        """
+        if len(p_payload) >= LARGE_RECORD_BYTES:
+            self.flush()
+            self.__append(p_stream, p_timestamp_ns, p_payload)
+            self.__write_chunk(self.__large_level)
+            return
+        if self.__count and p_timestamp_ns - self.__first_ns >= self.__chunk_ns:
+            self.flush()
+        self.__append(p_stream, p_timestamp_ns, p_payload)
+        if len(self.__chunk) >= self.__chunk_bytes:
+            self.flush()
+
+    def __append(self, p_stream: int, p_timestamp_ns: int, p_payload) -> None:
+        if self.__count == 0:
+            self.__first_ns = p_timestamp_ns
+        self.__last_ns = p_timestamp_ns
+        self.__chunk += RECORD_HEADER_STRUCT.pack(p_timestamp_ns, p_stream, len(p_payload))
+        self.__chunk += p_payload
+        self.__count += 1
+        self.__records += 1
+
+    def flush(self) -> None:
+        """
+        writes the pending records as a chunk
+        """
+        if self.__count:
+            self.__write_chunk(self.__level)
+
+    def __write_chunk(self, p_level: int) -> None:
+        codec = STORED
+        data: bytes | bytearray = self.__chunk
+        if p_level > 0:
+            compressed = zlib.compress(self.__chunk, p_level)
+            if len(compressed) < len(self.__chunk):
+                codec, data = ZLIB, compressed
+        header = CHUNK_HEADER_STRUCT.pack(
+            CHUNK_MAGIC, codec, len(data), len(self.__chunk), self.__count, self.__first_ns, self.__last_ns
+        )
+        self.__file.write(header)
+        self.__file.write(data)
+        # a crash loses at most the chunk being collected
+        self.__file.flush()
+        self.__chunk = bytearray()
+        self.__count = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args) -> None:
+        self.close()
+
+
+class RecordingReader:
+    """
+    Reads a recording. The chunk headers are indexed when the file is opened, records() then starts at any instant by
+    a binary search over the chunks and decompresses only the chunks it reads.
+    """
+
+    def __init__(self, p_path: str) -> None:
+        """
+        Args:
+            p_path: path of the recording
+        """
+        self.__path = p_path
+        # (offset of the chunk data, codec, stored size, raw size, record count, first timestamp, last timestamp)
+        self.__chunks: list = []
+        with open(p_path, "rb") as file:
+            if file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError(f"{p_path} is not a recording")
+            self.__index(file)
+        self.__last_ns = [chunk[6] for chunk in self.__chunks]
+
+    def __index(self, p_file) -> None:
+        offset = len(FILE_MAGIC)
+        size = p_file.seek(0, 2)
+        while offset + CHUNK_HEADER_STRUCT.size <= size:
+            p_file.seek(offset)
+            magic, codec, stored, raw, count, first_ns, last_ns = CHUNK_HEADER_STRUCT.unpack(
+                p_file.read(CHUNK_HEADER_STRUCT.size)
+            )
+            data_offset = offset + CHUNK_HEADER_STRUCT.size
+            if magic != CHUNK_MAGIC or data_offset + stored > size:
+                break
+            self.__chunks.append((data_offset, codec, stored, raw, count, first_ns, last_ns))
+            offset = data_offset + stored
+        if offset != size:
+            logger.warning("%s is truncated, reading the %d complete chunks", self.__path, len(self.__chunks))
+
+    def get_start_ns(self) -> int | None:
+        return self.__chunks[0][5] if self.__chunks else None
+
+    def get_end_ns(self) -> int | None:
+        return self.__chunks[-1][6] if self.__chunks else None
+
+    def get_record_count(self) -> int:
+        return sum(chunk[4] for chunk in self.__chunks)
+
+    def get_chunk_count(self) -> int:
+        return len(self.__chunks)
+
+    def records(self, p_start_ns: int | None = None, p_end_ns: int | None = None, p_streams=None):
+        """
+        Args:
+            p_start_ns: first instant that is read, None reads from the beginning
+            p_end_ns: last instant that is read, None reads to the end
+            p_streams: stream ids that are read, None reads all
+        Returns:
+            generator of (timestamp in ns, stream id, payload) in the order they were recorded
+        """
+        first_chunk = 0 if p_start_ns is None else bisect.bisect_left(self.__last_ns, p_start_ns)
+        with open(self.__path, "rb") as file:
+            for data_offset, codec, stored, raw, count, first_ns, _ in self.__chunks[first_chunk:]:
+                if p_end_ns is not None and first_ns > p_end_ns:
+                    return
+                file.seek(data_offset)
+                data = file.read(stored)
+                if codec == ZLIB:
+                    data = zlib.decompress(data, bufsize=raw)
+                view = memoryview(data)
+                offset = 0
+                for _ in range(count):
+                    timestamp_ns, stream, length = RECORD_HEADER_STRUCT.unpack_from(data, offset)
+                    offset += RECORD_HEADER_STRUCT.size
+                    payload = view[offset : offset + length]
+                    offset += length
+                    if p_start_ns is not None and timestamp_ns < p_start_ns:
+                        continue
+                    if p_end_ns is not None and timestamp_ns > p_end_ns:
+                        return
+                    if p_streams is None or stream in p_streams:
+                        yield timestamp_ns, stream, bytes(payload)
+
+
+def paced(p_records, p_speed: float = 1.0):
+    """
+    releases the records at the pace they were recorded
+    Args:
+        p_records: generator of RecordingReader.records
+        p_speed: replay speed, 2.0 replays twice as fast as recorded, 0 as fast as possible
+    Returns:
+        generator of the same records
+    """
+    if p_speed <= 0:
+        yield from p_records
+        return
+    start_ns = time.monotonic_ns()
+    first_ns = None
+    for record in p_records:
+        if first_ns is None:
+            first_ns = record[0]
+        delay_ns = (record[0] - first_ns) / p_speed - (time.monotonic_ns() - start_ns)
+        if delay_ns > 0:
+            time.sleep(delay_ns / NS_PER_SECOND)
+        yield record
+
+
+class Recorder:
+    """
+    Subscribes to the streams of the LapTimer like the LapTimer does and writes every message with the instant it was
+    received on the monotonic clock, the same clock the LapTimer times JSON coordinates with.
+    """
+
+    def __init__(self, p_writer: RecordingWriter, p_config: dict, p_streams=tuple(STREAMS), p_clock=None) -> None:
+        """
+        Args:
+            p_writer: writer the messages are recorded with
+            p_config: content of time_tracking_config.json
+            p_streams: stream ids that are recorded
+            p_clock: clock the receive instants are taken from, MonotonicClock by default
+        """
+        self.__writer = p_writer
+        self.__clock = MonotonicClock() if p_clock is None else p_clock
+        subscribers = p_config["pynng"]["subscribers"]
+        topics = {
+            COORDINATES: subscribers["__sub_coordinates"]["topics"]["pixel_coordinates"],
+            FRAME: "",
+            USER: subscribers["__sub_user"]["topics"]["current_driver"],
+        }
+        self.__sockets = {}
+        for stream in p_streams:
+            socket = pynng.Sub0()
+            socket.subscribe(topics[stream])
+            socket.dial(subscribers[STREAMS[stream]]["address"], block=False)
+            self.__sockets[stream] = socket
+
+    async def __record_stream(self, p_stream: int, p_socket: pynng.Sub0) -> None:
+        while True:
+            msg = await p_socket.arecv()
+            self.__writer.write(p_stream, self.__clock.now_ns(), msg)
+
+    async def arecord(self, p_duration_s: float | None = None) -> None:
+        """
+        records until the duration is over or the task is cancelled
+        Args:
+            p_duration_s: seconds to record, None records until cancelled
+        """
+        tasks = [asyncio.create_task(self.__record_stream(*item)) for item in self.__sockets.items()]
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), p_duration_s)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self) -> None:
+        for socket in self.__sockets.values():
+            socket.close()
+        self.__writer.close()
+
+
+def rebase_timestamp(p_stream: int, p_payload: bytes, p_offset_ns: int) -> bytes:
+    """
+    shifts the capture timestamp a message carries, so a replayed session is timed on the clock of the receiver
+    Args:
+        p_stream: stream id of the message
+        p_payload: recorded message
+        p_offset_ns: nanoseconds added to the capture timestamp
+    Returns:
+        the message with the shifted timestamp, unchanged if it has none
+    """
+    if p_stream == COORDINATES:
+        i = p_payload.find(b" ")
+        if is_binary_coordinates(p_payload, i + 1):
+            car_id, x, y, timestamp_ns = decode_binary_coordinates(p_payload, i + 1)
+            return encode_binary_coordinates(p_payload[:i].decode(), car_id, x, y, timestamp_ns + p_offset_ns)
+        coordinates = json.loads(p_payload[i + 1 :])
+        # only the object format carries a capture timestamp, lists are passed through like decode_coordinates reads
+        # them
+        if isinstance(coordinates, dict) and "timestamp_ns" in coordinates:
+            coordinates["timestamp_ns"] = int(coordinates["timestamp_ns"]) + p_offset_ns
+            return p_payload[: i + 1] + json.dumps(coordinates).encode()
+    elif p_stream == FRAME:
+        header = decode_frame_header(p_payload)
+        if header is not None:
+            values = list(FRAME_HEADER_STRUCT.unpack_from(p_payload))
+            values[-1] += p_offset_ns
+            return FRAME_HEADER_STRUCT.pack(*values) + p_payload[FRAME_HEADER_STRUCT.size :]
+    return p_payload
+
+
+def replay_pynng(p_records, p_config: dict, p_connect_timeout_s: float = 5.0, p_rebase: bool = True) -> int:
+    """
+    publishes the records on the addresses the LapTimer subscribes to, in place of the vehicle tracking. Pub/Sub drops
+    messages a subscriber cannot take, so a replay as fast as possible may lose messages a real time replay delivers
+    Args:
+        p_records: generator of RecordingReader.records, paced() for a real time replay
+        p_config: content of time_tracking_config.json
+        p_connect_timeout_s: time the coordinate and driver subscribers get to connect before the first message
+        p_rebase: shift the capture timestamps by the time between recording and replay, see rebase_timestamp
+    Returns:
+        number of messages sent
+    """
+    subscribers = p_config["pynng"]["subscribers"]
+    publishers = {stream: pynng.Pub0(listen=subscribers[name]["address"]) for stream, name in STREAMS.items()}
+    deadline = time.monotonic() + p_connect_timeout_s
+    while not (publishers[COORDINATES].pipes and publishers[USER].pipes):
+        if time.monotonic() > deadline:
+            logger.warning("no time tracking connected within %.1f s, replaying anyway", p_connect_timeout_s)
+            break
+        time.sleep(0.01)
+    count = 0
+    offset_ns = None
+    try:
+        for timestamp_ns, stream, payload in p_records:
+            if p_rebase is True:
+                if offset_ns is None:
+                    offset_ns = time.monotonic_ns() - timestamp_ns
+                payload = rebase_timestamp(stream, payload, offset_ns)
+            publishers[stream].send(payload)
+            count += 1
+    finally:
+        for publisher in publishers.values():
+            publisher.close()
+    return count
+
+
+def replay_in_process(p_records, p_timer, p_clock: VirtualClock) -> int:
+    """
+    hands the records to the LapTimer the way its receive loops do, with the clock set to the recorded instant of
+    every message. The crossings, and so the published events, only depend on the recording, not on the replay speed.
+    Args:
+        p_records: generator of RecordingReader.records, paced() for a real time replay
+        p_timer: LapTimer created with p_clock
+        p_clock: VirtualClock of the LapTimer
+    Returns:
+        number of messages replayed
+    """
+    count = 0
+    for timestamp_ns, stream, payload in p_records:
+        p_clock.set_ns(timestamp_ns)
+        if stream == COORDINATES:
+            # never drain the live coordinate socket of the LapTimer, only the recorded messages are replayed
+            p_timer.handle_coordinate_message(payload, timestamp_ns, p_drain=False)
+        elif stream == FRAME:
+            p_timer.handle_frame_message(payload)
+        else:
+            p_timer.handle_user_message(payload)
+        p_timer.run_scheduled(timestamp_ns)
+        count += 1
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="record and replay the streams of the RAAI time tracking")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="record the streams the time tracking subscribes to")
+    record.add_argument("path")
+    record.add_argument("--duration", type=float, default=None, help="seconds to record, default until Ctrl+C")
+    record.add_argument("--streams", nargs="+", choices=STREAM_NAMES, default=list(STREAM_NAMES))
+    record.add_argument("--level", type=int, default=6, help="zlib level of coordinates and driver changes")
+    record.add_argument("--frame-level", type=int, default=0, help="zlib level of frames, 0 stores them")
+
+    replay = commands.add_parser("replay", help="replay a recording")
+    replay.add_argument("path")
+    replay.add_argument("--fast", action="store_true", help="replay as fast as possible")
+    replay.add_argument("--speed", type=float, default=1.0, help="replay speed of the real time replay")
+    replay.add_argument("--start", type=float, default=0.0, help="seconds into the recording to start at")
+    replay.add_argument("--in-process", action="store_true", help="replay into a headless LapTimer")
+    replay.add_argument("--batch", action="store_true", help="time the coordinates in bulk, see main.py --batch")
+
+    info = commands.add_parser("info", help="print the size and duration of a recording")
+    info.add_argument("path")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with open("./time_tracking_config.json", "r") as file:
+        config = json.load(file)
+
+    if args.command == "record":
+        recorder = Recorder(
+            RecordingWriter(args.path, args.level, args.frame_level),
+            config,
+            tuple(STREAM_NAMES[name] for name in args.streams),
+        )
+        try:
+            asyncio.run(recorder.arecord(args.duration))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            recorder.close()
+        return
+
+    reader = RecordingReader(args.path)
+    first_ns = reader.get_start_ns()
+    last_ns = reader.get_end_ns()
+    if first_ns is None or last_ns is None:
+        print(f"{args.path} holds no records")
+        return
+    if args.command == "info":
+        duration = (last_ns - first_ns) / NS_PER_SECOND
+        print(f"{reader.get_record_count()} records in {reader.get_chunk_count()} chunks, {duration:.1f} s")
+        return
+
+    start_ns = first_ns + round(args.start * NS_PER_SECOND)
+    records = paced(reader.records(start_ns), 0 if args.fast else args.speed)
+    if args.in_process:
+        from time_tracking.time_tracking import LapTimer
+
+        clock = VirtualClock(start_ns)
+        timer = LapTimer(p_async=True, p_batch=args.batch, p_clock=clock, p_headless=True)
+        timer.start_timer()
+        count = replay_in_process(records, timer, clock)
+        # writes the records of the last second to the best times cache
+        timer.stop()
+    else:
+        count = replay_pynng(records, config)
+    print(f"replayed {count} messages")
+
+
+if __name__ == "__main__":
+    main()
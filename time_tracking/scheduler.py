@@ -0,0 +1,83 @@
+# Copyright (C) 2023, NG:ITL
+import heapq
+import itertools
+
+# handle of a scheduled task: [due instant in ns, sequence number, task, args, interval in ns or 0]
+ScheduledTask = list
+
+
+class Scheduler:
+    """
+    Timer heap run by the timing loop, replaces one threading.Timer thread per task. Due tasks are run by run_due() with
+    the instant the loop is at: the timestamp of the coordinate being processed, or the current time while no
+    coordinates arrive. Tasks therefore run on the timing thread, in order with the crossings, and recorded sessions
+    replay with the same timing.
+    """
+
+    def __init__(self) -> None:
+        # entries are ScheduledTask lists, the sequence number keeps tasks due at the same instant in the order they
+        # were scheduled
+        self.__heap: list[ScheduledTask] = []
+        self.__sequence = itertools.count()
+
+    def call_at(self, p_due_ns: int, p_task, *p_args) -> ScheduledTask:
+        """
+        Args:
+            p_due_ns: instant the task is due, in nanoseconds of the LapTimer clock
+            p_task: callable that is run
+            p_args: arguments passed to the task
+        Returns:
+            handle for cancel()
+        """
+        entry = [p_due_ns, next(self.__sequence), p_task, p_args, 0]
+        heapq.heappush(self.__heap, entry)
+        return entry
+
+    def call_every(self, p_start_ns: int, p_interval_ns: int, p_task, *p_args) -> ScheduledTask:
+        """
+        runs the task every interval, starting one interval after p_start_ns. Intervals missed while the loop was
+        blocked are not made up for.
+        Returns:
+            handle for cancel()
+        """
+        entry = [p_start_ns + p_interval_ns, next(self.__sequence), p_task, p_args, p_interval_ns]
+        heapq.heappush(self.__heap, entry)
+        return entry
+
+    @staticmethod
+    def cancel(p_handle: ScheduledTask | None) -> None:
+        """
+        cancels a task, the entry is dropped when it comes due
+        Args:
+            p_handle: handle returned by call_at or call_every, None is ignored
+        """
+        if p_handle is not None:
+            p_handle[2] = None
+
+    def run_due(self, p_now_ns: int) -> int:
+        """
+        runs every task that is due at the given instant, in the order they are due
+        Args:
+            p_now_ns: instant the timing loop is at
+        Returns:
+            number of tasks run
+        """
+        count = 0
+        heap = self.__heap
+        while heap and heap[0][0] <= p_now_ns:
+            entry = heapq.heappop(heap)
+            task = entry[2]
+            if task is None:
+                continue
+            if entry[4]:
+                entry[0] += entry[4]
+                if entry[0] <= p_now_ns:
+                    entry[0] = p_now_ns + entry[4]
+                entry[1] = next(self.__sequence)
+                heapq.heappush(heap, entry)
+            task(*entry[3])
+            count += 1
+        return count
+
+    def __len__(self) -> int:
+        return sum(1 for entry in self.__heap if entry[2] is not None)
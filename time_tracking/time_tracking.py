@@ -1,35 +1,102 @@
 # Copyright (C) 2023, NG:ITL
-import time
 import json
+import math
+import asyncio
+import logging
+import threading
 import pynng
-import cv2
 import numpy as np
 
 from pathlib import Path
 from json import load, dump
-from time_tracking.checkpoint_definer import CheckpointDefiner
-from time_tracking.utils import read_config, find_config_file, run_scheduled_task
+from typing import TYPE_CHECKING
+from time_tracking.wire_format import (
+    is_binary_coordinates,
+    decode_binary_coordinates,
+    encode_lap_trajectory,
+    EventEncoder,
+)
+from time_tracking.clock import MonotonicClock, ns_to_seconds, NS_PER_SECOND
+from time_tracking.best_times import BestTimesFetcher, BestTimesCache, layout_fingerprint
+from time_tracking.timing_state import TimingState, LAP, best_time_key
+from time_tracking.crossing_engine import (
+    CrossingEngine,
+    CheckpointGrid,
+    GRID_MIN_CHECKPOINTS,
+    ENGINE_MIN_CHECKPOINTS,
+)
+from time_tracking.scheduler import Scheduler, ScheduledTask
+from time_tracking.position_history import PositionHistory
+from time_tracking.lap_trajectory import LapTrajectory, RecordedLap, ReferenceLap
+from time_tracking.utils import read_config, find_config_file
+
+if TYPE_CHECKING:
+    # frame_pipeline imports cv2, at runtime it is only imported if frames are received
+    from time_tracking.frame_pipeline import CheckpointOverlay, FramePublisher
+
+# the blocking coordinate receive returns after this time without coordinates, so scheduled tasks still run
+SCHEDULER_TICK_MS = 100
+# the blocking frame receive returns after this time without a frame, so run() notices a failed timing worker even
+# while the frames stall
+FRAME_RECV_TIMEOUT_MS = 500
+# interval of taking over best times received in the background
+BEST_TIMES_POLL_NS = 100_000_000
+# the best times cache is written at most once per interval, records set in between are saved together
+BEST_TIMES_SAVE_NS = NS_PER_SECOND
+DEBOUNCE_UNITS = ("seconds", "pixels", "samples")
+# window of the speed estimate of get_metrics
+SPEED_WINDOW_NS = 250_000_000
+# window the position of the live delta is averaged over
+DELTA_SMOOTHING_NS = 40_000_000
+# capture timestamps further than this from the receive time are not on the clock of the LapTimer and are ignored
+MAX_CAPTURE_SKEW_NS = NS_PER_SECOND
+DELTA_REFERENCES = ("personal", "all_time")
+# BGR color of the trail of the car drawn on the frame
+TRAIL_COLOR = (0, 255, 255)
+# recording (see recording.py) or video file the checkpoints are defined on in test mode
+TEST_SOURCE = "./test_session.rec"
 
 FILE_DIR = Path(__file__).parent
 BASE_DIR = FILE_DIR.parent
 CONFIG_FILE_PATH = Path("./time_tracking_config.json")
 
+logger = logging.getLogger(__name__)
+
 
 class LapTimer:
-    def __init__(self, config_file_path="time_tracking.json", p_fallback: bool = False, test: bool = False):
+    def __init__(
+        self,
+        config_file_path="time_tracking.json",
+        p_fallback: bool = False,
+        test: bool = False,
+        p_async: bool = False,
+        p_batch: bool = False,
+        p_clock=None,
+        p_headless: bool = False,
+        p_test_source: str = TEST_SOURCE,
+    ):
         # initialise variables
-        self.__connection_state: bool = False
         self.__test = test
-        self.coordinates_list: list = []
-        self.__start_time: float = 0.0
-        self.__last_lap_time: float = 0.0
-        self.__last_checkpoint_time: float = 0.0
+        # all instants are integer nanoseconds of the clock, they are only converted to rounded seconds for publishing
+        self.__clock = MonotonicClock() if p_clock is None else p_clock
+        self.__start_time: int = 0
+        self.__last_lap_time: int | None = None
+        self.__last_checkpoint_time: int | None = None
+        # time from receiving the last coordinate message to having processed it, i.e. how far this module is behind
+        # its socket, read by the frame governor. 0 while the coordinate socket is idle
+        self.__coordinate_lag_ns: int = 0
+        # a rejected capture timestamp is logged once until a valid one is received again
+        self.__timestamp_rejected = False
         self.__checkpoints: list = []
-        self.__payload: dict = {}
-        self.__checkpoint_drawn = False
         self.__fallback = p_fallback
-        self.__video_path = "C:/Users/VWF6GWD/Desktop/Race_against_ai_workspace/TestVideo/drive_990p.h265"
+        self.__async = p_async
+        self.__batch = p_batch
+        self.__headless = p_headless
         self.__user: str | None = "anon"
+        self.__timing_thread: threading.Thread | None = None
+        self.__stop_event = threading.Event()
+        # exception that ended the timing worker, raised by run() on the calling thread
+        self.__worker_error: Exception | None = None
 
         if not CONFIG_FILE_PATH.exists():
             with open(CONFIG_FILE_PATH, "w") as config_file, open(
@@ -42,44 +109,291 @@ class LapTimer:
 
         # getting checkpoint positions from config file
         if find_config_file(config_file_path) is False:
+            if self.__headless is True:
+                raise FileNotFoundError(f"{config_file_path} not found, define the checkpoints without --headless")
+            from time_tracking.checkpoint_definer import CheckpointDefiner
+
             if self.__test is False:
                 self.__definer = CheckpointDefiner()
             else:
-                self.__definer = CheckpointDefiner(p_use_camera_stream=False, video_path=self.__video_path)
+                self.__definer = CheckpointDefiner(p_use_camera_stream=False, video_path=p_test_source)
             self.__definer.main()
 
+        self.__config_file_path = config_file_path
         self.__config = read_config(config_file_path)
         self.__number_of_checkpoints = len(self.__config["checkpoints"])
         self.__checkpoint_list = self.__config["checkpoints"]
 
         self.__pynng_config = read_config("./time_tracking_config.json")
+        self.__define_scheduler()
+        self.__define_metrics_log()
+        self.__define_position_history()
+        self.__define_lap_trajectory()
 
         self.__define_coordinate_receiver()
-        self.__define_frame_receiver()
         self.__define_user_receiver()
 
-        # getting best times from database interface
+        # the cached or else the fallback best times are used until the database interface responds, the request runs
+        # in the background or, in asyncio mode, in arun()
+        self.__timing_state = TimingState(self.__number_of_checkpoints)
+        self.__timing_state.load_best_times(self.fallback_best_times())
+        self.__define_best_times_cache()
         self.__define_requester()
-        self.__best_times = self.request_best_times()
-        self.__pers_best_times = {
-            "sector_1_best_time": 1000.0,
-            "sector_2_best_time": 1000.0,
-            "sector_3_best_time": 1000.0,
-            "lap_best_time": 1000.0,
-        }
+        if self.__async is False:
+            self.__best_times_fetcher.start()
+        self.__scheduler.call_every(self.__clock.now_ns(), BEST_TIMES_POLL_NS, self.swap_in_best_times)
+
+        # the frame path, and with it cv2, is only set up if frames are shown or the overlay is published
+        self.__publish_overlay = self.__pynng_config["pynng"]["publishers"]["__pub_frame"].get("enabled", True)
+        self.__overlay: "CheckpointOverlay | None" = None
+        self.__frame_publisher: "FramePublisher | None" = None
+        if self.__publish_overlay is True or self.__headless is False:
+            self.__define_frame_pipeline()
+        self.__define_checkpoints()
+
+        # setting up pynng publisher, the event payloads are pre-encoded templates
+        self.__define_event_encoder()
+        self.__pub_time = pynng.Pub0()
+        self.__pub_time.listen(self.__pynng_config["pynng"]["publishers"]["__pub_time"]["address"])
+        self.__define_live_delta()
 
+    def __define_checkpoints(self) -> None:
+        """
+        creates the checkpoints from the checkpoint list and everything that is derived from their positions
+        Returns:
+            None
+        """
+        self.__checkpoints = []
         for i in range(self.__number_of_checkpoints):
             if i == 0:
                 self.__checkpoints.append(FinishLineCheckpoint(self.__checkpoint_list[i], self.__number_of_checkpoints))
             else:
                 self.__checkpoints.append(SectorLineCheckpoint(self.__checkpoint_list[i], i))
+        self.__crossing_engine = CrossingEngine(self.__checkpoints)
+        # small layouts test every checkpoint one by one, below ENGINE_MIN_CHECKPOINTS that is faster than the
+        # vectorized call, large mini-sector layouts only test the checkpoints close to the car
+        self.__crossing_candidates: range | None = None
+        if self.__number_of_checkpoints < ENGINE_MIN_CHECKPOINTS:
+            self.__crossing_candidates = range(self.__number_of_checkpoints)
+        self.__checkpoint_grid: CheckpointGrid | None = None
+        if self.__number_of_checkpoints >= GRID_MIN_CHECKPOINTS:
+            self.__checkpoint_grid = CheckpointGrid(self.__checkpoints)
+        if self.__overlay is not None:
+            self.__overlay.invalidate(self.__checkpoints)
+
+    def reload_checkpoints(self) -> None:
+        """
+        reads the checkpoint positions from the config file again, e.g. after they were redefined. If the number of
+        checkpoints changed, the timing state and the event templates are rebuilt as well.
+        Returns:
+            None
+        """
+        self.__config = read_config(self.__config_file_path)
+        self.__checkpoint_list = self.__config["checkpoints"]
+        if len(self.__checkpoint_list) != self.__number_of_checkpoints:
+            self.__number_of_checkpoints = len(self.__checkpoint_list)
+            best_times = self.__timing_state.best_times()
+            self.__timing_state = TimingState(self.__number_of_checkpoints)
+            self.__timing_state.load_best_times(best_times)
+            self.__define_event_encoder()
+        if self.__best_times_cache is not None:
+            self.__best_times_cache.set_layout(layout_fingerprint(self.__checkpoint_list))
+        self.__define_checkpoints()
+        # crossings of the previous lines do not count for the new ones
+        self.__timing_state.clear_crossed()
+
+    def __define_scheduler(self) -> None:
+        """
+        defines the scheduler of the timing loop and reads the finish line debounce and the lap timeout
+        Returns:
+            None
+        """
+        self.__scheduler = Scheduler()
+        timing_config = self.__pynng_config.get("timing", {})
+        debounce_config = timing_config.get("finish_debounce", {"unit": "seconds", "value": 2})
+        if debounce_config["unit"] not in DEBOUNCE_UNITS:
+            raise ValueError(f"Unknown debounce unit {debounce_config['unit']}, expected one of {DEBOUNCE_UNITS}")
+        self.__debounce_unit = debounce_config["unit"]
+        self.__debounce_value = debounce_config["value"]
+        # samples or pixels left until the finish line is armed again, 0 while it is armed
+        self.__debounce_remaining: float = 0
+        self.__lap_timeout_ns = round(timing_config.get("lap_timeout_s", 0) * NS_PER_SECOND)
+        self.__lap_timeout: ScheduledTask | None = None
+        self.__lap_running = True
+
+    def __define_metrics_log(self) -> None:
+        """
+        logs get_metrics every metrics_log_s seconds (timing section) on info level, 0 disables it
+        Returns:
+            None
+        """
+        metrics_log_s = self.__pynng_config.get("timing", {}).get("metrics_log_s", 0)
+        if metrics_log_s > 0:
+            self.__scheduler.call_every(self.__clock.now_ns(), round(metrics_log_s * NS_PER_SECOND), self.__log_metrics)
 
-        # setting up pynng publisher
-        self.__pub_time = pynng.Pub0()
-        self.__pub_time.listen(self.__pynng_config["pynng"]["publishers"]["__pub_time"]["address"])
+    def __log_metrics(self) -> None:
+        logger.info("metrics %s", self.get_metrics())
+
+    def __define_position_history(self) -> None:
+        """
+        defines the ring buffer of the recent positions, the motion segments are formed from its newest samples and the
+        trail and the speed are read from it
+        Returns:
+            None
+        """
+        timing_config = self.__pynng_config.get("timing", {})
+        self.__history = PositionHistory(timing_config.get("history_s", 2.0), timing_config.get("history_rate_hz", 250))
+        trail_s = self.__pynng_config["pynng"]["publishers"]["__pub_frame"].get("trail_s", 0)
+        self.__trail_ns = round(trail_s * NS_PER_SECOND)
+
+    def __define_lap_trajectory(self) -> None:
+        """
+        defines the samples of the current lap and the best valid lap of every driver seen in this session
+        Returns:
+            None
+        """
+        self.__lap_trajectory = LapTrajectory()
+        self.__best_laps: dict = {}
+        # fastest valid lap of all drivers
+        self.__fastest_lap: RecordedLap | None = None
+
+    def __define_live_delta(self) -> None:
+        """
+        reads the rate and the reference lap of the live delta and schedules publishing it, it is only published if
+        the rate is above 0 and the live_delta topic is configured
+        Returns:
+            None
+        """
+        timing_config = self.__pynng_config.get("timing", {})
+        self.__delta_reference = timing_config.get("live_delta_reference", "personal")
+        if self.__delta_reference not in DELTA_REFERENCES:
+            raise ValueError(
+                f"Unknown live delta reference {self.__delta_reference}, expected one of {DELTA_REFERENCES}"
+            )
+        self.__reference_lap: ReferenceLap | None = None
+        # (start of the lap, arc length) of the last projection onto the reference lap
+        self.__delta_progress: tuple[int | None, float] = (None, 0.0)
+        rate_hz = timing_config.get("live_delta_hz", 0)
+        topics = self.__pynng_config["pynng"]["publishers"]["__pub_time"]["topics"]
+        self.__live_delta = rate_hz > 0 and "live_delta" in topics
+        if self.__live_delta:
+            self.__scheduler.call_every(
+                self.__clock.now_ns(), round(NS_PER_SECOND / rate_hz), self.__publish_live_delta
+            )
+
+    def __define_best_times_cache(self) -> None:
+        """
+        opens the on-disk best times cache if it is configured and takes over the all-time and personal best times
+        that are not stale
+        Returns:
+            None
+        """
+        self.__best_times_cache: BestTimesCache | None = None
+        # records set by calc_type since they were last saved, in the format of the database
+        self.__all_time_records: dict = {}
+        self.__personal_records: dict = {}
+        # the cache in memory has changes that are not written to disk yet
+        self.__cache_changed = False
+        cache_config = self.__pynng_config.get("best_times_cache")
+        if cache_config is None:
+            return
+        self.__best_times_cache = BestTimesCache(
+            cache_config.get("path", "./best_times_cache.json"),
+            cache_config.get("max_age_hours", 168),
+            layout_fingerprint(self.__checkpoint_list),
+        )
+        cached_best_times = self.__best_times_cache.all_time_best()
+        if cached_best_times is not None:
+            self.__timing_state.load_best_times(cached_best_times)
+        self.__load_personal_best()
+        self.__scheduler.call_every(self.__clock.now_ns(), BEST_TIMES_SAVE_NS, self.__write_best_times_cache)
+
+    def __load_personal_best(self) -> None:
+        cached_best_times = None
+        if self.__best_times_cache is not None:
+            cached_best_times = self.__best_times_cache.driver_best(self.__user)
+        if cached_best_times is None:
+            self.__timing_state.reset_personal_best()
+        else:
+            self.__timing_state.load_personal_best(cached_best_times)
+
+    def __save_records(self) -> None:
+        """
+        puts the records calc_type set into the cache, only records are written so the fallback best times never end
+        up in the cache. The cache file is written by the scheduler, see __write_best_times_cache
+        Returns:
+            None
+        """
+        if not self.__all_time_records and not self.__personal_records:
+            return
+        if self.__best_times_cache is not None:
+            self.__best_times_cache.update_all_time(self.__all_time_records)
+            self.__best_times_cache.update_driver(self.__user, self.__personal_records)
+            self.__cache_changed = True
+        self.__all_time_records = {}
+        self.__personal_records = {}
+
+    def __write_best_times_cache(self) -> None:
+        """
+        hands the cache to its writer thread if it changed since it was last written, runs every BEST_TIMES_SAVE_NS
+        and on stop(), so the file is written at most once per interval however many records are set and the timing
+        loop never waits for the disk
+        Returns:
+            None
+        """
+        if self.__cache_changed and self.__best_times_cache is not None:
+            self.__cache_changed = False
+            self.__best_times_cache.save_in_background()
+
+    def __define_event_encoder(self) -> None:
+        """
+        builds the topic prefixes and payload templates of the published events
+        Returns:
+            None
+        """
+        pub_time_config = self.__pynng_config["pynng"]["publishers"]["__pub_time"]
+        self.__event_encoder = EventEncoder(
+            pub_time_config["topics"], self.__number_of_checkpoints, pub_time_config.get("encoding", "json") == "binary"
+        )
+        # configurations without the topic do not publish the lap trajectories
+        self.__trajectory_topic = pub_time_config["topics"].get("lap_trajectory")
+
+    def __raw_frame_shape(self) -> tuple:
+        """
+        size of the frames the vehicle tracking sends without frame header, frames with header carry their own size
+        Returns:
+            (height, width, channels)
+        """
+        if self.__test:
+            return 480, 640, 3
+        sub_frame_config = self.__pynng_config["pynng"]["subscribers"]["__sub_frame"]
+        return tuple(sub_frame_config.get("raw_shape", (990, 1332, 3)))
+
+    def __define_frame_pipeline(self) -> None:
+        """
+        defines the frame receiver, the frame buffer, the checkpoint overlay and, unless disabled, the frame publisher.
+        Imports cv2, so a headless LapTimer without overlay publishing never loads it.
+        Returns:
+            None
+        """
+        from time_tracking.frame_pipeline import FrameBuffer, CheckpointOverlay, FramePublisher, FrameGovernor
 
+        pub_frame_config = self.__pynng_config["pynng"]["publishers"]["__pub_frame"]
+        self.__define_frame_receiver()
+        self.__frame_buffer = FrameBuffer(self.__raw_frame_shape())
+        self.__overlay = CheckpointOverlay(self.__checkpoints)
+        self.__frame_governor = FrameGovernor(
+            pub_frame_config.get("target_fps", 0), pub_frame_config.get("max_coordinate_lag_ms", 20.0)
+        )
+        if self.__publish_overlay is False:
+            return
         self.__pub_frame = pynng.Pub0()
-        self.__pub_frame.listen(self.__pynng_config["pynng"]["publishers"]["__pub_frame"]["address"])
+        self.__pub_frame.listen(pub_frame_config["address"])
+        self.__frame_publisher = FramePublisher(
+            self.__pub_frame,
+            pub_frame_config.get("encoding", "raw"),
+            pub_frame_config.get("quality", 80),
+        )
 
     # -----define pynng receiver-----
     def __define_coordinate_receiver(self) -> None:
@@ -100,6 +414,7 @@ class LapTimer:
             self.__sub_coordinates.dial(
                 self.__pynng_config["pynng"]["subscribers"]["__sub_coordinates_fallback"]["address"]
             )
+        self.__sub_coordinates.recv_timeout = SCHEDULER_TICK_MS
 
     def __define_frame_receiver(self) -> None:
         """
@@ -110,6 +425,7 @@ class LapTimer:
         self.__sub_frame = pynng.Sub0()
         self.__sub_frame.subscribe("")
         self.__sub_frame.dial(self.__pynng_config["pynng"]["subscribers"]["__sub_frame"]["address"])
+        self.__sub_frame.recv_timeout = FRAME_RECV_TIMEOUT_MS
 
     def __define_user_receiver(self) -> None:
         """
@@ -122,52 +438,131 @@ class LapTimer:
         self.__sub_user.dial(self.__pynng_config["pynng"]["subscribers"]["__sub_user"]["address"])
 
     def __define_requester(self) -> None:
-        if not self.__connection_state:
-            request_address = self.__pynng_config["pynng"]["requesters"]["best_times"]["address"]
-            print(f"Connecting to {request_address}")
-            self.__request_socket = pynng.Req0()
-            try:
-                print("Trying to connect")
-                self.__request_socket.dial(request_address, block=True)
-                self.__connection_state = True
-                print("Connected")
-            except pynng.exceptions.ConnectionRefused:
-                print("Connection failed")
-                self.__connection_state = False
+        """
+        dials the database interface without waiting for it, nng keeps reconnecting in the background, and defines the
+        fetcher that requests the best times with timeouts and retries
+        Returns:
+            None
+        """
+        requester_config = self.__pynng_config["pynng"]["requesters"]["best_times"]
+        print(f"Connecting to {requester_config['address']}")
+        self.__request_socket = pynng.Req0()
+        self.__request_socket.dial(requester_config["address"], block=False)
+        self.__best_times_fetcher = BestTimesFetcher(
+            self.__request_socket,
+            requester_config.get("timeout_ms", 1000),
+            requester_config.get("max_attempts", 10),
+            requester_config.get("backoff_ms", 250),
+            requester_config.get("max_backoff_ms", 8000),
+        )
 
     # -----lap time segment-----
 
-    def lap_update(self, correct: bool) -> None:
+    def lap_update(self, correct: bool, p_time_ns: int | None = None) -> None:
         """
         calculates the lap time, resets the crossed variables, sending lap data, start new lap(send_lap, lap start)
         Args:
             correct: if the lap was driven correct (car drove through all checkpoints)
+            p_time_ns: instant the finish line was crossed, now if not given
 
         Returns: none
 
         """
-        if self.__last_lap_time != 0:
-            lap_time = round(time.time() - self.__last_lap_time, 2)
+        now = self.__clock.now_ns() if p_time_ns is None else p_time_ns
+        if self.__last_lap_time is not None:
+            lap_time = ns_to_seconds(now - self.__last_lap_time)
         else:
-            lap_time = round(time.time() - self.__start_time, 2)
+            lap_time = ns_to_seconds(now - self.__start_time)
 
-        self.__last_lap_time = time.time()
+        self.__last_lap_time = now
 
-        for checkpoint in self.__checkpoints:
-            checkpoint.set_crossed(False)
+        # the finish line is armed again by the debounce
+        self.__timing_state.clear_sectors()
+        self.__schedule_lap_timeout(now)
 
         self.send_lap(lap_time, correct)
+        self.__finish_trajectory(lap_time, correct, now)
         self.send_lap_start()
 
+    def __finish_trajectory(self, p_lap_time: float, p_valid: bool, p_end_ns: int) -> None:
+        """
+        publishes the samples of the finished lap on the lap_trajectory topic, keeps the lap if it is the fastest valid
+        lap of the driver and starts the trajectory of the next lap
+        Args:
+            p_lap_time: published lap time
+            p_valid: if the lap was driven valid
+            p_end_ns: instant the lap ended, the start of the next lap
+        """
+        trajectory = self.__lap_trajectory
+        if len(trajectory) > 0:
+            times = trajectory.get_times() - trajectory.get_start_ns()
+            positions = trajectory.get_positions()
+            if self.__trajectory_topic is not None:
+                self.publish_event(
+                    encode_lap_trajectory(self.__trajectory_topic, self.__user, p_lap_time, p_valid, times, positions)
+                )
+            best_lap = self.__best_laps.get(self.__user)
+            if p_valid and (best_lap is None or p_lap_time < best_lap.lap_time):
+                lap = RecordedLap(self.__user, p_lap_time, times, positions.copy())
+                self.__best_laps[self.__user] = lap
+                if self.__fastest_lap is None or p_lap_time < self.__fastest_lap.lap_time:
+                    self.__fastest_lap = lap
+                self.__update_reference_lap()
+        trajectory.start(p_end_ns)
+
+    def get_best_lap(self, p_driver: str | None) -> RecordedLap | None:
+        """
+        Args:
+            p_driver: name of the driver
+        Returns:
+            fastest valid lap of the driver in this session with its samples, None if the driver has none
+        """
+        return self.__best_laps.get(p_driver)
+
+    # ----- live delta -----
+
+    def __update_reference_lap(self) -> None:
+        """
+        indexes the lap the live delta is measured against when it changed: the fastest valid lap of the current driver
+        or, with live_delta_reference all_time, of all drivers in this session
+        """
+        if self.__live_delta is False:
+            return
+        lap = self.__fastest_lap if self.__delta_reference == "all_time" else self.__best_laps.get(self.__user)
+        if lap is None or len(lap.times_ns) < 2:
+            self.__reference_lap = None
+        elif self.__reference_lap is None or self.__reference_lap.get_lap() is not lap:
+            self.__reference_lap = ReferenceLap(lap)
+
+    def __publish_live_delta(self) -> None:
+        """
+        projects the recent position of the car onto the reference lap and publishes how far the current lap is behind
+        the reference lap at that point, runs on the scheduler at live_delta_hz
+        """
+        reference = self.__reference_lap
+        trajectory = self.__lap_trajectory
+        smoothed = self.__history.smoothed(DELTA_SMOOTHING_NS)
+        # the trajectory is empty while no lap is running
+        if reference is None or len(trajectory) == 0 or smoothed is None:
+            return
+        x, y, t = smoothed
+        lap_start = trajectory.get_start_ns()
+        previous_start, previous_arc = self.__delta_progress
+        location = reference.locate(x, y, previous_arc if previous_start == lap_start else 0.0)
+        if location is None:
+            return
+        arc, reference_ns = location
+        self.__delta_progress = (lap_start, arc)
+        delta = ns_to_seconds(t - lap_start - reference_ns)
+        progress = round(arc / reference.get_length(), 3)
+        self.publish_event(self.__event_encoder.live_delta(self.__user, delta, progress, reference.get_lap().lap_time))
+
     def lap_valid(self) -> bool:
         """
         checks if lap is correct (car driven through every section)
         Returns: boolean
         """
-        for checkpoint in self.__checkpoints:
-            if checkpoint.get_crossed() is False:
-                return False
-        return True
+        return self.__timing_state.all_crossed()
 
     def send_lap(self, p_time: float, p_valid: bool) -> None:
         """
@@ -179,36 +574,31 @@ class LapTimer:
 
         Returns: None
         """
-        self.__payload.clear()
-        self.__payload = {
-            "current_driver": self.__user,
-            "lap_time": p_time,
-            "lap_valid": p_valid,
-            "type": self.calc_type(p_time, "lap", p_valid),
-        }
-        msg = self.__payload
-        self.send_data(msg, self.__pynng_config["pynng"]["publishers"]["__pub_time"]["topics"]["lap_finished"])
+        time_type = self.calc_type(p_time, LAP, p_valid)
+        self.publish_event(self.__event_encoder.lap(self.__user, p_time, p_valid, time_type))
+        self.__save_records()
 
     def send_lap_start(self) -> None:
-        msg = self.__best_times
-        self.send_data(msg, self.__pynng_config["pynng"]["publishers"]["__pub_time"]["topics"]["lap_start"])
+        self.publish_event(self.__event_encoder.lap_start(self.__timing_state.all_time_best))
 
     # -----checkpoint segment-----
 
-    def checkpoint_update(self, n: int) -> None:
+    def checkpoint_update(self, n: int, p_time_ns: int | None = None) -> None:
         """
         calculate checkpoint times and sends the sector information via pynng(send_sector)
         Args:
             n: sector number
+            p_time_ns: instant the checkpoint was crossed, now if not given
 
         Returns: none
         """
-        if self.__last_checkpoint_time != 0:
-            in_lap_time = round((time.time() - self.__last_checkpoint_time), 2)
+        now = self.__clock.now_ns() if p_time_ns is None else p_time_ns
+        if self.__last_checkpoint_time is not None:
+            in_lap_time = ns_to_seconds(now - self.__last_checkpoint_time)
         else:
-            in_lap_time = round(time.time() - self.__start_time, 2)
+            in_lap_time = ns_to_seconds(now - self.__start_time)
 
-        self.__last_checkpoint_time = time.time()
+        self.__last_checkpoint_time = now
 
         # sending data
         self.send_sector(n, in_lap_time, True)
@@ -224,16 +614,9 @@ class LapTimer:
 
         Returns: None
         """
-        self.__payload.clear()
-        self.__payload = {
-            "current_driver": self.__user,
-            "sector_number": p_sector,
-            "sector_time": p_time,
-            "sector_valid": p_valid,
-            "type": self.calc_type(p_time, f"sector_{p_sector}", True),
-        }
-        msg = self.__payload
-        self.send_data(msg, self.__pynng_config["pynng"]["publishers"]["__pub_time"]["topics"]["sector:finished"])
+        time_type = self.calc_type(p_time, p_sector, True)
+        self.publish_event(self.__event_encoder.sector(self.__user, p_sector, p_time, p_valid, time_type))
+        self.__save_records()
 
     def send_data(self, p_dict: dict, p_topic: str) -> None:
         """
@@ -246,29 +629,112 @@ class LapTimer:
         json_data = json.dumps(p_dict)
         p_topic += " "
         msg = p_topic + json_data
-        print(msg)
-        self.__pub_time.send(msg.encode())
+        self.publish_event(msg.encode())
+
+    def publish_event(self, p_msg: bytes) -> None:
+        """
+        publishes an encoded message on __pub_time, the console echo is only done on debug level
+        Args:
+            p_msg: topic and payload
+        Returns:
+            None
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(p_msg.decode("utf-8", errors="replace"))
+        self.__pub_time.send(p_msg)
 
     # ----- visualisation -----
 
     def draw(self) -> None:
         """
         reads the new frame, loops through the checkpoints and draws them on the picture. Then the frame is published
-        via pynng and showed
+        via pynng and showed. Returns without drawing if no frame arrives within FRAME_RECV_TIMEOUT_MS
+
+        Input/Output:
+            None
+        """
+        try:
+            self.__read_new_frame()
+        except pynng.Timeout:
+            return
+        self.__govern_frame()
+
+    def __govern_frame(self) -> None:
+        """
+        visualises the current frame unless the frame governor skips it to keep the target frame rate or because the
+        coordinate processing is behind
 
         Input/Output:
             None
         """
-        self.__read_new_frame()
-        for checkpoint in self.__checkpoints:
-            checkpoint.draw_checkpoint(self.__frame)
+        start = self.__clock.now_ns()
+        if self.__frame_governor.admit(start, self.__coordinate_lag_ns):
+            self.draw_frame()
+            self.__frame_governor.record_draw(self.__clock.now_ns() - start)
+
+    def draw_frame(self) -> None:
+        """
+        draws the cached checkpoint overlay on the current frame, publishes it and, unless headless, shows it
+
+        Input/Output:
+            None
+        """
+        if self.__overlay is None:
+            return
+        self.__overlay.apply(self.__frame)
+        if self.__trail_ns > 0:
+            self.__draw_trail()
 
         self.publish_frame()
-        cv2.imshow("Debug", self.__frame)
+        if self.__headless is True:
+            return
+        import cv2
 
+        cv2.imshow("Debug", self.__frame)
         if cv2.waitKey(1) & 0xFF == ord("s"):
             cv2.destroyAllWindows()
 
+    def __draw_trail(self) -> None:
+        """
+        draws the positions of the last trail_s seconds onto the current frame. The history is read while the timing
+        worker may append to it, a sample overwritten meanwhile only bends the trail of this one frame
+
+        Input/Output:
+            None
+        """
+        positions, _ = self.__history.window(self.__trail_ns)
+        if len(positions) < 2:
+            return
+        import cv2
+
+        points = np.rint(positions).astype(np.int32).reshape((-1, 1, 2))
+        cv2.polylines(self.__frame, [points], False, TRAIL_COLOR, 2)
+
+    def get_metrics(self) -> dict:
+        """
+        Returns:
+            dict with the coordinate lag, the speed of the car and, if frames are received, the counters of drawn,
+            skipped, missed and published frames and the average draw time
+        """
+        metrics = {
+            "coordinate_lag_ms": self.__coordinate_lag_ns / 1_000_000,
+            "speed_px_s": self.__history.speed(SPEED_WINDOW_NS),
+        }
+        if self.__overlay is not None:
+            metrics.update(self.__frame_governor.metrics())
+            metrics["frames_missed"] = self.__frame_buffer.get_missed_frames()
+        if self.__frame_publisher is not None:
+            metrics["frames_published"] = self.__frame_publisher.get_published_frames()
+            metrics["frames_replaced"] = self.__frame_publisher.get_dropped_frames()
+        return metrics
+
+    def has_visualisation(self) -> bool:
+        """
+        Returns:
+            True if frames are received, i.e. they are shown or the overlay is published
+        """
+        return self.__overlay is not None
+
     def __read_new_frame(self) -> None:
         """
         Reads the next frame in the video.
@@ -276,57 +742,143 @@ class LapTimer:
         Input/Output:
         None
         """
-        image = self.__sub_frame.recv()
-        if self.__test is True:
-            self.__frame = np.frombuffer(image, dtype=np.uint8).reshape((480, 640, 3))
-        else:
-            self.__frame = np.frombuffer(image, dtype=np.uint8).reshape((990, 1332, 3))
+        self.__decode_frame(self.__sub_frame.recv())
+
+    def __decode_frame(self, image: bytes) -> None:
+        """
+        Copies the received frame bytes into the writable frame buffer of their resolution.
+
+        Input:
+        `image:bytes` -> frame received from the vehicle tracking, raw pixels or with frame header
+        """
+        self.__frame = self.__frame_buffer.load(image)
 
     def publish_frame(self) -> None:
         """
-        sends the edited frame via pynng
+        sends the edited frame via pynng with the configured encoding, raw frames straight from the frame buffer
 
         Input/Output:
         None
         """
-        frame_np_array = np.array(self.__frame)
-        frame_bytes = frame_np_array.tobytes()
-        self.__pub_frame.send(frame_bytes)
+        if self.__frame_publisher is not None:
+            self.__frame_publisher.publish(self.__frame_buffer)
 
     # ----- receive -----
 
-    def request_best_times(self) -> dict:
+    def swap_in_best_times(self) -> None:
+        """
+        takes over the best times the background request received, run periodically by the scheduler of the timing loop
+        between two coordinate updates, so no crossing is timed against half replaced best times
+        Returns:
+            None
+        """
+        best_times = self.__best_times_fetcher.take()
+        if best_times is not None:
+            self.__take_over_best_times(best_times)
+
+    def __take_over_best_times(self, p_best_times: dict) -> None:
         """
-        request all-time best times from the database
+        reconciles the best times received from the database with the cache and loads the result
+        Args:
+            p_best_times: best times received from the database
+        """
+        if self.__best_times_cache is not None:
+            p_best_times = self.__best_times_cache.reconcile(p_best_times)
+            self.__cache_changed = True
+        self.__timing_state.load_best_times(p_best_times)
+
+    @staticmethod
+    def fallback_best_times() -> dict:
+        """
+        best times used when the database is not available
         Returns:
             dict
         """
-        if self.__connection_state:
-            self.__request_socket.send("get_best_times".encode())
-            print(f"request sent")
-            response = self.__request_socket.recv()
-            response = response.decode("utf-8")
-            best_times = json.loads(response)
-        else:
-            best_times = {
-                "sector_1_best_time": 9.87,
-                "sector_2_best_time": 4.08,
-                "sector_3_best_time": 5.53,
-                "lap_best_time": 19.48,
-            }
-        return best_times
+        return {
+            "sector_1_best_time": 9.87,
+            "sector_2_best_time": 4.08,
+            "sector_3_best_time": 5.53,
+            "lap_best_time": 19.48,
+        }
 
     def receive_coordinates(self) -> tuple:
         """
-        receives the coordinates and returns them
+        waits for the next coordinates and returns them. The coordinate socket times out after SCHEDULER_TICK_MS for
+        the timing loop, here the receive is simply repeated until coordinates arrive
         Returns: tuple
         """
-        msg = self.__sub_coordinates.recv()
+        while True:
+            try:
+                return self.decode_coordinates(self.__sub_coordinates.recv())
+            except pynng.Timeout:
+                continue
+
+    def __drain_coordinates(self, p_first_msg: bytes, p_receive_time_ns: int, p_drain: bool = True) -> tuple:
+        """
+        decodes the given message and every message still queued on the coordinate socket
+        Args:
+            p_first_msg: message that was already received
+            p_receive_time_ns: instant p_first_msg was received
+            p_drain: False only decodes p_first_msg
+        Returns: (N, 2) array of coordinates, (N,) array of timestamps in nanoseconds
+        """
+        batch = [self.__timed_coordinates(self.decode_coordinates(p_first_msg), p_receive_time_ns)]
+        while p_drain:
+            try:
+                msg = self.__sub_coordinates.recv(block=False)
+            except pynng.TryAgain:
+                break
+            batch.append(self.__timed_coordinates(self.decode_coordinates(msg), self.__clock.now_ns()))
+        coordinates = np.array([(x, y) for x, y, _ in batch], dtype=np.float64)
+        times = np.array([t for _, _, t in batch], dtype=np.int64)
+        return coordinates, times
+
+    def __timed_coordinates(self, p_coordinates, p_receive_time_ns: int) -> tuple:
+        """
+        the capture timestamp decoded from the message (integer nanoseconds of time.monotonic_ns()) is used if it is
+        within MAX_CAPTURE_SKEW_NS of the receive timestamp, otherwise the receive timestamp is used
+        Returns: (x, y, t)
+        """
+        if len(p_coordinates) > 2:
+            timestamp_ns = p_coordinates[2]
+            if (
+                isinstance(timestamp_ns, (int, np.integer))
+                and abs(p_receive_time_ns - timestamp_ns) <= MAX_CAPTURE_SKEW_NS
+            ):
+                self.__timestamp_rejected = False
+                return p_coordinates[0], p_coordinates[1], int(timestamp_ns)
+            if not self.__timestamp_rejected:
+                self.__timestamp_rejected = True
+                logger.warning(
+                    "ignoring capture timestamp %r, it is not within %.1f s of the receive time, using the receive time",
+                    timestamp_ns,
+                    MAX_CAPTURE_SKEW_NS / NS_PER_SECOND,
+                )
+        return p_coordinates[0], p_coordinates[1], p_receive_time_ns
+
+    @staticmethod
+    def decode_coordinates(msg: bytes) -> tuple:
+        """
+        strips the topic from a received coordinate message and decodes the coordinates. The format is detected per
+        message: the binary layout of wire_format is read straight from the buffer, everything else is parsed as JSON,
+        either a list [x, y] or an object {"x": x, "y": y, "timestamp_ns": t} with optional capture timestamp. Further
+        values of a JSON list are ignored, only the binary layout and the named field carry a capture timestamp
+        Args:
+            msg: message received on the coordinate topic
+        Returns: tuple, (x, y) or (x, y, capture timestamp)
+        """
         i = msg.find(b" ")
+        if is_binary_coordinates(msg, i + 1):
+            _, x, y, timestamp_ns = decode_binary_coordinates(msg, i + 1)
+            return x, y, timestamp_ns
         data = msg[i + 1 :]
         json_data = data.decode("utf-8")
         coordinates = json.loads(json_data)
-        return coordinates
+        if isinstance(coordinates, dict):
+            if "timestamp_ns" in coordinates:
+                return coordinates["x"], coordinates["y"], coordinates["timestamp_ns"]
+            return coordinates["x"], coordinates["y"]
+        return coordinates[0], coordinates[1]
 
     def receive_user(self) -> str | None:
         """
@@ -335,24 +887,28 @@ class LapTimer:
         Returns: str, None
         """
         try:
-            msg = self.__sub_user.recv(block=False)
-            msg = msg.decode("utf-8")
-            i = msg.find(" ")
-            data = msg[i + 1 :]
-            return data
+            return self.decode_user(self.__sub_user.recv(block=False))
         except pynng.TryAgain:
             return None
 
+    @staticmethod
+    def decode_user(msg: bytes) -> str:
+        """
+        strips the topic from a received driver message
+        Args:
+            msg: message received on the current driver topic
+        Returns: str
+        """
+        text = msg.decode("utf-8")
+        i = text.find(" ")
+        return text[i + 1 :]
+
     # ----- User -----
 
     def change_user(self, p_name) -> None:
         self.__user = p_name
-        self.__pers_best_times = {
-            "sector_1_best_time": 1000.0,
-            "sector_2_best_time": 1000.0,
-            "sector_3_best_time": 1000.0,
-            "lap_best_time": 1000.0,
-        }
+        self.__load_personal_best()
+        self.__update_reference_lap()
 
     def user_handler(self) -> None:
         name = self.receive_user()
@@ -368,77 +924,433 @@ class LapTimer:
 
         Returns: none
         """
-        if self.__fallback is False:
-            coordinates = Point(self.receive_coordinates())
-            self.coordinates_list.append(coordinates)
-            if len(self.coordinates_list) > 2:
-                self.coordinates_list.pop(0)
-                for checkpoint in self.__checkpoints:
-                    if isinstance(checkpoint, FinishLineCheckpoint):  # check if checkpoint is a finish line
-                        if checkpoint.check(self.coordinates_list):
-                            correct = self.lap_valid()
-                            self.checkpoint_update(self.__number_of_checkpoints)
-                            self.lap_update(correct)
-                    else:
-                        if checkpoint.check(self.coordinates_list):
-                            self.checkpoint_update(checkpoint.get_num())
+        try:
+            msg = self.__sub_coordinates.recv()
+        except pynng.Timeout:
+            # no coordinates for SCHEDULER_TICK_MS, nothing is waiting to be processed and the timing loop goes on to
+            # run the scheduled tasks
+            self.__coordinate_lag_ns = 0
+            return
+        self.handle_coordinate_message(msg, self.__clock.now_ns())
+
+    def handle_coordinate_message(self, p_msg: bytes, p_receive_time_ns: int, p_drain: bool = True) -> None:
+        """
+        processes a message of the coordinate socket according to the mode, shared by the receive loops and the replay
+        of recording.py
+        Args:
+            p_msg: received message
+            p_receive_time_ns: instant the message was received
+            p_drain: in batch mode, also process the messages still queued on the coordinate socket. The replay passes
+                False, its messages do not come from the socket and live ones must not mix in.
+        Returns: none
+        """
+        if self.__fallback is True:
+            self.process_fallback(p_msg)
+        elif self.__batch is True:
+            coordinates, times = self.__drain_coordinates(p_msg, p_receive_time_ns, p_drain)
+            self.process_coordinate_batch(coordinates, times, p_receive_time_ns)
         else:
-            received_bytes = self.__sub_coordinates.recv()
-            num = int.from_bytes(received_bytes, "big")
-            self.checkpoint_update(num)
-            if num != 3:
-                self.__checkpoints[num].set_crossed(True)
+            self.process_coordinates(self.decode_coordinates(p_msg), p_receive_time_ns)
+
+    def handle_frame_message(self, p_msg) -> None:
+        """
+        takes a received frame into the frame buffer and visualises it unless the frame governor skips it, frames are
+        ignored without visualisation
+        Args:
+            p_msg: received frame
+        Returns: none
+        """
+        if self.__overlay is not None:
+            self.__decode_frame(p_msg)
+            self.__govern_frame()
+
+    def handle_user_message(self, p_msg: bytes) -> None:
+        """
+        Args:
+            p_msg: message received on the current driver topic
+        Returns: none
+        """
+        self.change_user(self.decode_user(p_msg))
+
+    def run_scheduled(self, p_now_ns: int) -> None:
+        """
+        runs the scheduled tasks that are due at the given instant
+        Args:
+            p_now_ns: instant the timing loop is at
+        Returns: none
+        """
+        self.__scheduler.run_due(p_now_ns)
+
+    def process_coordinates(self, p_coordinates: tuple, p_receive_time_ns: int | None = None) -> None:
+        """
+        adds the coordinates to the motion segment and tests it against every checkpoint in one vectorized call, or
+        for large layouts only against the candidates the checkpoint grid returns. The crossing instants are
+        interpolated between the timestamps of the two positions.
+        Args:
+            p_coordinates: coordinates received from the vehicle tracking, optionally with the capture timestamp as
+                third value
+            p_receive_time_ns: instant the coordinates were received, used if they carry no capture timestamp and for the
+                coordinate lag
+
+        Returns: none
+        """
+        receive_time = self.__clock.now_ns() if p_receive_time_ns is None else p_receive_time_ns
+        x, y, t = self.__timed_coordinates(p_coordinates, receive_time)
+        previous = self.__history.newest()
+        self.__history.append(x, y, t)
+        if previous is not None:
+            start_x, start_y, start_time = previous
+            if self.__debounce_remaining > 0:
+                self.__advance_debounce(1, math.hypot(x - start_x, y - start_y))
+            if self.__checkpoint_grid is not None:
+                candidates = self.__checkpoint_grid.candidates((start_x, start_y), (x, y))
+                indices, fractions = self.__test_candidates(candidates, start_x, start_y, x, y)
+            elif self.__crossing_candidates is not None:
+                indices, fractions = self.__test_candidates(self.__crossing_candidates, start_x, start_y, x, y)
             else:
-                self.__checkpoints[0].set_crossed(True)
-                self.lap_update(self.lap_valid())
+                indices, fractions = self.__crossing_engine.crossings((start_x, start_y), (x, y))
+            self.__handle_crossings(indices, fractions, start_time, t)
+        # appended after the crossings, a lap ending on this segment ends with its start
+        if self.__lap_running is True:
+            self.__lap_trajectory.append(x, y, t)
+        self.__coordinate_lag_ns = self.__clock.now_ns() - receive_time
+
+    def __test_candidates(self, p_candidates, q1x, q1y, q2x, q2y) -> tuple:
+        """
+        tests the motion segment from (q1x, q1y) to (q2x, q2y) against the given checkpoints one by one
+        Args:
+            p_candidates: ascending checkpoint indices
+        Returns: (indices of the crossed checkpoints, fraction of the segment to each crossing)
+        """
+        indices = []
+        fractions = []
+        for i in p_candidates:
+            fraction = self.__checkpoints[i].crossing_fraction(q1x, q1y, q2x, q2y)
+            if fraction is not None:
+                indices.append(i)
+                fractions.append(fraction)
+        return indices, fractions
+
+    def process_coordinate_batch(
+        self, p_coordinates: np.ndarray, p_times_ns: np.ndarray, p_receive_time_ns: int | None = None
+    ) -> None:
+        """
+        evaluates all motion segments of a batch of coordinates against the checkpoints in one pass and fires the
+        crossings in the order they were driven
+        Args:
+            p_coordinates: (N, 2) array of coordinates in the order they were received
+            p_times_ns: (N,) array of their timestamps in nanoseconds
+            p_receive_time_ns: instant the first coordinates of the batch were received, for the coordinate lag
+
+        Returns: none
+        """
+        receive_time = self.__clock.now_ns() if p_receive_time_ns is None else p_receive_time_ns
+        # the newest known position leads the batch, so the first segment joins it to the batch
+        previous_positions, previous_times = self.__history.last(1)
+        path = np.concatenate((previous_positions, p_coordinates))
+        times = np.concatenate((previous_times, p_times_ns))
+        # coordinates of the batch before this index are in the lap trajectory, path[i] is p_coordinates[i - lead]
+        lead = len(previous_times)
+        captured = 0
+        if len(path) > 1:
+            segment_lengths = np.hypot(*np.diff(path, axis=0).T)
+            # segments before this index have been counted for the finish line debounce
+            counted = 0
+            for segment, indices, fractions in self.__crossing_engine.path_crossings(path):
+                if self.__debounce_remaining > 0:
+                    self.__advance_debounce(segment + 1 - counted, float(segment_lengths[counted : segment + 1].sum()))
+                counted = segment + 1
+                # like in process_coordinates, the lap trajectory ends with the start of the segment
+                captured = self.__capture_trajectory(p_coordinates, p_times_ns, captured, segment + 1 - lead)
+                self.__handle_crossings(indices, fractions, int(times[segment]), int(times[segment + 1]))
+            if self.__debounce_remaining > 0:
+                self.__advance_debounce(len(segment_lengths) - counted, float(segment_lengths[counted:].sum()))
+        self.__capture_trajectory(p_coordinates, p_times_ns, captured, len(p_times_ns))
+        self.__history.extend(p_coordinates, p_times_ns)
+        # the first message of the batch waited the longest
+        self.__coordinate_lag_ns = self.__clock.now_ns() - receive_time
+
+    def __capture_trajectory(self, p_coordinates: np.ndarray, p_times_ns: np.ndarray, p_start: int, p_end: int) -> int:
+        """
+        adds the coordinates of the batch from p_start to p_end to the lap trajectory while a lap is running
+        Returns:
+            index of the first coordinate not added yet
+        """
+        if p_end <= p_start:
+            return p_start
+        if self.__lap_running is True:
+            self.__lap_trajectory.extend(p_coordinates[p_start:p_end], p_times_ns[p_start:p_end])
+        return p_end
+
+    def __handle_crossings(self, p_indices, p_fractions, p_start_time: int, p_end_time: int) -> None:
+        """
+        updates the checkpoints the current motion segment crossed, in the order they were crossed
+        Args:
+            p_indices: indices of the crossed checkpoints
+            p_fractions: where on the motion segment each checkpoint was crossed (0 start, 1 end)
+            p_start_time: timestamp of the start of the motion segment in nanoseconds
+            p_end_time: timestamp of the end of the motion segment in nanoseconds
+
+        Returns: none
+        """
+        for fraction, index in sorted(zip(p_fractions, p_indices), key=lambda crossing: crossing[0]):
+            crossing_time = p_start_time + round(fraction * (p_end_time - p_start_time))
+            # debounce and lap timeout tasks due before the crossing run first
+            self.__scheduler.run_due(crossing_time)
+            checkpoint = self.__checkpoints[index]
+            if isinstance(checkpoint, FinishLineCheckpoint):  # check if checkpoint is a finish line
+                if self.__timing_state.register_crossing(index):
+                    self.__arm_debounce(crossing_time)
+                    if self.__lap_running is False:
+                        self.__restart_lap(crossing_time)
+                        continue
+                    correct = self.lap_valid()
+                    self.checkpoint_update(self.__number_of_checkpoints, crossing_time)
+                    self.lap_update(correct, crossing_time)
+            elif self.__lap_running is True:
+                if self.__timing_state.register_crossing(index):
+                    self.checkpoint_update(checkpoint.get_num(), crossing_time)
+
+    # ----- finish line debounce and lap timeout -----
+
+    def __arm_debounce(self, p_crossing_time: int) -> None:
+        """
+        keeps the finish line from counting again until the car drove on for the configured time, distance or number
+        of samples
+        Args:
+            p_crossing_time: instant the finish line was crossed in nanoseconds
+        """
+        if self.__debounce_unit == "seconds":
+            rearm_time = p_crossing_time + round(self.__debounce_value * NS_PER_SECOND)
+            self.__scheduler.call_at(rearm_time, self.__rearm_finish_line)
+        else:
+            self.__debounce_remaining = self.__debounce_value
 
-    def calc_type(self, p_time: float, p_sector: str, p_valid: bool) -> str:
+    def __advance_debounce(self, p_samples: int, p_distance: float) -> None:
+        """
+        counts the samples or the distance driven since the finish line was crossed
+        Args:
+            p_samples: number of new samples
+            p_distance: distance covered by them in pixels
+        """
+        self.__debounce_remaining -= p_samples if self.__debounce_unit == "samples" else p_distance
+        if self.__debounce_remaining <= 0:
+            self.__rearm_finish_line()
+
+    def __rearm_finish_line(self) -> None:
+        self.__debounce_remaining = 0
+        self.__timing_state.clear_crossed(0)
+
+    def __schedule_lap_timeout(self, p_lap_start_time: int) -> None:
+        self.__scheduler.cancel(self.__lap_timeout)
+        self.__lap_timeout = None
+        if self.__lap_timeout_ns and self.__fallback is False:
+            self.__lap_timeout = self.__scheduler.call_at(
+                p_lap_start_time + self.__lap_timeout_ns, self.__lap_timed_out
+            )
+
+    def __lap_timed_out(self) -> None:
+        """
+        abandons the current lap after lap_timeout_s without reaching the finish line. Sector crossings are ignored
+        until the next finish line crossing, which starts a new lap instead of finishing the abandoned one.
+        """
+        self.__lap_timeout = None
+        self.__lap_running = False
+        self.__lap_trajectory.start(0)
+        self.__timing_state.clear_crossed()
+
+    def __restart_lap(self, p_time_ns: int) -> None:
+        self.__lap_running = True
+        self.__last_lap_time = p_time_ns
+        self.__last_checkpoint_time = p_time_ns
+        self.__lap_trajectory.start(p_time_ns)
+        self.send_lap_start()
+        self.__schedule_lap_timeout(p_time_ns)
+
+    def process_fallback(self, p_received_bytes: bytes) -> None:
+        """
+        handles a crossed checkpoint number sent by the fallback coordinate source
+        Args:
+            p_received_bytes: big endian number of the crossed checkpoint
+
+        Returns: none
+        """
+        num = int.from_bytes(p_received_bytes, "big")
+        self.checkpoint_update(num)
+        if num != self.__number_of_checkpoints:
+            self.__timing_state.mark_crossed(num)
+        else:
+            self.__timing_state.mark_crossed(0)
+            self.lap_update(self.lap_valid())
+
+    def calc_type(self, p_time: float, p_sector: int, p_valid: bool) -> str:
         """
          calculates if the time is an alltime best(purple), personal best(green) or just a normal time(orange)
          changes the alltime and personal best values if necessary
         Args:
             p_time: sector time
-            p_sector: which sector
+            p_sector: sector number, LAP (0) for the whole lap
             p_valid: if the sector was driven correct
 
         Returns: string
         """
-        if p_time < self.__best_times[f"{p_sector}_best_time"]:
+        state = self.__timing_state
+        state.last_time[p_sector] = p_time
+        if p_time < state.all_time_best[p_sector]:
             if p_valid:
-                self.__best_times[f"{p_sector}_best_time"] = p_time
-            if p_time < self.__pers_best_times[f"{p_sector}_best_time"]:
+                state.all_time_best[p_sector] = p_time
+                self.__all_time_records[best_time_key(p_sector)] = p_time
+            if p_time < state.personal_best[p_sector]:
                 if p_valid:
-                    self.__pers_best_times[f"{p_sector}_best_time"] = p_time
+                    state.personal_best[p_sector] = p_time
+                    self.__personal_records[best_time_key(p_sector)] = p_time
             return "purple"
-        elif p_time < self.__pers_best_times[f"{p_sector}_best_time"]:
+        elif p_time < state.personal_best[p_sector]:
             if p_valid:
-                self.__pers_best_times[f"{p_sector}_best_time"] = p_time
+                state.personal_best[p_sector] = p_time
+                self.__personal_records[best_time_key(p_sector)] = p_time
             return "green"
         else:
             return "yellow"
 
     def start_timer(self) -> None:
-        self.__start_time = time.time()
+        self.__start_time = self.__clock.now_ns()
+        self.__lap_running = True
+        self.__lap_trajectory.start(self.__start_time)
         self.send_lap_start()
+        self.__schedule_lap_timeout(self.__start_time)
 
-    def run(self) -> None:
+    # ----- asyncio mode -----
+
+    async def arun(self) -> None:
         """
-        main function
+        main function of the asyncio mode. Coordinates, frames, driver changes and the best times response are all
+        awaited on one event loop, so each of them is handled as soon as it arrives without busy looping
+        Returns: None
+        """
+        tasks = [self.__best_times_task(), self.__coordinate_task(), self.__user_task()]
+        if self.has_visualisation():
+            tasks.append(self.__frame_task())
+        await asyncio.gather(*tasks)
+
+    async def __best_times_task(self) -> None:
+        best_times = await self.__best_times_fetcher.afetch()
+        if best_times is not None:
+            self.__take_over_best_times(best_times)
+
+    async def __coordinate_task(self) -> None:
+        while not self.__stop_event.is_set():
+            try:
+                msg = await self.__sub_coordinates.arecv()
+            except pynng.Timeout:
+                msg = None
+                self.__coordinate_lag_ns = 0
+            if msg is not None:
+                self.handle_coordinate_message(msg, self.__clock.now_ns())
+            self.run_scheduled(self.__clock.now_ns())
+
+    async def __frame_task(self) -> None:
+        while not self.__stop_event.is_set():
+            try:
+                msg = await self.__sub_frame.arecv()
+            except pynng.Timeout:
+                continue
+            self.handle_frame_message(msg)
+
+    async def __user_task(self) -> None:
+        while not self.__stop_event.is_set():
+            self.handle_user_message(await self.__sub_user.arecv())
+
+    # ----- workers -----
+
+    def start_timing_worker(self) -> None:
+        """
+        starts the timing loop (coordinates -> crossing -> publish) on its own thread, so it never has to wait for a
+        frame to be received or drawn
+        Returns: None
+        """
+        if self.__timing_thread is None:
+            self.__stop_event.clear()
+            self.__timing_thread = threading.Thread(target=self.__timing_worker, name="timing", daemon=True)
+            self.__timing_thread.start()
+
+    def __timing_worker(self) -> None:
+        """
+        receive loop of the timing worker, runs until stop() is called or an exception ends it. The exception is logged
+        and kept for run(), which raises it, so the timing never stops silently behind a running debug view
+        Returns: None
+        """
+        try:
+            while not self.__stop_event.is_set():
+                self.timing_step()
+        except Exception as error:
+            logger.exception("timing worker failed")
+            self.__worker_error = error
+            self.__stop_event.set()
+
+    def timing_step(self) -> None:
+        """
+        processes the next coordinate update, checks for a new driver and runs the scheduled tasks that are due
         Returns: None
         """
-        self.draw()
         self.checkpoint_check()
         self.user_handler()
+        self.run_scheduled(self.__clock.now_ns())
+
+    def stop(self) -> None:
+        """
+        stops the timing worker after its current iteration and waits for it, the coordinate socket times out after
+        SCHEDULER_TICK_MS, so the wait is short
+        Returns: None
+        """
+        self.__stop_event.set()
+        thread = self.__timing_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.__timing_thread = None
+        self.__write_best_times_cache()
+        if self.__best_times_cache is not None:
+            self.__best_times_cache.close()
+        self.__best_times_fetcher.stop()
+        if self.__frame_publisher is not None:
+            self.__frame_publisher.close()
+
+    def run(self) -> None:
+        """
+        main function, makes sure the timing worker is running and then handles the visualisation on the calling
+        thread. A slow or stalled frame source therefore only freezes the debug view and never delays the timing.
+        Without visualisation (headless and overlay publishing disabled) the timing runs on the calling thread. If an
+        exception ended the timing worker, a RuntimeError caused by it is raised, which ends the main loop. The frame
+        receive times out after FRAME_RECV_TIMEOUT_MS, so that also happens while no frames arrive.
+        Returns: None
+        """
+        self.__check_timing_worker()
+        if self.has_visualisation() is False:
+            self.timing_step()
+            return
+        self.start_timing_worker()
+        self.draw()
+        self.__check_timing_worker()
+
+    def __check_timing_worker(self) -> None:
+        if self.__worker_error is not None:
+            raise RuntimeError("the timing worker failed") from self.__worker_error
 
 
 class Point:
+    # slotted, a Point is created for every received coordinate
+    __slots__ = ("__x", "__y")
+
     def __init__(self, p_coordinates: tuple) -> None:
         self.__x = p_coordinates[0]
         self.__y = p_coordinates[1]
 
     def __getitem__(self, key=0) -> int:
-        item = (self.__x, self.__y)
-        return item[key]
+        if key == 0:
+            return self.__x
+        if key == 1:
+            return self.__y
+        return (self.__x, self.__y)[key]
 
     def get_x(self) -> int:
         return self.__x
@@ -456,9 +1368,12 @@ class Point:
         Returns: boolean
 
         """
-        if min(self[0], p2[0]) <= sx <= max(self[0], p2[0]) and min(self[1], p2[1]) <= sy <= max(self[1], p2[1]):
-            return True
-        return False
+        x1, y1, x2, y2 = self.__x, self.__y, p2[0], p2[1]
+        if x2 < x1:
+            x1, x2 = x2, x1
+        if y2 < y1:
+            y1, y2 = y2, y1
+        return x1 <= sx <= x2 and y1 <= sy <= y2
 
     def calc_intersection(self, p_point, p_checkpoint) -> bool:
         """
@@ -469,38 +1384,41 @@ class Point:
             p_checkpoint: the checkpoint with that the intersection shouldbe checked
         Returns: boolean
         """
-
-        def det(a, b):
-            return a[0] * b[1] - a[1] * b[0]
-
-        p1 = Point((p_checkpoint.get_x1(), p_checkpoint.get_y1()))
-        p2 = Point((p_checkpoint.get_x2(), p_checkpoint.get_y2()))
-        q1 = Point((self.get_x(), self.get_y()))
-        q2 = Point((p_point.get_x(), p_point.get_y()))
-
-        xdiff = (p1[0] - p2[0], q1[0] - q2[0])
-        ydiff = (p1[1] - p2[1], q1[1] - q2[1])
-
-        div = det(xdiff, ydiff)
-        if div == 0:
-            return False
-
-        d = (det(*(p1, p2)), det(*(q1, q2)))
-        x = det(d, xdiff) / div
-        y = det(d, ydiff) / div
-
-        if p1.prf_area(p2, x, y) & q1.prf_area(q2, x, y):
-            return True
-        return False
+        return p_checkpoint.crossing_fraction(self.__x, self.__y, p_point.get_x(), p_point.get_y()) is not None
 
 
 class Checkpoint:
+    # slotted, everything the crossing test needs from the line is computed once here
+    __slots__ = (
+        "__x1",
+        "__y1",
+        "__x2",
+        "__y2",
+        "__xdiff",
+        "__ydiff",
+        "__det",
+        "__min_x",
+        "__max_x",
+        "__min_y",
+        "__max_y",
+        "__num",
+    )
+
     def __init__(self, checkpoint: dict, p_num: int) -> None:
         self.__x1 = checkpoint["x1"]
         self.__y1 = checkpoint["y1"]
         self.__x2 = checkpoint["x2"]
         self.__y2 = checkpoint["y2"]
-        self.__crossed = False
+        # direction vector (from the second to the first endpoint) and determinant of the line, the coefficients of
+        # the line equation ydiff * x - xdiff * y = det
+        self.__xdiff = self.__x1 - self.__x2
+        self.__ydiff = self.__y1 - self.__y2
+        self.__det = self.__x1 * self.__y2 - self.__y1 * self.__x2
+        # bounding box
+        self.__min_x = min(self.__x1, self.__x2)
+        self.__max_x = max(self.__x1, self.__x2)
+        self.__min_y = min(self.__y1, self.__y2)
+        self.__max_y = max(self.__y1, self.__y2)
         self.__num = p_num
 
     def draw_checkpoint(self, img) -> None:
@@ -512,28 +1430,38 @@ class Checkpoint:
         """
         pts = np.array([[self.__x1, self.__y1], [self.__x2, self.__y2]])
         pts = pts.reshape((-1, 1, 2))
+        import cv2
+
         cv2.polylines(img, [pts], True, (0, 0, 255), 3)
 
-    def check_line(
-        self,
-        p_points: list,
-    ) -> bool:
+    def crossing_fraction(self, q1x, q1y, q2x, q2y) -> float | None:
         """
-        checks if the car drives through the given Pixels
-        input:
-            p_points: list of coordinates received from the vehicle tracking
-        Returns: boolean
+        intersects the motion segment from (q1x, q1y) to (q2x, q2y) with the line using the precomputed coefficients,
+        without creating any objects but the floats. The arithmetic is the one of CrossingEngine, so both return the
+        same results
+        Args:
+            q1x, q1y: start of the motion segment
+            q2x, q2y: end of the motion segment
+        Returns: fraction of the segment between 0 and 1 where the line is crossed, None if it is not crossed
         """
-        if p_points[0].calc_intersection(p_points[1], self):
-            self.__crossed = True
-            return True
-        return False
-
-    def get_crossed(self) -> bool:
-        return self.__crossed
-
-    def set_crossed(self, x: bool) -> None:
-        self.__crossed = x
+        q_xdiff = q1x - q2x
+        q_ydiff = q1y - q2y
+        div = self.__xdiff * q_ydiff - q_xdiff * self.__ydiff
+        if div == 0:
+            return None
+        q_det = q1x * q2y - q1y * q2x
+        x = (self.__det * q_xdiff - q_det * self.__xdiff) / div
+        y = (self.__det * q_ydiff - q_det * self.__ydiff) / div
+        if not (self.__min_x <= x <= self.__max_x and self.__min_y <= y <= self.__max_y):
+            return None
+        if not (min(q1x, q2x) <= x <= max(q1x, q2x) and min(q1y, q2y) <= y <= max(q1y, q2y)):
+            return None
+        # segment_fraction of crossing_engine for a single crossing
+        if abs(q_xdiff) >= abs(q_ydiff):
+            fraction = (x - q1x) / (q2x - q1x)
+        else:
+            fraction = (y - q1y) / (q2y - q1y)
+        return float(min(max(fraction, 0.0), 1.0))
 
     def get_num(self) -> int:
         return self.__num
@@ -552,23 +1480,14 @@ class Checkpoint:
 
 
 class FinishLineCheckpoint(Checkpoint):
+    __slots__ = ()
+
     def __init__(self, checkpoint: dict, p_num: int) -> None:
         super().__init__(checkpoint, p_num)
 
-    def check(self, coordinates: list) -> bool:
-        if self.get_crossed() is False:
-            if self.check_line(coordinates):
-                run_scheduled_task(2, self.set_crossed, False)
-                return True
-        return False
-
 
 class SectorLineCheckpoint(Checkpoint):
+    __slots__ = ()
+
     def __init__(self, checkpoint: dict, p_num: int) -> None:
         super().__init__(checkpoint, p_num)
-
-    def check(self, coordinates: list) -> bool:
-        if self.get_crossed() is False:
-            if self.check_line(coordinates):
-                return True
-        return False
@@ -0,0 +1,128 @@
+# Copyright (C) 2023, NG:ITL
+import numpy as np
+
+# index of the whole lap in the per-sector arrays, the sectors use their number (1 to number of sectors)
+LAP = 0
+# time used while no best time is known
+NO_TIME = 1000.0
+# the finish line is the first checkpoint
+FINISH_LINE_BIT = 1
+
+
+def best_time_key(p_sector: int) -> str:
+    """
+    Args:
+        p_sector: sector number, LAP (0) for the whole lap
+    Returns:
+        name of the best time of the sector in the format of the database
+    """
+    return "lap_best_time" if p_sector == LAP else f"sector_{p_sector}_best_time"
+
+
+class TimingState:
+    """
+    Timing state indexed by sector number, works for any number of checkpoints. Holds the all-time best, the personal
+    best and the last time of every sector and of the lap, plus a bitmask of the checkpoints crossed in this lap. The
+    bitmask is the only crossed state: a sector line counts once per lap, the finish line (checkpoint 0) stays crossed
+    until the debounce re-arms it.
+    """
+
+    def __init__(self, p_number_of_sectors: int) -> None:
+        """
+        Args:
+            p_number_of_sectors: number of sectors of a lap, equals the number of checkpoints
+        """
+        self.__number_of_sectors = p_number_of_sectors
+        self.all_time_best = np.full(p_number_of_sectors + 1, NO_TIME)
+        self.personal_best = np.full(p_number_of_sectors + 1, NO_TIME)
+        self.last_time = np.full(p_number_of_sectors + 1, NO_TIME)
+        self.crossed_mask = 0
+        self.full_mask = (1 << p_number_of_sectors) - 1
+
+    def get_number_of_sectors(self) -> int:
+        return self.__number_of_sectors
+
+    # ----- crossed checkpoints -----
+
+    def mark_crossed(self, p_checkpoint: int) -> None:
+        self.crossed_mask |= 1 << int(p_checkpoint)
+
+    def register_crossing(self, p_checkpoint: int) -> bool:
+        """
+        marks the checkpoint as crossed after the crossing engine reported an intersection
+        Args:
+            p_checkpoint: index of the checkpoint, 0 is the finish line
+        Returns:
+            boolean, False if the checkpoint was already crossed
+        """
+        bit = 1 << int(p_checkpoint)
+        if self.crossed_mask & bit:
+            return False
+        self.crossed_mask |= bit
+        return True
+
+    def is_crossed(self, p_checkpoint: int) -> bool:
+        return bool(self.crossed_mask & (1 << int(p_checkpoint)))
+
+    def clear_crossed(self, p_checkpoint: int | None = None) -> None:
+        """
+        Args:
+            p_checkpoint: index of the checkpoint that can be crossed again, None clears all checkpoints
+        """
+        if p_checkpoint is None:
+            self.crossed_mask = 0
+        else:
+            self.crossed_mask &= ~(1 << int(p_checkpoint))
+
+    def clear_sectors(self) -> None:
+        """
+        starts a new lap, the sector lines can be crossed again. The finish line keeps its state, it is re-armed by the
+        debounce
+        """
+        self.crossed_mask &= FINISH_LINE_BIT
+
+    def all_crossed(self) -> bool:
+        return self.crossed_mask == self.full_mask
+
+    # ----- best times -----
+
+    def reset_personal_best(self) -> None:
+        self.personal_best.fill(NO_TIME)
+
+    def __from_dict(self, p_times: dict, p_defaults: np.ndarray) -> np.ndarray:
+        times = p_defaults.copy()
+        for sector in range(self.__number_of_sectors + 1):
+            times[sector] = p_times.get(best_time_key(sector), times[sector])
+        return times
+
+    def __to_dict(self, p_times: np.ndarray) -> dict:
+        times = {best_time_key(sector): float(p_times[sector]) for sector in range(1, self.__number_of_sectors + 1)}
+        times[best_time_key(LAP)] = float(p_times[LAP])
+        return times
+
+    def load_best_times(self, p_best_times: dict) -> None:
+        """
+        takes over the all-time best times in the format of the database ("sector_<n>_best_time", "lap_best_time"),
+        sectors missing in the dict keep their current value. The new times are filled into a new array that replaces
+        the old one in a single assignment, readers on other threads see either all old or all new times.
+        Args:
+            p_best_times: best times received from the database
+        """
+        self.all_time_best = self.__from_dict(p_best_times, self.all_time_best)
+
+    def best_times(self) -> dict:
+        """
+        returns the all-time best times in the format of the database
+        Returns:
+            dict
+        """
+        return self.__to_dict(self.all_time_best)
+
+    def load_personal_best(self, p_personal_best: dict) -> None:
+        """
+        takes over the personal best times of a driver in the format of the database, sectors missing in the dict
+        have no personal best
+        Args:
+            p_personal_best: personal best times, e.g. from the best times cache
+        """
+        self.personal_best = self.__from_dict(p_personal_best, np.full(self.__number_of_sectors + 1, NO_TIME))
@@ -2,7 +2,6 @@
 import json
 import os
 from pathlib import Path
-from threading import Timer
 
 
 def read_config(config_file_name: str) -> dict:
@@ -37,17 +36,3 @@ def find_config_file(relative_path: str) -> bool:
             return True
     print("-----!File not found!-----")
     return False
-
-
-def run_scheduled_task(p_time: int, scheduled_task, arg=None) -> None:
-    """
-    Args:
-        p_time: time till the method will be executed
-        scheduled_task: method that should be run
-        arg: argument that should be passed to the method
-
-    Returns:
-        None
-    """
-    threading_timer = Timer(p_time, scheduled_task, [arg])
-    threading_timer.start()
@@ -0,0 +1,346 @@
+# Copyright (C) 2023, NG:ITL
+import json
+import struct
+import zlib
+
+import numpy as np
+
+# Binary coordinate payload, sent after the topic and a space instead of the JSON list:
+# magic (2 bytes), version (uint8), padding, car id (uint32), x (float64), y (float64), capture timestamp (int64, ns)
+COORDINATE_MAGIC = b"\xc7\x01"
+COORDINATE_VERSION = 1
+COORDINATE_STRUCT = struct.Struct("<2sBxIddq")
+
+
+def is_binary_coordinates(p_msg: bytes, p_offset: int) -> bool:
+    """
+    Args:
+        p_msg: received message
+        p_offset: start of the payload behind the topic
+    Returns:
+        True if the payload uses the binary coordinate layout, False for JSON
+    """
+    return p_msg[p_offset : p_offset + 2] == COORDINATE_MAGIC
+
+
+def decode_binary_coordinates(p_msg: bytes, p_offset: int) -> tuple:
+    """
+    reads a binary coordinate payload straight from the received buffer
+    Args:
+        p_msg: received message
+        p_offset: start of the payload behind the topic
+    Returns:
+        (car id, x, y, capture timestamp in nanoseconds)
+    """
+    _, version, car_id, x, y, timestamp_ns = COORDINATE_STRUCT.unpack_from(p_msg, p_offset)
+    if version != COORDINATE_VERSION:
+        raise ValueError(f"Unsupported coordinate format version {version}")
+    return car_id, x, y, timestamp_ns
+
+
+def encode_binary_coordinates(p_topic: str, p_car_id: int, p_x: float, p_y: float, p_timestamp_ns: int) -> bytes:
+    """
+    builds a binary coordinate message, used by the vehicle tracking and the replay
+    Args:
+        p_topic: topic the message is published on
+        p_car_id: id of the tracked car
+        p_x: x coordinate in pixels
+        p_y: y coordinate in pixels
+        p_timestamp_ns: capture timestamp, integer nanoseconds of time.monotonic_ns()
+    Returns:
+        bytes
+    """
+    payload = COORDINATE_STRUCT.pack(COORDINATE_MAGIC, COORDINATE_VERSION, p_car_id, p_x, p_y, p_timestamp_ns)
+    return p_topic.encode() + b" " + payload
+
+
+# Binary event payloads, opt-in replacement for the JSON payloads on the __pub_time topics:
+# magic (2 bytes), event kind (uint8), time type (uint8), then the kind specific fields. The driver name follows the
+# sector, lap and live delta structs as UTF-8, lap_start carries the lap best time followed by the best time of every
+# sector.
+EVENT_MAGIC = b"\xc7\x02"
+SECTOR_EVENT, LAP_EVENT, LAP_START_EVENT, LIVE_DELTA_EVENT = 1, 2, 3, 4
+TIME_TYPES = ("yellow", "green", "purple")
+SECTOR_EVENT_STRUCT = struct.Struct("<2sBBHBxd")
+LAP_EVENT_STRUCT = struct.Struct("<2sBBBxxxd")
+LAP_START_EVENT_STRUCT = struct.Struct("<2sBxH")
+LIVE_DELTA_EVENT_STRUCT = struct.Struct("<2sBxxxxxddd")
+JSON_BOOL = {False: b"false", True: b"true"}
+
+
+class EventEncoder:
+    """
+    Encodes the sector, lap and lap_start events of the LapTimer. Topic prefixes and payload templates are built once,
+    per event only the numbers are filled in. The JSON output is identical to json.dumps of the former payload dicts.
+    """
+
+    def __init__(self, p_topics: dict, p_number_of_sectors: int, p_binary: bool = False) -> None:
+        """
+        Args:
+            p_topics: topics of the __pub_time publisher from time_tracking_config.json
+            p_number_of_sectors: number of sectors of a lap
+            p_binary: use the binary payloads instead of JSON
+        """
+        self.__binary = p_binary
+        self.__sector_prefix = f"{p_topics['sector:finished']} ".encode()
+        self.__lap_prefix = f"{p_topics['lap_finished']} ".encode()
+        self.__lap_start_prefix = f"{p_topics['lap_start']} ".encode()
+        self.__live_delta_prefix = f"{p_topics.get('live_delta', 'live_delta')} ".encode()
+        self.__driver: str | None = ""
+        self.__driver_json = b'""'
+        self.__driver_utf8 = b""
+
+        self.__sector_template = (
+            b'{"current_driver": %s, "sector_number": %d, "sector_time": %s, "sector_valid": %s, "type": "%s"}'
+        )
+        self.__lap_template = b'{"current_driver": %s, "lap_time": %s, "lap_valid": %s, "type": "%s"}'
+        self.__live_delta_template = (
+            b'{"current_driver": %s, "delta": %s, "lap_progress": %s, "reference_lap_time": %s}'
+        )
+        sector_fields = ", ".join(f'"sector_{sector}_best_time": %s' for sector in range(1, p_number_of_sectors + 1))
+        self.__lap_start_template = ("{" + sector_fields + ', "lap_best_time": %s}').encode()
+        self.__lap_start_struct = struct.Struct(f"<{p_number_of_sectors + 1}d")
+        self.__number_of_sectors = p_number_of_sectors
+
+    def __set_driver(self, p_driver: str | None) -> None:
+        if p_driver != self.__driver:
+            self.__driver = p_driver
+            self.__driver_json = json.dumps(p_driver).encode()
+            self.__driver_utf8 = b"" if p_driver is None else p_driver.encode()
+
+    def sector(self, p_driver: str | None, p_sector: int, p_time: float, p_valid: bool, p_type: str) -> bytes:
+        self.__set_driver(p_driver)
+        if self.__binary:
+            type_code = TIME_TYPES.index(p_type)
+            payload = SECTOR_EVENT_STRUCT.pack(EVENT_MAGIC, SECTOR_EVENT, type_code, p_sector, p_valid, p_time)
+            return self.__sector_prefix + payload + self.__driver_utf8
+        values = (self.__driver_json, p_sector, repr(p_time).encode(), JSON_BOOL[p_valid], p_type.encode())
+        return self.__sector_prefix + self.__sector_template % values
+
+    def lap(self, p_driver: str | None, p_time: float, p_valid: bool, p_type: str) -> bytes:
+        self.__set_driver(p_driver)
+        if self.__binary:
+            type_code = TIME_TYPES.index(p_type)
+            payload = LAP_EVENT_STRUCT.pack(EVENT_MAGIC, LAP_EVENT, type_code, p_valid, p_time)
+            return self.__lap_prefix + payload + self.__driver_utf8
+        values = (self.__driver_json, repr(p_time).encode(), JSON_BOOL[p_valid], p_type.encode())
+        return self.__lap_prefix + self.__lap_template % values
+
+    def live_delta(self, p_driver: str | None, p_delta: float, p_progress: float, p_reference_lap_time: float) -> bytes:
+        """
+        Args:
+            p_driver: current driver
+            p_delta: seconds behind the reference lap at the same point of the lap, negative if ahead
+            p_progress: fraction of the reference lap driven
+            p_reference_lap_time: lap time of the reference lap
+        """
+        self.__set_driver(p_driver)
+        if self.__binary:
+            payload = LIVE_DELTA_EVENT_STRUCT.pack(
+                EVENT_MAGIC, LIVE_DELTA_EVENT, p_delta, p_progress, p_reference_lap_time
+            )
+            return self.__live_delta_prefix + payload + self.__driver_utf8
+        values = (
+            self.__driver_json,
+            repr(p_delta).encode(),
+            repr(p_progress).encode(),
+            repr(p_reference_lap_time).encode(),
+        )
+        return self.__live_delta_prefix + self.__live_delta_template % values
+
+    def lap_start(self, p_best_times) -> bytes:
+        """
+        Args:
+            p_best_times: all-time best times indexed by sector number, the lap at index 0
+        """
+        if self.__binary:
+            header = LAP_START_EVENT_STRUCT.pack(EVENT_MAGIC, LAP_START_EVENT, self.__number_of_sectors)
+            return self.__lap_start_prefix + header + self.__lap_start_struct.pack(*p_best_times)
+        best_times = [repr(float(best_time)).encode() for best_time in p_best_times]
+        values = tuple(best_times[1:]) + (best_times[0],)
+        return self.__lap_start_prefix + self.__lap_start_template % values
+
+
+def decode_binary_event(p_msg: bytes) -> tuple:
+    """
+    decodes a binary event published by the EventEncoder, for subscribers and tests
+    Args:
+        p_msg: received message including the topic
+    Returns:
+        (topic, dict with the same fields as the JSON payload)
+    """
+    i = p_msg.find(b" ")
+    topic = p_msg[:i].decode()
+    offset = i + 1
+    magic, kind, type_code = struct.unpack_from("<2sBB", p_msg, offset)
+    if magic != EVENT_MAGIC:
+        raise ValueError("Not a binary event")
+    if kind == SECTOR_EVENT:
+        _, _, _, sector, valid, sector_time = SECTOR_EVENT_STRUCT.unpack_from(p_msg, offset)
+        driver = p_msg[offset + SECTOR_EVENT_STRUCT.size :].decode()
+        return topic, {
+            "current_driver": driver,
+            "sector_number": sector,
+            "sector_time": sector_time,
+            "sector_valid": bool(valid),
+            "type": TIME_TYPES[type_code],
+        }
+    if kind == LAP_EVENT:
+        _, _, _, valid, lap_time = LAP_EVENT_STRUCT.unpack_from(p_msg, offset)
+        driver = p_msg[offset + LAP_EVENT_STRUCT.size :].decode()
+        return topic, {
+            "current_driver": driver,
+            "lap_time": lap_time,
+            "lap_valid": bool(valid),
+            "type": TIME_TYPES[type_code],
+        }
+    if kind == LIVE_DELTA_EVENT:
+        _, _, delta, progress, reference_lap_time = LIVE_DELTA_EVENT_STRUCT.unpack_from(p_msg, offset)
+        driver = p_msg[offset + LIVE_DELTA_EVENT_STRUCT.size :].decode()
+        return topic, {
+            "current_driver": driver,
+            "delta": delta,
+            "lap_progress": progress,
+            "reference_lap_time": reference_lap_time,
+        }
+    _, _, number_of_sectors = LAP_START_EVENT_STRUCT.unpack_from(p_msg, offset)
+    best_times = struct.unpack_from(f"<{number_of_sectors + 1}d", p_msg, offset + LAP_START_EVENT_STRUCT.size)
+    result = {f"sector_{sector}_best_time": best_times[sector] for sector in range(1, number_of_sectors + 1)}
+    result["lap_best_time"] = best_times[0]
+    return topic, result
+
+
+# Lap trajectory payload on the lap_trajectory topic, always binary: magic (2 bytes), version (uint8), lap valid
+# (uint8), number of samples (uint32), lap time (float64, s), time unit (uint32, ns), position units per pixel (uint16),
+# length of the driver name (uint16), then the driver name as UTF-8 and the zlib compressed samples. The sample times
+# (relative to the lap start) and positions are quantized to the units first and then stored as deltas, three int32
+# columns t, x, y with the first value of each column absolute, so the rounding error does not accumulate.
+TRAJECTORY_MAGIC = b"\xc7\x04"
+TRAJECTORY_VERSION = 1
+TRAJECTORY_HEADER_STRUCT = struct.Struct("<2sBBIdIHH")
+TRAJECTORY_TIME_UNIT_NS = 100_000
+TRAJECTORY_POSITION_UNITS = 16
+
+
+def encode_lap_trajectory(
+    p_topic: str,
+    p_driver: str | None,
+    p_lap_time: float,
+    p_valid: bool,
+    p_times_ns: np.ndarray,
+    p_positions: np.ndarray,
+    p_level: int = 6,
+) -> bytes:
+    """
+    builds the lap_trajectory message of a finished lap
+    Args:
+        p_topic: topic the message is published on
+        p_driver: driver of the lap
+        p_lap_time: lap time in seconds
+        p_valid: if the lap was driven valid
+        p_times_ns: (N,) array of the sample times since the start of the lap in nanoseconds
+        p_positions: (N, 2) array of the sample positions in pixels
+        p_level: zlib compression level
+    Returns:
+        bytes
+    """
+    count = len(p_times_ns)
+    samples = np.empty((3, count), dtype=np.int64)
+    samples[0] = (p_times_ns + TRAJECTORY_TIME_UNIT_NS // 2) // TRAJECTORY_TIME_UNIT_NS
+    samples[1:] = np.rint(p_positions.T * TRAJECTORY_POSITION_UNITS)
+    deltas = np.diff(samples, axis=1, prepend=0).astype("<i4")
+    driver = b"" if p_driver is None else p_driver.encode()
+    header = TRAJECTORY_HEADER_STRUCT.pack(
+        TRAJECTORY_MAGIC,
+        TRAJECTORY_VERSION,
+        p_valid,
+        count,
+        p_lap_time,
+        TRAJECTORY_TIME_UNIT_NS,
+        TRAJECTORY_POSITION_UNITS,
+        len(driver),
+    )
+    return p_topic.encode() + b" " + header + driver + zlib.compress(deltas.tobytes(), p_level)
+
+
+def decode_lap_trajectory(p_msg: bytes) -> tuple:
+    """
+    decodes a lap_trajectory message, for subscribers and tests
+    Args:
+        p_msg: received message including the topic
+    Returns:
+        (topic, dict with current_driver, lap_time, lap_valid, times_ns (N,) int64 array of the sample times since the
+        start of the lap and positions (N, 2) float64 array)
+    """
+    i = p_msg.find(b" ")
+    topic = p_msg[:i].decode()
+    offset = i + 1
+    (
+        magic,
+        version,
+        valid,
+        count,
+        lap_time,
+        time_unit_ns,
+        position_units,
+        driver_length,
+    ) = TRAJECTORY_HEADER_STRUCT.unpack_from(p_msg, offset)
+    if magic != TRAJECTORY_MAGIC:
+        raise ValueError("Not a lap trajectory")
+    if version != TRAJECTORY_VERSION:
+        raise ValueError(f"Unsupported lap trajectory version {version}")
+    offset += TRAJECTORY_HEADER_STRUCT.size
+    driver = bytes(p_msg[offset : offset + driver_length]).decode()
+    deltas = np.frombuffer(zlib.decompress(p_msg[offset + driver_length :]), dtype="<i4").reshape(3, count)
+    samples = np.cumsum(deltas, axis=1, dtype=np.int64)
+    return topic, {
+        "current_driver": driver,
+        "lap_time": lap_time,
+        "lap_valid": bool(valid),
+        "times_ns": samples[0] * time_unit_ns,
+        "positions": samples[1:].T / position_units,
+    }
+
+
+# Optional frame header in front of the pixel payload on the frame stream:
+# magic (2 bytes), version (uint8), dtype code (uint8), width (uint16), height (uint16), channels (uint8), padding,
+# frame index (uint32), capture timestamp (int64, ns). Frames without the magic are raw pixels of a configured size.
+FRAME_MAGIC = b"\xc7\x03"
+FRAME_VERSION = 1
+FRAME_HEADER_STRUCT = struct.Struct("<2sBBHHBxxxIq")
+FRAME_DTYPES = {1: "uint8", 2: "uint16", 3: "float32"}
+
+
+def decode_frame_header(p_msg) -> tuple | None:
+    """
+    reads the frame header without touching the pixel payload
+    Args:
+        p_msg: received frame message
+    Returns:
+        ((height, width, channels), dtype name, frame index, capture timestamp in ns, offset of the pixels) or None if
+        the frame has no header
+    """
+    if len(p_msg) < FRAME_HEADER_STRUCT.size or p_msg[:2] != FRAME_MAGIC:
+        return None
+    _, version, dtype_code, width, height, channels, index, timestamp_ns = FRAME_HEADER_STRUCT.unpack_from(p_msg)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported frame header version {version}")
+    return (height, width, channels), FRAME_DTYPES[dtype_code], index, timestamp_ns, FRAME_HEADER_STRUCT.size
+
+
+def encode_frame_header(p_shape: tuple, p_dtype: str, p_index: int, p_timestamp_ns: int) -> bytes:
+    """
+    builds the header the vehicle tracking puts in front of the pixels of a frame
+    Args:
+        p_shape: (height, width, channels) of the frame
+        p_dtype: dtype name of the pixels, one of FRAME_DTYPES
+        p_index: running number of the frame
+        p_timestamp_ns: capture timestamp, integer nanoseconds of time.monotonic_ns()
+    Returns:
+        bytes
+    """
+    dtype_code = next(code for code, name in FRAME_DTYPES.items() if name == p_dtype)
+    height, width, channels = p_shape
+    return FRAME_HEADER_STRUCT.pack(
+        FRAME_MAGIC, FRAME_VERSION, dtype_code, width, height, channels, p_index, p_timestamp_ns
+    )